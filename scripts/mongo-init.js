@@ -72,38 +72,7 @@ db.createCollection('municipality_boundaries');
 db.createCollection('notifications');
 db.createCollection('notification_preferences');
 
-// Create indexes for performance
-db.users.createIndex({ email: 1 }, { unique: true });
-db.users.createIndex({ municipality_id: 1 });
-db.users.createIndex({ role: 1 });
-db.users.createIndex({ created_at: -1 });
-
-db.municipalities.createIndex({ name: 1 });
-db.municipalities.createIndex({ admin_id: 1 });
-
-db.tickets.createIndex({ municipality_id: 1 });
-db.tickets.createIndex({ status: 1 });
-db.tickets.createIndex({ citizen_id: 1 });
-db.tickets.createIndex({ assigned_operator_id: 1 });
-db.tickets.createIndex({ created_at: -1 });
-db.tickets.createIndex({ 'location.coordinates': '2dsphere' });
-
-db.ticket_comments.createIndex({ ticket_id: 1 });
-db.ticket_comments.createIndex({ created_at: -1 });
-
-db.ticket_feedback.createIndex({ ticket_id: 1 }, { unique: true });
-db.ticket_feedback.createIndex({ citizen_id: 1 });
-
-db.media_files.createIndex({ ticket_id: 1 });
-db.media_files.createIndex({ uploaded_by: 1 });
-db.media_files.createIndex({ upload_date: -1 });
-
-db.municipality_boundaries.createIndex({ municipality_id: 1 }, { unique: true });
-
-db.notifications.createIndex({ user_id: 1 });
-db.notifications.createIndex({ created_at: -1 });
-db.notifications.createIndex({ read: 1 });
-
-db.notification_preferences.createIndex({ user_id: 1 }, { unique: true });
+// Indexes are declared by each service (INDEXES in src/<Service>/src/database.py)
+// and reconciled in the background at service startup.
 
 print('CityFix database initialized successfully!');
@@ -2,18 +2,66 @@
 Database connection for service
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import IndexModel
+from bson import ObjectId
+from datetime import datetime
 from pymongo.errors import ConnectionFailure
+import asyncio
 import logging
 from .config import settings
+from .utils.indexes import reconcile_indexes
 
 logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    index_task: asyncio.Task = None
 
 db_instance = Database()
 
+INDEXES = {
+    "municipalities": [
+        IndexModel([("name", 1)]),
+        IndexModel([("admin_id", 1)])
+    ],
+    "statistics_rollups": [
+        IndexModel([("scope", 1)])
+    ],
+    "kpi_buckets": [
+        IndexModel([("granularity", 1), ("municipality_id", 1), ("period_start", 1)]),
+        IndexModel([("granularity", 1), ("period_start", 1)]),
+        IndexModel([("granularity", 1), ("updated_at", 1)])
+    ],
+    "jobs": [
+        IndexModel([("state", 1), ("available_at", 1)]),
+        IndexModel([("type", 1), ("created_at", -1)]),
+        IndexModel([("created_at", -1)])
+    ]
+}
+
+QUERY_SHAPES = [
+    {
+        "name": "kpi_buckets_by_municipality",
+        "collection": "kpi_buckets",
+        "filter": {
+            "granularity": "day",
+            "municipality_id": ObjectId(),
+            "period_start": {"$gte": datetime(2026, 1, 1), "$lt": datetime(2026, 2, 1)}
+        }
+    },
+    {
+        "name": "jobs_claimable",
+        "collection": "jobs",
+        "filter": {
+            "state": {"$in": ["queued", "running"]},
+            "available_at": {"$lte": datetime(2026, 1, 1)},
+            "pause_requested": False
+        },
+        "sort": [("available_at", 1)]
+    }
+]
+
 async def connect_db():
     try:
         logger.info(f"Connecting to MongoDB...")
@@ -31,6 +79,8 @@ async def connect_db():
         raise
 
 async def close_db():
+    if db_instance.index_task and not db_instance.index_task.done():
+        db_instance.index_task.cancel()
     if db_instance.client:
         db_instance.client.close()
         logger.info("MongoDB connection closed")
@@ -41,6 +91,7 @@ async def get_database() -> AsyncIOMotorDatabase:
 async def init_database():
     try:
         db = await get_database()
+        db_instance.index_task = asyncio.create_task(reconcile_indexes(db, INDEXES))
         logger.info("Database initialized")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
@@ -9,8 +9,14 @@ import logging
 import sys
 
 from .config import settings
-from .database import connect_db, close_db, init_database
-from .routes import municipalities, categories, statistics
+from .database import connect_db, close_db, init_database, get_database, QUERY_SHAPES
+from .utils.indexes import explain_query_shapes
+from .utils.serialization import MongoJSONResponse
+from .routes import municipalities, categories, statistics, jobs
+from .services.cache import response_cache
+from .services.jobs import job_runner
+from .services.kpis import kpi_compactor
+from .services.statistics import statistics_reconciler
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,9 +31,17 @@ async def lifespan(app: FastAPI):
     logger.info(f"Starting {settings.SERVICE_NAME}...")
     await connect_db()
     await init_database()
+    await statistics_reconciler.start(await get_database())
+    await kpi_compactor.start(await get_database())
+    await response_cache.start(await get_database())
+    await job_runner.start(await get_database())
     logger.info(f"{settings.SERVICE_NAME} started successfully on port {settings.SERVICE_PORT}")
     yield
     logger.info(f"Shutting down {settings.SERVICE_NAME}...")
+    await job_runner.stop()
+    await response_cache.stop()
+    await kpi_compactor.stop()
+    await statistics_reconciler.stop()
     await close_db()
 
 app = FastAPI(
@@ -36,6 +50,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=MongoJSONResponse,
     lifespan=lifespan
 )
 
@@ -50,6 +65,7 @@ app.add_middleware(
 app.include_router(municipalities.router, prefix="/api/v1/municipalities", tags=["Municipalities"])
 app.include_router(categories.router, prefix="/api/v1/categories", tags=["Categories"])
 app.include_router(statistics.router, prefix="/api/v1/statistics", tags=["Statistics"])
+app.include_router(jobs.router, prefix="/api/v1/jobs", tags=["Jobs"])
 
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def health_check():
@@ -59,6 +75,10 @@ async def health_check():
 async def root():
     return {"service": settings.SERVICE_NAME, "version": "1.0.0", "docs": "/docs"}
 
+@app.get("/diagnostics/query-plans")
+async def query_plans():
+    return await explain_query_shapes(await get_database(), QUERY_SHAPES)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=settings.SERVICE_PORT, reload=settings.ENVIRONMENT == "development")
@@ -1,20 +1,25 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
 from ..database import get_database
+from ..services.cache import response_cache
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
 from datetime import datetime
+from typing import Optional
 
 router = APIRouter()
 
 @router.post("/")
 async def create_category(category_data: dict, db=Depends(get_database)):
     category_data["created_at"] = datetime.utcnow()
-    result = await db.maintenance_categories.insert_one(category_data)
-    return {"id": str(result.inserted_id), **category_data}
+    await db.maintenance_categories.insert_one(category_data)
+    response_cache.invalidate("categories")
+    return MongoJSONResponse(with_id(category_data))
 
 @router.get("/")
-async def get_categories(db=Depends(get_database)):
-    categories = []
-    async for cat in db.maintenance_categories.find():
-        cat["id"] = str(cat.pop("_id"))
-        categories.append(cat)
-    return categories
+async def get_categories(if_none_match: Optional[str] = Header(None), db=Depends(get_database)):
+    async def load():
+        categories = []
+        async for cat in db.maintenance_categories.find():
+            categories.append(with_id(cat))
+        return categories
+    return await response_cache.respond("categories", load, if_none_match)
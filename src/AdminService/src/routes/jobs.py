@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from ..database import get_database
+from ..services.jobs import JOB_STATES, job_runner
+from ..utils.serialization import MongoJSONResponse, with_id
+from bson import ObjectId
+from datetime import datetime
+from typing import Optional
+
+router = APIRouter()
+
+def parse_job_id(job_id: str) -> ObjectId:
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ObjectId(job_id)
+
+async def find_job(db, job_id: ObjectId) -> dict:
+    job = await db.jobs.find_one({"_id": job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/")
+async def list_jobs(
+    state: Optional[str] = None,
+    type: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db=Depends(get_database)
+):
+    if state and state not in JOB_STATES:
+        raise HTTPException(status_code=400, detail=f"state must be one of {', '.join(JOB_STATES)}")
+    query = {}
+    if state:
+        query["state"] = state
+    if type:
+        query["type"] = type
+    jobs = await db.jobs.find(query).sort("created_at", -1).limit(limit).to_list(length=limit)
+    return MongoJSONResponse([with_id(job) for job in jobs])
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, db=Depends(get_database)):
+    return MongoJSONResponse(with_id(await find_job(db, parse_job_id(job_id))))
+
+@router.post("/{job_id}/pause")
+async def pause_job(job_id: str, db=Depends(get_database)):
+    job_id = parse_job_id(job_id)
+    now = datetime.utcnow()
+    # Queued jobs park at once; running ones stop at their next checkpoint.
+    result = await db.jobs.update_one(
+        {"_id": job_id, "state": "queued"},
+        {"$set": {"state": "paused", "updated_at": now}}
+    )
+    if not result.matched_count:
+        result = await db.jobs.update_one(
+            {"_id": job_id, "state": "running"},
+            {"$set": {"pause_requested": True, "updated_at": now}}
+        )
+    if not result.matched_count:
+        job = await find_job(db, job_id)
+        if job["state"] != "paused":
+            raise HTTPException(status_code=409, detail=f"Cannot pause a {job['state']} job")
+    return MongoJSONResponse(with_id(await find_job(db, job_id)))
+
+@router.post("/{job_id}/resume")
+async def resume_job(job_id: str, db=Depends(get_database)):
+    job_id = parse_job_id(job_id)
+    now = datetime.utcnow()
+    # Progress is kept, so the job picks up from its last checkpoint.
+    result = await db.jobs.update_one(
+        {"_id": job_id, "state": "paused"},
+        {"$set": {"state": "queued", "available_at": now, "updated_at": now}}
+    )
+    if not result.matched_count:
+        result = await db.jobs.update_one(
+            {"_id": job_id, "state": "running", "pause_requested": True},
+            {"$set": {"pause_requested": False, "updated_at": now}}
+        )
+    if not result.matched_count:
+        job = await find_job(db, job_id)
+        if job["state"] not in ("queued", "running"):
+            raise HTTPException(status_code=409, detail=f"Cannot resume a {job['state']} job")
+    job_runner.notify()
+    return MongoJSONResponse(with_id(await find_job(db, job_id)))
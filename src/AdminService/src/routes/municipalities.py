@@ -1,31 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from ..database import get_database
+from ..services.cache import response_cache
+from ..services.jobs import enqueue_job
+from ..services.statistics import increment_global
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
 from datetime import datetime
+from typing import Optional
 
 router = APIRouter()
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_municipality(municipality_data: dict, db=Depends(get_database)):
     municipality_data["created_at"] = datetime.utcnow()
-    result = await db.municipalities.insert_one(municipality_data)
-    return {"id": str(result.inserted_id), **municipality_data}
+    await db.municipalities.insert_one(municipality_data)
+    response_cache.invalidate("municipalities")
+    await increment_global(db, "municipalities.total", 1)
+    return MongoJSONResponse(with_id(municipality_data), status_code=status.HTTP_201_CREATED)
 
 @router.get("/")
-async def get_municipalities(db=Depends(get_database)):
-    municipalities = []
-    async for mun in db.municipalities.find():
-        mun["id"] = str(mun.pop("_id"))
-        municipalities.append(mun)
-    return municipalities
+async def get_municipalities(if_none_match: Optional[str] = Header(None), db=Depends(get_database)):
+    async def load():
+        municipalities = []
+        async for mun in db.municipalities.find():
+            municipalities.append(with_id(mun))
+        return municipalities
+    return await response_cache.respond("municipalities", load, if_none_match)
 
 @router.get("/{municipality_id}")
 async def get_municipality(municipality_id: str, db=Depends(get_database)):
     mun = await db.municipalities.find_one({"_id": ObjectId(municipality_id)})
     if not mun:
         raise HTTPException(status_code=404, detail="Municipality not found")
-    mun["id"] = str(mun.pop("_id"))
-    return mun
+    return MongoJSONResponse(with_id(mun))
 
 @router.put("/{municipality_id}")
 async def update_municipality(municipality_id: str, update_data: dict, db=Depends(get_database)):
@@ -36,11 +43,19 @@ async def update_municipality(municipality_id: str, update_data: dict, db=Depend
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Municipality not found")
+    response_cache.invalidate("municipalities")
     return {"message": "Updated successfully"}
 
-@router.delete("/{municipality_id}")
+@router.delete("/{municipality_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_municipality(municipality_id: str, db=Depends(get_database)):
     result = await db.municipalities.delete_one({"_id": ObjectId(municipality_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Municipality not found")
-    return {"message": "Deleted successfully"}
+    response_cache.invalidate("municipalities")
+    await increment_global(db, "municipalities.total", -1)
+    # Its tickets, users and the rest are removed in batches by a background job.
+    job_id = await enqueue_job(db, "municipality_cascade_delete", {"municipality_id": municipality_id})
+    return MongoJSONResponse(
+        {"message": "Deleted successfully", "job_id": job_id},
+        status_code=status.HTTP_202_ACCEPTED
+    )
@@ -1,16 +1,127 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from ..config import settings
 from ..database import get_database
+from ..services.kpis import (
+    GRANULARITIES,
+    LATENCY_METRICS,
+    compact_kpis,
+    kpi_series,
+    latency_percentiles,
+    max_periods
+)
+from ..services.statistics import GLOBAL_SCOPE, municipality_scope, reconcile_rollups
+from ..utils.serialization import MongoJSONResponse
+from bson import ObjectId
+from datetime import datetime, timedelta
+from typing import Optional
 
 router = APIRouter()
 
 @router.get("/")
 async def get_statistics(db=Depends(get_database)):
-    total_municipalities = await db.municipalities.count_documents({})
-    total_users = await db.users.count_documents({})
-    total_tickets = await db.tickets.count_documents({})
+    rollup = await db.statistics_rollups.find_one({"_id": GLOBAL_SCOPE})
+    if not rollup:
+        await reconcile_rollups(db)
+        rollup = await db.statistics_rollups.find_one({"_id": GLOBAL_SCOPE}) or {}
     
-    return {
-        "total_municipalities": total_municipalities,
-        "total_users": total_users,
-        "total_tickets": total_tickets
-    }
+    tickets = rollup.get("tickets") or {}
+    users = rollup.get("users") or {}
+    return MongoJSONResponse({
+        "total_municipalities": (rollup.get("municipalities") or {}).get("total", 0),
+        "total_users": users.get("total", 0),
+        "total_tickets": tickets.get("total", 0),
+        "tickets_by_status": tickets.get("by_status", {}),
+        "tickets_by_category": tickets.get("by_category", {}),
+        "users_by_role": users.get("by_role", {}),
+        "updated_at": rollup.get("updated_at")
+    })
+
+@router.get("/municipality/{municipality_id}")
+async def get_municipality_statistics(municipality_id: str, db=Depends(get_database)):
+    rollup = await db.statistics_rollups.find_one({"_id": municipality_scope(ObjectId(municipality_id))}) or {}
+    tickets = rollup.get("tickets") or {}
+    return MongoJSONResponse({
+        "municipality_id": municipality_id,
+        "total_tickets": tickets.get("total", 0),
+        "tickets_by_status": tickets.get("by_status", {}),
+        "tickets_by_category": tickets.get("by_category", {}),
+        "updated_at": rollup.get("updated_at")
+    })
+
+@router.post("/reconcile")
+async def reconcile_statistics(db=Depends(get_database)):
+    return await reconcile_rollups(db)
+
+@router.get("/kpis")
+async def get_kpis(
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    municipality_id: Optional[str] = None,
+    category: Optional[str] = None,
+    db=Depends(get_database)
+):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported granularity, expected one of: {', '.join(GRANULARITIES)}"
+        )
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=settings.KPI_DEFAULT_RANGE_DAYS)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if max_periods(start, end, granularity) > settings.KPI_MAX_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Range too large (max {settings.KPI_MAX_PERIODS} periods)")
+    
+    series = await kpi_series(
+        db,
+        granularity,
+        start,
+        end,
+        municipality_id=ObjectId(municipality_id) if municipality_id else None,
+        category=category
+    )
+    return MongoJSONResponse({"granularity": granularity, "series": series})
+
+@router.get("/percentiles")
+async def get_latency_percentiles(
+    metric: str = "resolution",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    quantiles: str = "0.5,0.9,0.99",
+    municipality_id: Optional[str] = None,
+    category: Optional[str] = None,
+    group_by: Optional[str] = None,
+    db=Depends(get_database)
+):
+    if metric not in LATENCY_METRICS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported metric, expected one of: {', '.join(LATENCY_METRICS)}"
+        )
+    if group_by not in (None, "municipality_id", "category"):
+        raise HTTPException(status_code=400, detail="group_by must be municipality_id or category")
+    try:
+        quantile_list = [float(value) for value in quantiles.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid quantiles")
+    if not quantile_list or any(not 0 <= value <= 1 for value in quantile_list):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=settings.KPI_DEFAULT_RANGE_DAYS)
+    
+    results = await latency_percentiles(
+        db,
+        metric,
+        start,
+        end,
+        quantile_list,
+        municipality_id=ObjectId(municipality_id) if municipality_id else None,
+        category=category,
+        group_by=group_by
+    )
+    return MongoJSONResponse({"metric": metric, "start": start, "end": end, "results": results})
+
+@router.post("/kpis/compact")
+async def compact_kpi_buckets(db=Depends(get_database)):
+    return await compact_kpis(db)
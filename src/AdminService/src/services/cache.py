@@ -0,0 +1,147 @@
+"""
+In-process cache of serialized list responses
+"""
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from fastapi.responses import Response
+from pymongo.errors import OperationFailure, PyMongoError
+import asyncio
+import hashlib
+import logging
+import time
+
+from ..config import settings
+from ..utils.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+# Cache key per watched collection.
+CACHED_COLLECTIONS = {
+    "municipalities": "municipalities",
+    "maintenance_categories": "categories"
+}
+
+@dataclass
+class CachedBody:
+    body: bytes
+    etag: str
+    stored_at: float
+
+def body_etag(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+class ResponseCache:
+    """
+    Holds the JSON bytes and ETag of whole list responses.
+    
+    Local writes invalidate directly; a change stream on the cached
+    collections invalidates writes made through other replicas. Without
+    change streams (standalone MongoDB) entries expire after
+    CACHE_FALLBACK_TTL_SECONDS instead, which bounds cross-replica staleness.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._entries: dict[str, CachedBody] = {}
+        self._loading: dict[str, asyncio.Future] = {}
+        self._generations: dict[str, int] = {}
+        self.coherent = False
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._watch())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.coherent = False
+        self._entries.clear()
+    
+    def invalidate(self, *keys: str):
+        # A full invalidation also covers keys that are loading right now.
+        for key in keys or {*self._entries, *self._loading}:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+    
+    def _fresh(self, entry: CachedBody) -> bool:
+        return self.coherent or time.monotonic() - entry.stored_at < settings.CACHE_FALLBACK_TTL_SECONDS
+    
+    async def get(self, key: str, loader: Callable[[], Awaitable[object]]) -> CachedBody:
+        entry = self._entries.get(key)
+        if entry and self._fresh(entry):
+            return entry
+        # Concurrent misses share one load.
+        if key in self._loading:
+            return await asyncio.shield(self._loading[key])
+        
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        generation = self._generations.get(key, 0)
+        try:
+            body = dumps(await loader())
+            entry = CachedBody(body, body_etag(body), time.monotonic())
+            # A write that landed during the load leaves this result stale.
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = entry
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved so an unawaited failure is not logged twice.
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._loading[key]
+    
+    async def respond(self, key: str, loader: Callable[[], Awaitable[object]], if_none_match: Optional[str]) -> Response:
+        entry = await self.get(key, loader)
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, entry.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+    
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(CACHED_COLLECTIONS)}}}]
+        while True:
+            try:
+                async with self._db.watch(pipeline) as stream:
+                    # Anything cached before the stream opened may have missed events.
+                    self.invalidate()
+                    self.coherent = True
+                    logger.info("Response cache change stream opened")
+                    async for change in stream:
+                        key = CACHED_COLLECTIONS.get((change.get("ns") or {}).get("coll"))
+                        if key:
+                            self.invalidate(key)
+                        else:
+                            self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.coherent = False
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams require a replica set, response cache falls back to TTL expiry")
+                    return
+                logger.error(f"Response cache change stream failed: {str(e)}")
+            except PyMongoError as e:
+                self.coherent = False
+                logger.error(f"Response cache change stream interrupted: {str(e)}")
+            self.invalidate()
+            await asyncio.sleep(settings.CACHE_RETRY_SECONDS)
+
+response_cache = ResponseCache()
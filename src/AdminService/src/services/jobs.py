@@ -0,0 +1,285 @@
+"""
+Mongo-backed background jobs
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+import asyncio
+import httpx
+import logging
+import uuid
+
+from ..config import settings
+from .statistics import reconcile_rollups
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ("queued", "running", "paused", "completed", "failed")
+
+class JobInterrupted(Exception):
+    """The job was paused or its lease was taken over; stop without failing it."""
+
+def new_job(job_type: str, params: dict, now: datetime) -> dict:
+    return {
+        "type": job_type,
+        "params": params,
+        "state": "queued",
+        "pause_requested": False,
+        "attempts": 0,
+        "progress": {"step": 0, "last_id": None, "deleted": {}, "totals": {}},
+        "available_at": now,
+        "created_at": now,
+        "updated_at": now
+    }
+
+async def enqueue_job(db, job_type: str, params: dict) -> ObjectId:
+    job = new_job(job_type, params, datetime.utcnow())
+    result = await db.jobs.insert_one(job)
+    job_runner.notify()
+    return result.inserted_id
+
+class JobContext:
+    """
+    Handed to job handlers. Every checkpoint persists progress and renews
+    the lease in one conditional update, so a handler that resumes after a
+    crash or a pause continues from the last completed batch.
+    """
+    def __init__(self, db, job: dict, worker_id: str, http: httpx.AsyncClient):
+        self.db = db
+        self.job = job
+        self.worker_id = worker_id
+        self.http = http
+    
+    @property
+    def progress(self) -> dict:
+        return self.job["progress"]
+    
+    async def checkpoint(self, step: int, last_id=None, deleted: Optional[dict] = None, totals: Optional[dict] = None):
+        now = datetime.utcnow()
+        update = {"$set": {
+            "progress.step": step,
+            "progress.last_id": last_id,
+            "available_at": now + timedelta(seconds=settings.JOBS_LEASE_SECONDS),
+            "updated_at": now
+        }}
+        if totals:
+            update["$set"].update({f"progress.totals.{name}": count for name, count in totals.items()})
+        if deleted:
+            update["$inc"] = {f"progress.deleted.{name}": count for name, count in deleted.items() if count}
+        job = await self.db.jobs.find_one_and_update(
+            {"_id": self.job["_id"], "state": "running", "worker_id": self.worker_id, "pause_requested": False},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            raise JobInterrupted()
+        self.job = job
+        await asyncio.sleep(settings.JOBS_BATCH_PAUSE_SECONDS)
+
+async def delete_media(ctx: JobContext, media_ids: list[ObjectId]):
+    # Through MediaService, so stored files are removed with their metadata.
+    limit = asyncio.Semaphore(settings.JOBS_HTTP_CONCURRENCY)
+    
+    async def delete_one(media_id: ObjectId):
+        async with limit:
+            response = await ctx.http.delete(f"/api/v1/media/files/{media_id}")
+            if response.status_code != 404:
+                response.raise_for_status()
+    
+    await asyncio.gather(*(delete_one(media_id) for media_id in media_ids))
+
+async def cascade_tickets(ctx: JobContext, municipality_id: ObjectId, last_id) -> tuple[Optional[ObjectId], dict]:
+    query = {"municipality_id": municipality_id}
+    if last_id:
+        query["_id"] = {"$gt": last_id}
+    batch = await ctx.db.tickets.find(query, {"_id": 1}).sort("_id", 1).limit(
+        settings.JOBS_BATCH_SIZE
+    ).to_list(length=settings.JOBS_BATCH_SIZE)
+    ticket_ids = [ticket["_id"] for ticket in batch]
+    if not ticket_ids:
+        return None, {}
+    
+    media_ids = await ctx.db.media_files.distinct("_id", {"ticket_id": {"$in": ticket_ids}})
+    await delete_media(ctx, media_ids)
+    comments = await ctx.db.ticket_comments.delete_many({"ticket_id": {"$in": ticket_ids}})
+    feedback = await ctx.db.ticket_feedback.delete_many({"ticket_id": {"$in": ticket_ids}})
+    await ctx.db.ticket_outbox.delete_many({"_id": {"$in": ticket_ids}})
+    tickets = await ctx.db.tickets.delete_many({"_id": {"$in": ticket_ids}, "municipality_id": municipality_id})
+    return ticket_ids[-1], {
+        "tickets": tickets.deleted_count,
+        "ticket_comments": comments.deleted_count,
+        "ticket_feedback": feedback.deleted_count,
+        "media_files": len(media_ids)
+    }
+
+async def cascade_users(ctx: JobContext, municipality_id: ObjectId, last_id) -> tuple[Optional[ObjectId], dict]:
+    query = {"municipality_id": municipality_id}
+    if last_id:
+        query["_id"] = {"$gt": last_id}
+    batch = await ctx.db.users.find(query, {"_id": 1}).sort("_id", 1).limit(
+        settings.JOBS_BATCH_SIZE
+    ).to_list(length=settings.JOBS_BATCH_SIZE)
+    if not batch:
+        return None, {}
+    result = await ctx.db.users.delete_many({
+        "municipality_id": municipality_id,
+        "_id": {"$gte": batch[0]["_id"], "$lte": batch[-1]["_id"]}
+    })
+    return batch[-1]["_id"], {"users": result.deleted_count}
+
+def delete_all(collection: str, field: str = "municipality_id"):
+    async def step(ctx: JobContext, municipality_id: ObjectId, last_id) -> tuple[None, dict]:
+        result = await ctx.db[collection].delete_many({field: municipality_id})
+        return None, {collection: result.deleted_count}
+    return step
+
+# Children before parents: tickets take their comments, feedback and media
+# with them, batch by batch. ticket_events may be a time-series collection,
+# which only supports deletes on its metaField (municipality_id).
+CASCADE_STEPS = [
+    cascade_tickets,
+    delete_all("ticket_events"),
+    cascade_users,
+    delete_all("municipality_boundaries"),
+    delete_all("kpi_buckets"),
+    delete_all("satisfaction_scores")
+]
+
+async def run_municipality_cascade(ctx: JobContext):
+    municipality_id = ObjectId(ctx.job["params"]["municipality_id"])
+    if not ctx.progress.get("totals"):
+        await ctx.checkpoint(0, totals={
+            "tickets": await ctx.db.tickets.count_documents({"municipality_id": municipality_id}),
+            "users": await ctx.db.users.count_documents({"municipality_id": municipality_id})
+        })
+    
+    step = ctx.progress["step"]
+    last_id = ctx.progress.get("last_id")
+    while step < len(CASCADE_STEPS):
+        last_id, deleted = await CASCADE_STEPS[step](ctx, municipality_id, last_id)
+        if last_id is None:
+            step += 1
+        await ctx.checkpoint(step, last_id, deleted)
+    
+    # Recounting drops the municipality's rollup and fixes the global totals.
+    await reconcile_rollups(ctx.db)
+
+JOB_HANDLERS = {
+    "municipality_cascade_delete": run_municipality_cascade
+}
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(settings.JOBS_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), 3600))
+
+class JobRunner:
+    """
+    Worker coroutines claiming jobs from the jobs collection. A running
+    job's available_at doubles as its lease: checkpoints push it forward,
+    and a job whose worker died becomes claimable again once it lapses.
+    """
+    def __init__(self):
+        self._db = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+    
+    async def start(self, db):
+        self._db = db
+        self._http = httpx.AsyncClient(base_url=settings.MEDIA_SERVICE_URL, timeout=30.0)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(settings.JOBS_WORKERS)]
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http:
+            await self._http.aclose()
+            self._http = None
+    
+    def notify(self):
+        self._wakeup.set()
+    
+    async def _work(self):
+        worker_id = uuid.uuid4().hex
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self.claim(worker_id)
+                if job:
+                    await self.run(job, worker_id)
+                    continue
+            except Exception as e:
+                # A worker that dies here would stall the queue for good.
+                logger.exception(f"Job worker error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOBS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        # A worker that died after a pause request never reaches its next
+        # checkpoint; park such jobs once their lease lapses.
+        await self._db.jobs.update_many(
+            {"state": "running", "available_at": {"$lte": now}, "pause_requested": True},
+            {"$set": {"state": "paused", "pause_requested": False, "updated_at": now}}
+        )
+        return await self._db.jobs.find_one_and_update(
+            {"state": {"$in": ["queued", "running"]}, "available_at": {"$lte": now}, "pause_requested": False},
+            {
+                "$set": {
+                    "state": "running",
+                    "worker_id": worker_id,
+                    "available_at": now + timedelta(seconds=settings.JOBS_LEASE_SECONDS),
+                    "started_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def run(self, job: dict, worker_id: str):
+        handler = JOB_HANDLERS.get(job["type"])
+        owned = {"_id": job["_id"], "worker_id": worker_id, "state": "running"}
+        try:
+            if not handler:
+                raise ValueError(f"Unknown job type {job['type']!r}")
+            await handler(JobContext(self._db, job, worker_id, self._http))
+        except JobInterrupted:
+            # Paused jobs park here; a lost lease means another worker owns it.
+            await self._db.jobs.update_one(
+                {**owned, "pause_requested": True},
+                {"$set": {"state": "paused", "pause_requested": False, "updated_at": datetime.utcnow()}}
+            )
+            return
+        except Exception as e:
+            # Database and MediaService errors are retried; anything else is a
+            # bug or bad data that another attempt would hit again.
+            now = datetime.utcnow()
+            transient = isinstance(e, (PyMongoError, httpx.HTTPError))
+            failed = job["attempts"] >= settings.JOBS_MAX_ATTEMPTS or not transient
+            if transient:
+                logger.error(f"Job {job['_id']} attempt {job['attempts']} failed: {str(e)}")
+            else:
+                logger.exception(f"Job {job['_id']} failed: {str(e)}")
+            await self._db.jobs.update_one(owned, {"$set": {
+                "state": "failed" if failed else "queued",
+                "error": str(e) if transient else f"{type(e).__name__}: {e}",
+                "available_at": now + retry_delay(job["attempts"]),
+                "updated_at": now
+            }})
+            return
+        
+        now = datetime.utcnow()
+        await self._db.jobs.update_one(owned, {"$set": {
+            "state": "completed",
+            "completed_at": now,
+            "updated_at": now
+        }})
+
+job_runner = JobRunner()
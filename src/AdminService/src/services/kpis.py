@@ -0,0 +1,309 @@
+"""
+KPI time series over daily ticket buckets
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
+
+from ..config import settings
+from .sketches import sketch_quantile, sketch_quantiles
+from .statistics import rollup_key
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("day", "week", "month")
+MIN_PERIOD_DAYS = {"day": 1, "week": 7, "month": 28}
+COUNTER_FIELDS = ("opened", "resolved", "resolution_seconds_sum", "responded", "response_seconds_sum")
+NESTED_COUNTER_FIELDS = ("entered", "resolution_sketch", "response_sketch")
+LATENCY_METRICS = {
+    "resolution": ("resolved", "resolution_seconds_sum", "resolution_sketch"),
+    "response": ("responded", "response_seconds_sum", "response_sketch")
+}
+
+def to_day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def period_start(day: datetime, granularity: str) -> datetime:
+    day = to_day(day)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def period_end(start: datetime, granularity: str) -> datetime:
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+def max_periods(start: datetime, end: datetime, granularity: str) -> int:
+    return (end - period_start(start, granularity)).days // MIN_PERIOD_DAYS[granularity] + 1
+
+def add_counters(total: dict, bucket: dict):
+    for field in COUNTER_FIELDS:
+        total[field] = total.get(field, 0) + (bucket.get(field) or 0)
+    for field in NESTED_COUNTER_FIELDS:
+        nested = total.setdefault(field, Counter())
+        nested.update(bucket.get(field) or {})
+
+def summarize(start: datetime, total: dict) -> dict:
+    resolved = total.get("resolved", 0)
+    return {
+        "period_start": start,
+        "opened": total.get("opened", 0),
+        "resolved": resolved,
+        "entered": dict(total.get("entered") or {}),
+        "mean_resolution_seconds": total["resolution_seconds_sum"] / resolved if resolved else None,
+        "median_resolution_seconds": sketch_quantile(total.get("resolution_sketch") or {}, 0.5)
+    }
+
+async def compaction_state(db) -> dict:
+    return await db.kpi_compaction.find_one({"_id": "state"}) or {}
+
+async def kpi_series(
+    db,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    municipality_id=None,
+    category: Optional[str] = None
+) -> list[dict]:
+    """
+    One entry per period overlapping [start, end), keyed by the aligned
+    period start. Compacted weeks and months are used only for periods
+    entirely inside the range and before the last compaction; partial
+    edge periods and anything newer are folded from days.
+    """
+    first = period_start(start, granularity)
+    day_start = to_day(start)
+    filters = {}
+    if municipality_id:
+        filters["municipality_id"] = municipality_id
+    if category:
+        filters["category"] = rollup_key(category)
+    
+    totals = {}
+    day_ranges = [(day_start, end)]
+    if granularity != "day":
+        compacted_through = (await compaction_state(db)).get("compacted_through")
+        if compacted_through:
+            compacted_from = first if first == day_start else period_end(first, granularity)
+            compacted_to = compacted_from
+            while period_end(compacted_to, granularity) <= min(end, compacted_through):
+                compacted_to = period_end(compacted_to, granularity)
+            if compacted_to > compacted_from:
+                day_ranges = [(day_start, compacted_from), (compacted_to, end)]
+                async for bucket in db.kpi_buckets.find({
+                    **filters,
+                    "granularity": granularity,
+                    "period_start": {"$gte": compacted_from, "$lt": compacted_to}
+                }):
+                    add_counters(totals.setdefault(bucket["period_start"], {}), bucket)
+    
+    for day_from, day_to in day_ranges:
+        if day_from >= day_to:
+            continue
+        async for bucket in db.kpi_buckets.find({
+            **filters,
+            "granularity": "day",
+            "period_start": {"$gte": day_from, "$lt": day_to}
+        }):
+            add_counters(totals.setdefault(period_start(bucket["period_start"], granularity), {}), bucket)
+    
+    series = []
+    current = first
+    while current < end:
+        series.append(summarize(current, totals.get(current, {})))
+        current = period_end(current, granularity)
+    return series
+
+async def range_buckets(db, start: datetime, end: datetime, filters: dict) -> list[dict]:
+    """
+    Buckets covering [start, end) at day resolution: compacted months that
+    fit entirely inside the range, days for the edges and for anything
+    after the last compaction.
+    """
+    start = to_day(start)
+    compacted_through = (await compaction_state(db)).get("compacted_through")
+    months = []
+    if compacted_through:
+        month = period_start(start, "month")
+        if month < start:
+            month = period_end(month, "month")
+        while period_end(month, "month") <= min(end, compacted_through):
+            months.append(month)
+            month = period_end(month, "month")
+    
+    if not months:
+        day_ranges = [{"$gte": start, "$lt": end}]
+        buckets = []
+    else:
+        day_ranges = [{"$gte": start, "$lt": months[0]}, {"$gte": period_end(months[-1], "month"), "$lt": end}]
+        buckets = await db.kpi_buckets.find({
+            **filters,
+            "granularity": "month",
+            "period_start": {"$gte": months[0], "$lte": months[-1]}
+        }).to_list(length=None)
+    for day_range in day_ranges:
+        buckets.extend(await db.kpi_buckets.find({
+            **filters,
+            "granularity": "day",
+            "period_start": day_range
+        }).to_list(length=None))
+    return buckets
+
+async def latency_percentiles(
+    db,
+    metric: str,
+    start: datetime,
+    end: datetime,
+    quantiles: list[float],
+    municipality_id=None,
+    category: Optional[str] = None,
+    group_by: Optional[str] = None
+) -> list[dict]:
+    """
+    Merge the DDSketch bins of every bucket in range (optionally per
+    municipality or category) and read the requested quantiles.
+    """
+    count_field, sum_field, sketch_field = LATENCY_METRICS[metric]
+    filters = {}
+    if municipality_id:
+        filters["municipality_id"] = municipality_id
+    if category:
+        filters["category"] = rollup_key(category)
+    
+    groups = {}
+    for bucket in await range_buckets(db, start, end, filters):
+        total = groups.setdefault(bucket.get(group_by) if group_by else None, {})
+        add_counters(total, bucket)
+    
+    results = []
+    for key, total in groups.items():
+        count = total.get(count_field, 0)
+        if group_by and not count:
+            continue
+        values = sketch_quantiles(total.get(sketch_field) or {}, quantiles)
+        result = {
+            "count": count,
+            "mean_seconds": total[sum_field] / count if count else None,
+            "quantiles": {f"p{round(quantile * 100, 3):g}": value for quantile, value in values.items()}
+        }
+        if group_by:
+            result[group_by] = key
+        results.append(result)
+    return results
+
+async def compact_period(db, granularity: str, start: datetime) -> int:
+    end = period_end(start, granularity)
+    merged = {}
+    async for bucket in db.kpi_buckets.find({"granularity": "day", "period_start": {"$gte": start, "$lt": end}}):
+        key = (bucket.get("municipality_id"), bucket.get("category"))
+        add_counters(merged.setdefault(key, {}), bucket)
+    if not merged:
+        return 0
+    
+    now = datetime.utcnow()
+    requests = []
+    for (municipality_id, category), total in merged.items():
+        bucket_id = f"{granularity}|{start.date().isoformat()}|{municipality_id or ''}|{category}"
+        requests.append(ReplaceOne({"_id": bucket_id}, {
+            **{field: total[field] for field in COUNTER_FIELDS},
+            **{field: dict(total[field]) for field in NESTED_COUNTER_FIELDS},
+            "granularity": granularity,
+            "period_start": start,
+            "municipality_id": municipality_id,
+            "category": category,
+            "updated_at": now
+        }, upsert=True))
+    await db.kpi_buckets.bulk_write(requests, ordered=False)
+    return len(requests)
+
+async def compact_kpis(db) -> dict:
+    """
+    Rebuild week and month buckets for every complete period that either
+    just completed or has day buckets written since the last run (late
+    events and imports land in old days too). Rebuilds replace whole
+    documents, so running twice is harmless.
+    """
+    state = await compaction_state(db)
+    started = datetime.utcnow()
+    today = to_day(started)
+    previous_through = state.get("compacted_through")
+    
+    query = {"granularity": "day", "period_start": {"$lt": today}}
+    if state.get("compacted_at"):
+        query["updated_at"] = {"$gte": state["compacted_at"]}
+    affected = set()
+    async for bucket in db.kpi_buckets.find(query, {"period_start": 1}):
+        for granularity in ("week", "month"):
+            affected.add((granularity, period_start(bucket["period_start"], granularity)))
+    if previous_through:
+        for granularity in ("week", "month"):
+            current = period_start(previous_through, granularity)
+            while period_end(current, granularity) <= today:
+                affected.add((granularity, current))
+                current = period_end(current, granularity)
+    
+    written = 0
+    for granularity, start in sorted(affected):
+        if period_end(start, granularity) <= today:
+            written += await compact_period(db, granularity, start)
+    
+    await db.kpi_compaction.update_one(
+        {"_id": "state"},
+        {"$set": {"compacted_at": started, "compacted_through": today}},
+        upsert=True
+    )
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    logger.info(f"Compacted {len(affected)} KPI periods into {written} buckets in {elapsed:.1f}s")
+    return {"periods": len(affected), "buckets": written, "elapsed_seconds": elapsed}
+
+def seconds_until_hour(now: datetime, hour: int) -> float:
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+class KpiCompactor:
+    """
+    Nightly compaction at KPI_COMPACTION_HOUR (UTC), plus a first pass at
+    startup when nothing has been compacted yet.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        try:
+            if not await compaction_state(self._db):
+                await compact_kpis(self._db)
+        except PyMongoError as e:
+            logger.error(f"Initial KPI compaction failed: {str(e)}")
+        while True:
+            await asyncio.sleep(seconds_until_hour(datetime.utcnow(), settings.KPI_COMPACTION_HOUR))
+            try:
+                await compact_kpis(self._db)
+            except PyMongoError as e:
+                logger.error(f"KPI compaction failed: {str(e)}")
+
+kpi_compactor = KpiCompactor()
@@ -0,0 +1,42 @@
+"""
+DDSketch quantiles over merged latency bins
+"""
+from typing import Optional
+
+# Must match the binning used by TicketService.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+ZERO_BIN = "zero"
+
+def bin_value(key: str) -> float:
+    # Midpoint of (gamma^(i-1), gamma^i] in relative terms.
+    if key == ZERO_BIN:
+        return 0.0
+    return 2 * GAMMA ** int(key) / (GAMMA + 1)
+
+def sketch_quantiles(bins: dict, quantiles: list[float]) -> dict[float, Optional[float]]:
+    """
+    Walk the bins in value order once and read every requested quantile,
+    using the same rank convention as DDSketch (rank = q * (n - 1)).
+    """
+    ordered = sorted(
+        ((bin_value(key), count) for key, count in bins.items() if count > 0),
+        key=lambda item: item[0]
+    )
+    total = sum(count for _, count in ordered)
+    results = {quantile: None for quantile in quantiles}
+    if not total:
+        return results
+    
+    pending = sorted(quantiles)
+    cumulative = 0
+    for value, count in ordered:
+        cumulative += count
+        while pending and pending[0] * (total - 1) < cumulative:
+            results[pending.pop(0)] = value
+        if not pending:
+            break
+    return results
+
+def sketch_quantile(bins: dict, quantile: float) -> Optional[float]:
+    return sketch_quantiles(bins, [quantile])[quantile]
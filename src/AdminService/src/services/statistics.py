@@ -0,0 +1,143 @@
+"""
+Statistics rollups and their reconciliation
+"""
+from datetime import datetime
+from typing import Optional
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_SCOPE = "global"
+
+def rollup_key(value) -> str:
+    # Must match the key encoding used by the services that $inc the rollups.
+    if value is None or value == "":
+        return "unknown"
+    return str(value).replace(".", "_").lstrip("$") or "unknown"
+
+def municipality_scope(municipality_id) -> str:
+    return f"municipality:{municipality_id}"
+
+def empty_ticket_counts() -> dict:
+    return {"total": 0, "by_status": {}, "by_category": {}}
+
+def add_ticket_counts(counts: dict, status, category, count: int):
+    counts["total"] += count
+    status_key, category_key = rollup_key(status), rollup_key(category)
+    counts["by_status"][status_key] = counts["by_status"].get(status_key, 0) + count
+    counts["by_category"][category_key] = counts["by_category"].get(category_key, 0) + count
+
+async def compute_rollups(db) -> dict[str, dict]:
+    """
+    Recompute every rollup document from the source collections: one
+    grouped pass over tickets, one over users and a municipality count.
+    """
+    now = datetime.utcnow()
+    rollups = {
+        GLOBAL_SCOPE: {
+            "_id": GLOBAL_SCOPE,
+            "scope": GLOBAL_SCOPE,
+            "tickets": empty_ticket_counts(),
+            "users": {"total": 0, "by_role": {}},
+            "municipalities": {"total": await db.municipalities.count_documents({})},
+            "updated_at": now,
+            "reconciled_at": now
+        }
+    }
+    
+    async for row in db.tickets.aggregate([
+        {"$group": {
+            "_id": {"municipality_id": "$municipality_id", "status": "$status", "category": "$category"},
+            "count": {"$sum": 1}
+        }}
+    ], allowDiskUse=True):
+        group = row["_id"]
+        add_ticket_counts(rollups[GLOBAL_SCOPE]["tickets"], group.get("status"), group.get("category"), row["count"])
+        if group.get("municipality_id"):
+            scope = municipality_scope(group["municipality_id"])
+            rollup = rollups.setdefault(scope, {
+                "_id": scope,
+                "scope": "municipality",
+                "municipality_id": group["municipality_id"],
+                "tickets": empty_ticket_counts(),
+                "updated_at": now,
+                "reconciled_at": now
+            })
+            add_ticket_counts(rollup["tickets"], group.get("status"), group.get("category"), row["count"])
+    
+    users = rollups[GLOBAL_SCOPE]["users"]
+    async for row in db.users.aggregate([{"$group": {"_id": "$role", "count": {"$sum": 1}}}]):
+        users["total"] += row["count"]
+        users["by_role"][rollup_key(row["_id"])] = row["count"]
+    return rollups
+
+async def reconcile_rollups(db) -> dict:
+    """
+    Overwrite the rollups with freshly computed values. Increments that land
+    between the recompute and the write are lost until the next pass, which
+    bounds drift to one reconciliation interval.
+    """
+    started = datetime.utcnow()
+    rollups = await compute_rollups(db)
+    await db.statistics_rollups.bulk_write(
+        [ReplaceOne({"_id": scope}, rollup, upsert=True) for scope, rollup in rollups.items()],
+        ordered=False
+    )
+    stale = await db.statistics_rollups.delete_many(
+        {"scope": "municipality", "_id": {"$nin": list(rollups)}}
+    )
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    logger.info(f"Reconciled {len(rollups)} statistics rollups in {elapsed:.1f}s")
+    return {"rollups": len(rollups), "removed": stale.deleted_count, "elapsed_seconds": elapsed}
+
+async def increment_global(db, path: str, amount: int):
+    try:
+        await db.statistics_rollups.update_one(
+            {"_id": GLOBAL_SCOPE},
+            {"$inc": {path: amount}, "$set": {"updated_at": datetime.utcnow()}, "$setOnInsert": {"scope": GLOBAL_SCOPE}},
+            upsert=True
+        )
+    except PyMongoError as e:
+        logger.warning(f"Failed to update statistics rollups: {str(e)}")
+
+class StatisticsReconciler:
+    """
+    Builds the rollups on first start and periodically rewrites them from
+    the source collections to repair drift from missed increments.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        try:
+            if not await self._db.statistics_rollups.find_one({"_id": GLOBAL_SCOPE}, {"_id": 1}):
+                await reconcile_rollups(self._db)
+        except PyMongoError as e:
+            logger.error(f"Initial statistics reconciliation failed: {str(e)}")
+        while True:
+            await asyncio.sleep(settings.STATISTICS_RECONCILE_SECONDS)
+            try:
+                await reconcile_rollups(self._db)
+            except PyMongoError as e:
+                logger.error(f"Statistics reconciliation failed: {str(e)}")
+
+statistics_reconciler = StatisticsReconciler()
@@ -0,0 +1,86 @@
+"""
+Declarative index reconciliation and query plan diagnostics
+"""
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+import logging
+
+logger = logging.getLogger(__name__)
+
+PLAN_WARNINGS = {
+    "COLLSCAN": "collection scan",
+    "SORT": "in-memory sort"
+}
+
+async def reconcile_indexes(db, declared: dict[str, list[IndexModel]]) -> dict:
+    """
+    Create declared indexes that are missing. Undeclared indexes are only
+    reported, never dropped, since collections are shared between services.
+    Services run this as a background task so index builds never delay
+    readiness.
+    """
+    summary = {"created": [], "failed": [], "undeclared": []}
+    for collection_name, models in declared.items():
+        collection = db[collection_name]
+        try:
+            existing = await collection.index_information()
+        except PyMongoError as e:
+            logger.error(f"Cannot list indexes on {collection_name}: {str(e)}")
+            continue
+        
+        existing_keys = {tuple(info["key"]) for info in existing.values()}
+        declared_names = {model.document["name"] for model in models}
+        for model in models:
+            name = model.document["name"]
+            if name in existing or tuple(model.document["key"].items()) in existing_keys:
+                continue
+            try:
+                await collection.create_indexes([model])
+                summary["created"].append(f"{collection_name}.{name}")
+                logger.info(f"Created index {collection_name}.{name}")
+            except OperationFailure as e:
+                summary["failed"].append(f"{collection_name}.{name}")
+                logger.error(f"Failed to create index {collection_name}.{name}: {str(e)}")
+        
+        for name in existing:
+            if name != "_id_" and name not in declared_names:
+                summary["undeclared"].append(f"{collection_name}.{name}")
+    
+    if summary["undeclared"]:
+        logger.info(f"Undeclared indexes left in place: {', '.join(summary['undeclared'])}")
+    logger.info(f"Index reconciliation finished: {len(summary['created'])} created, {len(summary['failed'])} failed")
+    return summary
+
+def plan_stages(plan) -> list[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+async def explain_query_shapes(db, shapes: list[dict]) -> list[dict]:
+    report = []
+    for shape in shapes:
+        cursor = db[shape["collection"]].find(shape.get("filter", {}))
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        cursor = cursor.limit(shape.get("limit", 50))
+        
+        entry = {"name": shape["name"], "collection": shape["collection"]}
+        try:
+            explanation = await cursor.explain()
+        except PyMongoError as e:
+            entry["error"] = str(e)
+            report.append(entry)
+            continue
+        
+        stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        entry["stages"] = stages
+        entry["warnings"] = [PLAN_WARNINGS[stage] for stage in stages if stage in PLAN_WARNINGS]
+        report.append(entry)
+    return report
@@ -0,0 +1,29 @@
+"""
+Fast JSON serialization of Motor documents
+"""
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+import orjson
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+def with_id(document: dict) -> dict:
+    document["id"] = document.pop("_id")
+    return document
+
+class MongoJSONResponse(JSONResponse):
+    """
+    Serializes Motor documents as-is: ObjectId, datetime and nested documents
+    are handled by orjson in one pass. Return it directly from a route to
+    skip FastAPI's jsonable_encoder walk as well.
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,386 @@
+"""
+Tests for AdminService
+"""
+import asyncio
+import math
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from fastapi.testclient import TestClient
+from src.main import app
+from src.config import settings
+from src.routes.jobs import pause_job, resume_job
+from src.services.cache import ResponseCache
+from src.services import jobs
+from src.services.jobs import JobContext, JobInterrupted, JobRunner, new_job
+from src.services.kpis import compact_period, kpi_series
+from src.services.sketches import GAMMA, RELATIVE_ACCURACY, ZERO_BIN, sketch_quantiles
+from src.services.statistics import GLOBAL_SCOPE, municipality_scope, reconcile_rollups
+
+client = TestClient(app)
+
+def test_health_check():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+    
+    def __aiter__(self):
+        return self._iterate()
+    
+    async def _iterate(self):
+        for document in self.documents:
+            yield dict(document)
+
+class FakeAggregate:
+    def __init__(self, rows):
+        self.rows = rows
+    
+    def aggregate(self, pipeline, **kwargs):
+        return FakeCursor(self.rows)
+
+class FakeMunicipalities:
+    def __init__(self, total):
+        self.total = total
+    
+    async def count_documents(self, query):
+        return self.total
+
+class FakeRollups:
+    def __init__(self, documents):
+        self.documents = {document["_id"]: document for document in documents}
+    
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.documents[request._filter["_id"]] = request._doc
+    
+    async def delete_many(self, query):
+        stale = [
+            scope for scope, document in self.documents.items()
+            if document.get("scope") == query["scope"] and scope not in query["_id"]["$nin"]
+        ]
+        for scope in stale:
+            del self.documents[scope]
+        return type("Result", (), {"deleted_count": len(stale)})()
+
+class FakeRollupDb:
+    def __init__(self, ticket_rows, user_rows, rollups):
+        self.tickets = FakeAggregate(ticket_rows)
+        self.users = FakeAggregate(user_rows)
+        self.municipalities = FakeMunicipalities(2)
+        self.statistics_rollups = FakeRollups(rollups)
+
+@pytest.mark.asyncio
+async def test_reconcile_rollups_rewrites_drift_and_drops_stale_scopes():
+    salerno, napoli, deleted = ObjectId(), ObjectId(), ObjectId()
+    db = FakeRollupDb(
+        [
+            {"_id": {"municipality_id": salerno, "status": "open", "category": "roads"}, "count": 3},
+            {"_id": {"municipality_id": salerno, "status": "resolved", "category": "roads"}, "count": 2},
+            {"_id": {"municipality_id": napoli, "status": "open", "category": "lighting.public"}, "count": 1},
+            {"_id": {"status": "open"}, "count": 4}
+        ],
+        [{"_id": "citizen", "count": 10}, {"_id": None, "count": 1}],
+        [
+            {"_id": GLOBAL_SCOPE, "scope": GLOBAL_SCOPE, "tickets": {"total": 99}},
+            {"_id": municipality_scope(deleted), "scope": "municipality", "tickets": {"total": 7}}
+        ]
+    )
+    
+    result = await reconcile_rollups(db)
+    
+    assert result["rollups"] == 3
+    assert result["removed"] == 1
+    rollups = db.statistics_rollups.documents
+    assert set(rollups) == {GLOBAL_SCOPE, municipality_scope(salerno), municipality_scope(napoli)}
+    tickets = rollups[GLOBAL_SCOPE]["tickets"]
+    assert tickets["total"] == 10
+    assert tickets["by_status"] == {"open": 8, "resolved": 2}
+    assert tickets["by_category"] == {"roads": 5, "lighting_public": 1, "unknown": 4}
+    assert rollups[GLOBAL_SCOPE]["users"] == {"total": 11, "by_role": {"citizen": 10, "unknown": 1}}
+    assert rollups[GLOBAL_SCOPE]["municipalities"] == {"total": 2}
+    assert rollups[municipality_scope(salerno)]["tickets"]["by_status"] == {"open": 3, "resolved": 2}
+
+def matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if "$gte" in condition and not value >= condition["$gte"]:
+                return False
+            if "$lt" in condition and not value < condition["$lt"]:
+                return False
+            if "$lte" in condition and not value <= condition["$lte"]:
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+class FakeBuckets:
+    def __init__(self, documents):
+        self.documents = {document["_id"]: document for document in documents}
+        self.queries = []
+    
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return FakeCursor([document for document in self.documents.values() if matches(document, query)])
+    
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.documents[request._filter["_id"]] = {**request._doc, "_id": request._filter["_id"]}
+
+class FakeCompaction:
+    def __init__(self, state):
+        self.state = state
+    
+    async def find_one(self, query):
+        return self.state
+
+class FakeKpiDb:
+    def __init__(self, days, compacted_through=None):
+        self.kpi_buckets = FakeBuckets([
+            {"_id": f"day|{day.date()}", "granularity": "day", "period_start": day, "opened": 1, "resolved": 0}
+            for day in days
+        ])
+        self.kpi_compaction = FakeCompaction({"compacted_through": compacted_through} if compacted_through else None)
+
+@pytest.mark.asyncio
+async def test_compact_period_merges_days_per_scope():
+    first = datetime(2026, 3, 2)
+    db = FakeKpiDb([first + timedelta(days=offset) for offset in range(10)])
+    
+    assert await compact_period(db, "week", first) == 1
+    week = db.kpi_buckets.documents["week|2026-03-02||None"]
+    assert week["opened"] == 7
+    assert week["granularity"] == "week"
+    assert week["period_start"] == first
+
+@pytest.mark.asyncio
+async def test_kpi_series_reads_partial_edge_weeks_from_days():
+    first = datetime(2026, 2, 23)
+    db = FakeKpiDb([first + timedelta(days=offset) for offset in range(35)], compacted_through=datetime(2026, 3, 30))
+    for week in range(5):
+        await compact_period(db, "week", first + timedelta(weeks=week))
+    db.kpi_buckets.queries.clear()
+    
+    series = await kpi_series(db, "week", datetime(2026, 3, 4, 15, 30), datetime(2026, 3, 25))
+    
+    assert [entry["period_start"] for entry in series] == [
+        datetime(2026, 3, 2), datetime(2026, 3, 9), datetime(2026, 3, 16), datetime(2026, 3, 23)
+    ]
+    assert [entry["opened"] for entry in series] == [5, 7, 7, 2]
+    compacted = [query["period_start"] for query in db.kpi_buckets.queries if query["granularity"] == "week"]
+    assert compacted == [{"$gte": datetime(2026, 3, 9), "$lt": datetime(2026, 3, 23)}]
+    
+    # Nothing compacted yet: every period is folded from days.
+    db.kpi_compaction.state = None
+    series = await kpi_series(db, "week", datetime(2026, 3, 4), datetime(2026, 3, 25))
+    assert [entry["opened"] for entry in series] == [5, 7, 7, 2]
+
+def sketch_of(values):
+    bins = {}
+    for value in values:
+        key = ZERO_BIN if value == 0 else str(math.ceil(math.log(value, GAMMA)))
+        bins[key] = bins.get(key, 0) + 1
+    return bins
+
+def test_sketch_quantiles_within_relative_accuracy():
+    values = list(range(1, 1001))
+    results = sketch_quantiles(sketch_of(values), [0.99, 0.5, 0.9])
+    
+    assert list(results) == [0.99, 0.5, 0.9]
+    for quantile, value in results.items():
+        exact = values[round(quantile * (len(values) - 1))]
+        assert abs(value - exact) <= RELATIVE_ACCURACY * exact
+    
+    assert sketch_quantiles({}, [0.5]) == {0.5: None}
+    assert sketch_quantiles({ZERO_BIN: 3, "10": 0, "100": 1}, [0.0, 0.5, 1.0])[0.5] == 0.0
+
+@pytest.mark.asyncio
+async def test_response_cache_drops_loads_overtaken_by_invalidation():
+    cache = ResponseCache()
+    cache.coherent = True
+    release = asyncio.Event()
+    calls = []
+    
+    async def loader():
+        calls.append(1)
+        await release.wait()
+        return [{"name": f"version {len(calls)}"}]
+    
+    for invalidate in (lambda: cache.invalidate("municipalities"), lambda: cache.invalidate()):
+        cache.invalidate("municipalities")
+        calls.clear()
+        release.clear()
+        first = asyncio.create_task(cache.get("municipalities", loader))
+        second = asyncio.create_task(cache.get("municipalities", loader))
+        await asyncio.sleep(0)
+        invalidate()
+        release.set()
+        
+        # Concurrent misses share the load, but its result is not kept.
+        assert (await first).body == (await second).body
+        assert len(calls) == 1
+        await cache.get("municipalities", loader)
+        assert len(calls) == 2
+    
+    entry = await cache.get("municipalities", loader)
+    assert len(calls) == 2
+    response = await cache.respond("municipalities", loader, entry.etag)
+    assert response.status_code == 304
+
+class FakeJobs:
+    def __init__(self):
+        self.documents = {}
+    
+    async def insert_one(self, document):
+        document = dict(document, _id=document.get("_id", ObjectId()))
+        self.documents[document["_id"]] = document
+        return type("Result", (), {"inserted_id": document["_id"]})()
+    
+    async def find_one(self, query):
+        return next((dict(job) for job in self.documents.values() if matches(job, query)), None)
+    
+    def apply(self, job, update):
+        for path, value in update.get("$set", {}).items():
+            *parents, field = path.split(".")
+            target = job
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[field] = value
+        for path, count in update.get("$inc", {}).items():
+            *parents, field = path.split(".")
+            target = job
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[field] = target.get(field, 0) + count
+    
+    async def find_one_and_update(self, query, update, sort=None, return_document=None):
+        candidates = [job for job in self.documents.values() if matches(job, query)]
+        if sort:
+            candidates.sort(key=lambda job: job[sort[0][0]])
+        if not candidates:
+            return None
+        self.apply(candidates[0], update)
+        return dict(candidates[0])
+    
+    async def update_one(self, query, update):
+        job = next((job for job in self.documents.values() if matches(job, query)), None)
+        if job:
+            self.apply(job, update)
+        return type("Result", (), {"matched_count": int(job is not None)})()
+    
+    async def update_many(self, query, update):
+        updated = [job for job in self.documents.values() if matches(job, query)]
+        for job in updated:
+            self.apply(job, update)
+        return type("Result", (), {"matched_count": len(updated)})()
+
+class FakeJobDb:
+    def __init__(self):
+        self.jobs = FakeJobs()
+
+def job_runner_for(db) -> JobRunner:
+    runner = JobRunner()
+    runner._db = db
+    return runner
+
+@pytest.mark.asyncio
+async def test_job_pauses_at_checkpoint_and_resumes_from_progress(monkeypatch):
+    monkeypatch.setattr(settings, "JOBS_BATCH_PAUSE_SECONDS", 0)
+    db = FakeJobDb()
+    steps = []
+    
+    async def handler(ctx):
+        step = ctx.progress["step"]
+        while step < 3:
+            steps.append(step)
+            if step == 1 and len(steps) == 2:
+                await pause_job(str(ctx.job["_id"]), db)
+            step += 1
+            await ctx.checkpoint(step, deleted={"rows": 1})
+    
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "count", handler)
+    job_id = (await db.jobs.insert_one(new_job("count", {}, datetime.utcnow()))).inserted_id
+    runner = job_runner_for(db)
+    
+    await runner.run(await runner.claim("a"), "a")
+    job = await db.jobs.find_one({"_id": job_id})
+    assert job["state"] == "paused"
+    assert job["pause_requested"] is False
+    assert job["progress"]["step"] == 1
+    assert await runner.claim("a") is None
+    
+    await resume_job(str(job_id), db)
+    await runner.run(await runner.claim("b"), "b")
+    job = await db.jobs.find_one({"_id": job_id})
+    assert steps == [0, 1, 1, 2]
+    assert job["state"] == "completed"
+    assert job["attempts"] == 2
+    assert job["progress"]["deleted"] == {"rows": 3}
+
+@pytest.mark.asyncio
+async def test_job_lease_takeover_and_lapsed_pause_requests():
+    db = FakeJobDb()
+    lapsed = datetime.utcnow() - timedelta(seconds=1)
+    orphan = dict(new_job("count", {}, lapsed), state="running", worker_id="a", attempts=1)
+    orphan_id = (await db.jobs.insert_one(orphan)).inserted_id
+    pausing = dict(new_job("count", {}, lapsed), state="running", worker_id="c", pause_requested=True)
+    pausing_id = (await db.jobs.insert_one(pausing)).inserted_id
+    runner = job_runner_for(db)
+    
+    claimed = await runner.claim("b")
+    assert claimed["_id"] == orphan_id
+    assert claimed["worker_id"] == "b"
+    assert claimed["attempts"] == 2
+    assert (await db.jobs.find_one({"_id": pausing_id}))["state"] == "paused"
+    assert await runner.claim("d") is None
+    
+    # The original worker loses the lease at its next checkpoint.
+    with pytest.raises(JobInterrupted):
+        await JobContext(db, dict(orphan, _id=orphan_id), "a", None).checkpoint(1)
+
+@pytest.mark.asyncio
+async def test_job_failures_retry_with_backoff_then_fail(monkeypatch):
+    db = FakeJobDb()
+    
+    async def handler(ctx):
+        raise PyMongoError("connection reset")
+    
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "flaky", handler)
+    job_id = (await db.jobs.insert_one(new_job("flaky", {}, datetime.utcnow()))).inserted_id
+    runner = job_runner_for(db)
+    
+    before = datetime.utcnow()
+    await runner.run(await runner.claim("a"), "a")
+    job = await db.jobs.find_one({"_id": job_id})
+    assert job["state"] == "queued"
+    assert job["error"] == "connection reset"
+    assert job["available_at"] >= before + timedelta(seconds=settings.JOBS_RETRY_BASE_SECONDS)
+    
+    await db.jobs.update_one({"_id": job_id}, {"$set": {
+        "available_at": datetime.utcnow(),
+        "attempts": settings.JOBS_MAX_ATTEMPTS - 1
+    }})
+    await runner.run(await runner.claim("a"), "a")
+    assert (await db.jobs.find_one({"_id": job_id}))["state"] == "failed"
+    
+    unknown_id = (await db.jobs.insert_one(new_job("missing", {}, datetime.utcnow()))).inserted_id
+    await runner.run(await runner.claim("a"), "a")
+    assert (await db.jobs.find_one({"_id": unknown_id}))["state"] == "failed"
+    
+    async def broken(ctx):
+        return ctx.job["params"]["municipality_id"]
+    
+    # Bugs and bad data fail the job at once instead of killing the worker.
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "broken", broken)
+    broken_id = (await db.jobs.insert_one(new_job("broken", {}, datetime.utcnow()))).inserted_id
+    await runner.run(await runner.claim("a"), "a")
+    job = await db.jobs.find_one({"_id": broken_id})
+    assert job["state"] == "failed"
+    assert job["error"] == "KeyError: 'municipality_id'"
@@ -2,18 +2,39 @@
 Database connection and initialization for AuthService
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import IndexModel
 from pymongo.errors import ConnectionFailure
+import asyncio
 import logging
 from .config import settings
+from .utils.indexes import reconcile_indexes
 
 logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    index_task: asyncio.Task = None
 
 db_instance = Database()
 
+INDEXES = {
+    "users": [
+        IndexModel([("email", 1)], unique=True),
+        IndexModel([("municipality_id", 1)]),
+        IndexModel([("role", 1)]),
+        IndexModel([("created_at", -1)])
+    ]
+}
+
+QUERY_SHAPES = [
+    {
+        "name": "user_by_email",
+        "collection": "users",
+        "filter": {"email": "user@example.com"}
+    }
+]
+
 async def connect_db():
     try:
         logger.info(f"Connecting to MongoDB: {settings.MONGODB_URL.split('@')[1] if '@' in settings.MONGODB_URL else 'localhost'}")
@@ -34,6 +55,8 @@ async def connect_db():
         raise
 
 async def close_db():
+    if db_instance.index_task and not db_instance.index_task.done():
+        db_instance.index_task.cancel()
     if db_instance.client:
         db_instance.client.close()
         logger.info("MongoDB connection closed")
@@ -45,15 +68,7 @@ async def init_database():
     try:
         db = await get_database()
         
-        collections = await db.list_collection_names()
-        
-        if 'users' not in collections:
-            await db.create_collection('users')
-            await db.users.create_index("email", unique=True)
-            await db.users.create_index("municipality_id")
-            await db.users.create_index("role")
-            await db.users.create_index("created_at")
-            logger.info("Users collection created with indexes")
+        db_instance.index_task = asyncio.create_task(reconcile_indexes(db, INDEXES))
         
         if settings.ENVIRONMENT == "development":
             await seed_test_data(db)
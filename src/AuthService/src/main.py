@@ -9,7 +9,9 @@ import logging
 import sys
 
 from .config import settings
-from .database import connect_db, close_db, init_database
+from .database import connect_db, close_db, init_database, get_database, QUERY_SHAPES
+from .utils.indexes import explain_query_shapes
+from .utils.serialization import MongoJSONResponse
 from .routes import auth, users
 from .middleware.logging import RequestLoggingMiddleware
 
@@ -39,6 +41,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=MongoJSONResponse,
     lifespan=lifespan
 )
 
@@ -71,6 +74,10 @@ async def root():
         "docs": "/docs"
     }
 
+@app.get("/diagnostics/query-plans")
+async def query_plans():
+    return await explain_query_shapes(await get_database(), QUERY_SHAPES)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
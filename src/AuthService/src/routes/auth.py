@@ -11,6 +11,7 @@ from ..services.auth import (
     hash_password,
     authenticate_user,
     create_access_token,
+    record_user_created,
     user_to_dict
 )
 from ..middleware.auth import get_current_user
@@ -36,6 +37,7 @@ async def register(user_data: UserCreate, db=Depends(get_database)):
         user_dict["municipality_id"] = ObjectId(user_dict["municipality_id"])
     
     result = await db.users.insert_one(user_dict)
+    await record_user_created(db, user_dict)
     
     created_user = await db.users.find_one({"_id": result.inserted_id})
     
@@ -6,6 +6,7 @@ from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from bson import ObjectId
+from pymongo.errors import PyMongoError
 import logging
 
 from ..config import settings
@@ -92,3 +93,22 @@ def user_to_dict(user) -> dict:
         "updated_at": user["updated_at"]
     }
     return user_dict
+
+async def record_user_created(db, user: dict):
+    """
+    Bump the AdminService statistics rollup. Best effort: drift is
+    repaired by the AdminService reconciliation job.
+    """
+    role = getattr(user.get("role"), "value", user.get("role")) or "unknown"
+    try:
+        await db.statistics_rollups.update_one(
+            {"_id": "global"},
+            {
+                "$inc": {"users.total": 1, f"users.by_role.{role}": 1},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$setOnInsert": {"scope": "global"}
+            },
+            upsert=True
+        )
+    except PyMongoError as e:
+        logger.warning(f"Failed to update statistics rollups: {str(e)}")
@@ -2,18 +2,38 @@
 Database connection for service
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import IndexModel
+from bson import ObjectId
 from pymongo.errors import ConnectionFailure
+import asyncio
 import logging
 from .config import settings
+from .utils.indexes import reconcile_indexes
 
 logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    index_task: asyncio.Task = None
 
 db_instance = Database()
 
+INDEXES = {
+    "municipality_boundaries": [
+        IndexModel([("municipality_id", 1)], unique=True),
+        IndexModel([("geometry", "2dsphere")])
+    ]
+}
+
+QUERY_SHAPES = [
+    {
+        "name": "boundary_by_municipality",
+        "collection": "municipality_boundaries",
+        "filter": {"municipality_id": ObjectId()}
+    }
+]
+
 async def connect_db():
     try:
         logger.info(f"Connecting to MongoDB...")
@@ -31,6 +51,8 @@ async def connect_db():
         raise
 
 async def close_db():
+    if db_instance.index_task and not db_instance.index_task.done():
+        db_instance.index_task.cancel()
     if db_instance.client:
         db_instance.client.close()
         logger.info("MongoDB connection closed")
@@ -41,6 +63,7 @@ async def get_database() -> AsyncIOMotorDatabase:
 async def init_database():
     try:
         db = await get_database()
+        db_instance.index_task = asyncio.create_task(reconcile_indexes(db, INDEXES))
         logger.info("Database initialized")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from ..database import get_database
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
 from datetime import datetime
 
@@ -16,7 +17,4 @@ async def create_boundary(boundary_data: dict, db=Depends(get_database)):
 @router.get("/municipality/{municipality_id}")
 async def get_municipality_boundaries(municipality_id: str, db=Depends(get_database)):
     boundary = await db.municipality_boundaries.find_one({"municipality_id": ObjectId(municipality_id)})
-    if boundary:
-        boundary["id"] = str(boundary.pop("_id"))
-        boundary["municipality_id"] = str(boundary["municipality_id"])
-    return boundary
+    return MongoJSONResponse(with_id(boundary) if boundary else None)
@@ -2,18 +2,66 @@
 Database connection for service
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import IndexModel
+from bson import ObjectId
+from datetime import datetime
 from pymongo.errors import ConnectionFailure
+import asyncio
 import logging
 from .config import settings
+from .utils.idempotency import IDEMPOTENCY_INDEXES
+from .utils.indexes import reconcile_indexes
 
 logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    index_task: asyncio.Task = None
 
 db_instance = Database()
 
+INDEXES = {
+    "media_files": [
+        IndexModel([("ticket_id", 1)]),
+        IndexModel([("uploaded_by", 1)]),
+        IndexModel([("upload_date", -1)]),
+        IndexModel([("blob_id", 1)]),
+        IndexModel(
+            [("upload_session_id", 1)],
+            unique=True,
+            partialFilterExpression={"upload_session_id": {"$exists": True}}
+        )
+    ],
+    "upload_sessions": [
+        IndexModel([("expires_at", 1)])
+    ],
+    "idempotency_keys": IDEMPOTENCY_INDEXES
+}
+
+QUERY_SHAPES = [
+    {
+        "name": "media_files_derivative_siblings",
+        "collection": "media_files",
+        "filter": {"blob_id": ObjectId(), "derivatives": {"$exists": True}}
+    },
+    {
+        "name": "media_files_by_tickets",
+        "collection": "media_files",
+        "filter": {"ticket_id": {"$in": [ObjectId(), ObjectId()]}}
+    },
+    {
+        "name": "media_files_by_upload_session",
+        "collection": "media_files",
+        "filter": {"upload_session_id": "00000000000000000000000000000000"}
+    },
+    {
+        "name": "upload_sessions_expired",
+        "collection": "upload_sessions",
+        "filter": {"expires_at": {"$lte": datetime(2026, 1, 1)}}
+    }
+]
+
 async def connect_db():
     try:
         logger.info(f"Connecting to MongoDB...")
@@ -31,6 +79,8 @@ async def connect_db():
         raise
 
 async def close_db():
+    if db_instance.index_task and not db_instance.index_task.done():
+        db_instance.index_task.cancel()
     if db_instance.client:
         db_instance.client.close()
         logger.info("MongoDB connection closed")
@@ -41,6 +91,7 @@ async def get_database() -> AsyncIOMotorDatabase:
 async def init_database():
     try:
         db = await get_database()
+        db_instance.index_task = asyncio.create_task(reconcile_indexes(db, INDEXES))
         logger.info("Database initialized")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
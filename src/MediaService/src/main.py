@@ -3,15 +3,20 @@ CityFix MediaService - Media Upload and Management
 """
 from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import logging
 import sys
 import os
 
 from .config import settings
-from .database import connect_db, close_db, init_database
-from .routes import files
+from .database import connect_db, close_db, init_database, get_database, QUERY_SHAPES
+from .utils.indexes import explain_query_shapes
+from .middleware.upload_limit import UploadLimitMiddleware
+from .utils.serialization import MongoJSONResponse
+from .routes import files, serve, uploads
+from .services.derivatives import derivative_pipeline
+from .services.resumable import session_sweeper
+from .services.storage import prepare_storage
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,14 +30,18 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     logger.info(f"Starting {settings.SERVICE_NAME}...")
     
-    upload_dir = getattr(settings, 'UPLOAD_DIR', '/app/uploads')
-    os.makedirs(upload_dir, exist_ok=True)
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    prepare_storage()
     
     await connect_db()
     await init_database()
+    await derivative_pipeline.start()
+    await session_sweeper.start(await get_database())
     logger.info(f"{settings.SERVICE_NAME} started successfully on port {settings.SERVICE_PORT}")
     yield
     logger.info(f"Shutting down {settings.SERVICE_NAME}...")
+    await session_sweeper.stop()
+    await derivative_pipeline.stop()
     await close_db()
 
 app = FastAPI(
@@ -41,6 +50,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=MongoJSONResponse,
     lifespan=lifespan
 )
 
@@ -50,13 +60,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Location", "ETag", "Content-Range", "Upload-Offset", "Upload-Length", "Upload-Expires",
+        "Tus-Resumable", "Tus-Version", "Tus-Extension", "Tus-Max-Size", "X-Media-Id", "X-Media-Url"
+    ]
 )
 
-upload_dir = getattr(settings, 'UPLOAD_DIR', '/app/uploads')
-if os.path.exists(upload_dir):
-    app.mount("/uploads", StaticFiles(directory=upload_dir), name="uploads")
+app.add_middleware(
+    UploadLimitMiddleware,
+    paths=("/api/v1/media/upload",),
+    max_bytes=settings.MAX_FILE_SIZE + settings.UPLOAD_MULTIPART_OVERHEAD
+)
 
 app.include_router(files.router, prefix="/api/v1/media", tags=["Media"])
+app.include_router(uploads.router, prefix="/api/v1/media/uploads", tags=["Resumable uploads"])
+app.include_router(serve.router, prefix="/uploads", tags=["Uploads"])
 
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def health_check():
@@ -66,6 +84,10 @@ async def health_check():
 async def root():
     return {"service": settings.SERVICE_NAME, "version": "1.0.0", "docs": "/docs"}
 
+@app.get("/diagnostics/query-plans")
+async def query_plans():
+    return await explain_query_shapes(await get_database(), QUERY_SHAPES)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=settings.SERVICE_PORT, reload=settings.ENVIRONMENT == "development")
@@ -0,0 +1,66 @@
+"""
+Reject oversized upload bodies before they are buffered
+"""
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+class UploadLimitMiddleware:
+    """
+    Multipart bodies are spooled in full before a route runs, so the size
+    check in the route alone still lets a client stream gigabytes in. This
+    answers 413 up front when Content-Length is too large, and otherwise
+    counts bytes as they arrive and cuts the body off once past the limit.
+    """
+    def __init__(self, app: ASGIApp, paths: tuple[str, ...], max_bytes: int):
+        self.app = app
+        self.paths = paths
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].rstrip("/") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        too_large = JSONResponse({"detail": "File too large"}, status_code=413)
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+        
+        received = 0
+        exceeded = False
+        
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+        
+        response_started = False
+        
+        async def limited_send(message: Message):
+            nonlocal response_started
+            # Whatever the app makes of the truncated body, the client gets a 413.
+            if exceeded:
+                if not response_started:
+                    response_started = True
+                    await too_large(scope, receive, send)
+                return
+            response_started = message["type"] == "http.response.start" or response_started
+            await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except Exception:
+            # The app failing on the cut-off body is expected; the 413 stands.
+            if not exceeded:
+                raise
+            if not response_started:
+                await too_large(scope, receive, send)
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, File, Depends, Header, HTTPException, Request
+from ..config import settings
 from ..database import get_database
+from ..services.blobs import BlobBusy
+from ..services.derivatives import derivative_pipeline
+from ..services.media import delete_media, register_media
+from ..services.storage import UploadTooLarge, discard, stage_upload
+from .serve import immutable
+from ..utils.file_response import file_response
+from ..utils.idempotency import request_fingerprint, run_idempotent
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
-from datetime import datetime
-import os
-import uuid
-from pathlib import Path
+from typing import Optional
 
 router = APIRouter()
 
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/uploads")
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -20,42 +24,36 @@ async def upload_file(
     file: UploadFile = File(...),
     ticket_id: str = None,
     user_id: str = None,
+    idempotency_key: Optional[str] = Header(None),
     db=Depends(get_database)
 ):
-    if not allowed_file(file.filename):
-        raise HTTPException(status_code=400, detail="File type not allowed")
-    
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="File too large")
-    
-    file_ext = file.filename.rsplit('.', 1)[1].lower()
-    unique_filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    
-    with open(file_path, 'wb') as f:
-        f.write(contents)
-    
-    media_doc = {
+    fingerprint = request_fingerprint({
         "filename": file.filename,
-        "stored_filename": unique_filename,
         "mime_type": file.content_type,
-        "size": len(contents),
-        "ticket_id": ObjectId(ticket_id) if ticket_id else None,
-        "uploaded_by": ObjectId(user_id) if user_id else None,
-        "upload_date": datetime.utcnow(),
-        "path": file_path
-    }
+        "size": file.size,
+        "ticket_id": ticket_id,
+        "user_id": user_id
+    })
+    return await run_idempotent(
+        db, "media.upload", idempotency_key, fingerprint,
+        lambda: store_upload(db, file, ticket_id, user_id)
+    )
+
+async def store_upload(db, file: UploadFile, ticket_id: Optional[str], user_id: Optional[str]) -> MongoJSONResponse:
+    if not allowed_file(file.filename):
+        raise HTTPException(status_code=400, detail="File type not allowed")
     
-    result = await db.media_files.insert_one(media_doc)
+    try:
+        staged = await stage_upload(file, settings.MAX_FILE_SIZE)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
     
-    return {
-        "id": str(result.inserted_id),
-        "filename": unique_filename,
-        "url": f"/uploads/{unique_filename}"
-    }
+    try:
+        media = await register_media(db, staged, file.filename, file.content_type, ticket_id, user_id)
+    except BlobBusy:
+        await discard(staged.path)
+        raise HTTPException(status_code=503, detail="Storage busy, retry the upload")
+    return MongoJSONResponse(media)
 
 @router.get("/files/{file_id}")
 async def get_file_metadata(file_id: str, db=Depends(get_database)):
@@ -63,23 +61,39 @@ async def get_file_metadata(file_id: str, db=Depends(get_database)):
     if not file_doc:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_doc["id"] = str(file_doc.pop("_id"))
-    if file_doc.get("ticket_id"):
-        file_doc["ticket_id"] = str(file_doc["ticket_id"])
-    if file_doc.get("uploaded_by"):
-        file_doc["uploaded_by"] = str(file_doc["uploaded_by"])
-    
-    return file_doc
+    return MongoJSONResponse(with_id(file_doc))
 
-@router.delete("/files/{file_id}")
-async def delete_file(file_id: str, db=Depends(get_database)):
+@router.api_route("/files/{file_id}/content", methods=["GET", "HEAD"])
+async def get_file_content(file_id: str, request: Request, db=Depends(get_database)):
+    file_doc = await db.media_files.find_one({"_id": ObjectId(file_id)}, {"path": 1, "sha256": 1, "mime_type": 1})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    etag = f'"{file_doc["sha256"]}"' if file_doc.get("sha256") else None
+    try:
+        return await file_response(request, file_doc["path"], etag, immutable(), file_doc.get("mime_type"))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+@router.api_route("/files/{file_id}/derivatives/{name}", methods=["GET", "HEAD"])
+async def get_derivative(file_id: str, name: str, request: Request, db=Depends(get_database)):
+    if name not in settings.DERIVATIVES:
+        raise HTTPException(status_code=404, detail="Unknown derivative")
     file_doc = await db.media_files.find_one({"_id": ObjectId(file_id)})
     if not file_doc:
         raise HTTPException(status_code=404, detail="File not found")
-    
-    if os.path.exists(file_doc["path"]):
-        os.remove(file_doc["path"])
-    
-    await db.media_files.delete_one({"_id": ObjectId(file_id)})
+    try:
+        path = await derivative_pipeline.ensure(db, file_doc, name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except OSError:
+        raise HTTPException(status_code=415, detail="File is not a supported image")
+    return await file_response(
+        request, path, None, f"public, max-age={settings.DERIVATIVE_CACHE_MAX_AGE_SECONDS}"
+    )
+
+@router.delete("/files/{file_id}")
+async def delete_file(file_id: str, db=Depends(get_database)):
+    if not await delete_media(db, ObjectId(file_id)):
+        raise HTTPException(status_code=404, detail="File not found")
     
     return {"message": "File deleted successfully"}
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Request
+from ..config import settings
+from ..utils.file_response import file_response
+import os
+
+router = APIRouter()
+
+def immutable() -> str:
+    return f"public, max-age={settings.MEDIA_CACHE_MAX_AGE_SECONDS}, immutable"
+
+def resolve_upload_path(path: str) -> str:
+    root = os.path.realpath(settings.UPLOAD_DIR)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not full_path.startswith(root + os.sep):
+        raise HTTPException(status_code=404, detail="File not found")
+    # Staging and session directories are dot-prefixed at any depth.
+    if any(part.startswith(".") for part in os.path.relpath(full_path, root).split(os.sep)):
+        raise HTTPException(status_code=404, detail="File not found")
+    return full_path
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def serve_upload(path: str, request: Request):
+    full_path = resolve_upload_path(path)
+    # Classify the file by where it resolved to, not by how the path was spelled.
+    relative = os.path.relpath(full_path, os.path.realpath(settings.UPLOAD_DIR)).replace(os.sep, "/")
+    if relative.startswith("blobs/"):
+        # Blob names are their SHA-256, so the content can never change.
+        etag, cache_control = f'"{os.path.basename(full_path).split(".", 1)[0]}"', immutable()
+    elif relative.startswith("derived/"):
+        # Re-rendered in place when the derivative settings change.
+        etag, cache_control = None, f"public, max-age={settings.DERIVATIVE_CACHE_MAX_AGE_SECONDS}"
+    else:
+        # Files stored before content addressing have unique, never reused names.
+        etag, cache_control = None, immutable()
+    try:
+        return await file_response(request, full_path, etag, cache_control)
+    except (FileNotFoundError, IsADirectoryError):
+        raise HTTPException(status_code=404, detail="File not found")
@@ -0,0 +1,193 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import Response
+from ..config import settings
+from ..database import get_database
+from ..services.blobs import BlobBusy
+from ..services.media import media_summary, register_media
+from ..services.resumable import (
+    TUS_EXTENSIONS,
+    TUS_VERSION,
+    OffsetMismatch,
+    SessionBusy,
+    SessionNotFound,
+    SessionLockLost,
+    UploadOverflow,
+    abort_finalize,
+    append_chunk,
+    begin_finalize,
+    claim_session,
+    complete_session,
+    create_session,
+    delete_session,
+    finalize_stalled,
+    find_session,
+    parse_metadata,
+    release_session,
+    stage_session
+)
+from .files import allowed_file
+from bson import ObjectId
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pymongo.errors import DuplicateKeyError
+from starlette.requests import ClientDisconnect
+from typing import Optional
+
+router = APIRouter()
+
+def tus_headers(session: Optional[dict] = None, **extra) -> dict:
+    headers = {"Tus-Resumable": TUS_VERSION, **extra}
+    if session:
+        headers["Upload-Offset"] = str(session["offset"])
+        headers["Upload-Expires"] = format_datetime(session["expires_at"].replace(tzinfo=timezone.utc), usegmt=True)
+        if session.get("media"):
+            headers["X-Media-Id"] = session["media"]["id"]
+            headers["X-Media-Url"] = session["media"]["url"]
+    return headers
+
+def tus_error(status_code: int, detail: str, **headers) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=detail, headers=tus_headers(**headers))
+
+@router.options("/")
+async def upload_capabilities():
+    return Response(status_code=204, headers=tus_headers(**{
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(settings.MAX_FILE_SIZE)
+    }))
+
+@router.post("/", status_code=201)
+async def create_upload(
+    upload_length: Optional[str] = Header(None),
+    upload_metadata: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    if not upload_length or not upload_length.isdigit():
+        raise tus_error(400, "Upload-Length header required")
+    length = int(upload_length)
+    if length > settings.MAX_FILE_SIZE:
+        raise tus_error(413, "File too large")
+    try:
+        metadata = parse_metadata(upload_metadata)
+    except ValueError as e:
+        raise tus_error(400, str(e))
+    if not allowed_file(metadata.get("filename") or ""):
+        raise tus_error(400, "File type not allowed")
+    for key in ("ticket_id", "user_id"):
+        if metadata.get(key) and not ObjectId.is_valid(metadata[key]):
+            raise tus_error(400, f"Invalid {key}")
+    
+    session = await create_session(db, length, metadata)
+    return Response(status_code=201, headers=tus_headers(
+        session,
+        Location=f"/api/v1/media/uploads/{session['_id']}"
+    ))
+
+@router.head("/{upload_id}")
+async def get_upload_offset(upload_id: str, db=Depends(get_database)):
+    try:
+        session = await find_session(db, upload_id)
+    except SessionNotFound:
+        raise tus_error(404, "Upload not found")
+    return Response(status_code=200, headers=tus_headers(
+        session,
+        **{"Upload-Length": str(session["length"]), "Cache-Control": "no-store"}
+    ))
+
+@router.patch("/{upload_id}")
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: Optional[str] = Header(None),
+    content_type: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    if content_type != "application/offset+octet-stream":
+        raise tus_error(415, "Content-Type must be application/offset+octet-stream")
+    if not upload_offset or not upload_offset.isdigit():
+        raise tus_error(400, "Upload-Offset header required")
+    try:
+        session = await claim_session(db, upload_id, int(upload_offset))
+    except SessionNotFound:
+        raise tus_error(404, "Upload not found")
+    except OffsetMismatch as e:
+        if e.offset != int(upload_offset):
+            raise tus_error(409, "Upload-Offset does not match", **{"Upload-Offset": str(e.offset)})
+        # Fully received: a retried last PATCH takes over a stalled
+        # finalize, or learns where the file went.
+        try:
+            session = await finalize_upload(db, await find_session(db, upload_id))
+        except SessionNotFound:
+            raise tus_error(404, "Upload not found")
+        return Response(status_code=204, headers=tus_headers(session))
+    except SessionBusy:
+        raise tus_error(423, "Upload is being written by another request")
+    
+    overflow = False
+    try:
+        await append_chunk(db, session, request.stream())
+    except UploadOverflow:
+        overflow = True
+    except (ClientDisconnect, SessionLockLost):
+        # Nobody is listening, or another request owns the session now; keep
+        # what arrived for the next attempt.
+        pass
+    finally:
+        released = await release_session(db, session)
+    if not released:
+        try:
+            session = await find_session(db, upload_id)
+        except SessionNotFound:
+            raise tus_error(404, "Upload not found")
+        raise tus_error(409, "Upload was taken over by another request", **{"Upload-Offset": str(session["offset"])})
+    session = released
+    if overflow:
+        raise tus_error(413, "Body exceeds Upload-Length", **{"Upload-Offset": str(session["offset"])})
+    
+    if session["offset"] == session["length"]:
+        session = await finalize_upload(db, session)
+    return Response(status_code=204, headers=tus_headers(session))
+
+async def finalize_upload(db, session: dict) -> dict:
+    finalizing_until = await begin_finalize(db, session)
+    if not finalizing_until:
+        current = await find_session(db, session["_id"])
+        if current["state"] == "finalizing":
+            raise tus_error(423, "Upload is being finalized", session=current)
+        if current["state"] != "completed":
+            raise tus_error(409, f"Upload is {current['state']}", session=current)
+        return current
+    try:
+        # A finalize that died after registering left the media behind.
+        media_doc = await db.media_files.find_one({"upload_session_id": session["_id"]})
+        if media_doc:
+            media = media_summary(media_doc)
+        else:
+            media = await register_media(
+                db, await stage_session(session), session["filename"], session["mime_type"],
+                session["ticket_id"], session["user_id"], upload_session_id=session["_id"]
+            )
+    except DuplicateKeyError:
+        # A finalize whose lease lapsed registered the session meanwhile.
+        media = media_summary(await db.media_files.find_one({"upload_session_id": session["_id"]}))
+    except BlobBusy:
+        # Back to uploading at full length: an empty PATCH retries the finalization.
+        await abort_finalize(db, session, finalizing_until)
+        raise tus_error(503, "Storage busy, retry the last request", **{"Upload-Offset": str(session["offset"])})
+    except Exception:
+        # Left in finalizing, the session could be neither retried nor terminated.
+        await abort_finalize(db, session, finalizing_until)
+        raise
+    await complete_session(db, session["_id"], media)
+    return {**session, "state": "completed", "media": media}
+
+@router.delete("/{upload_id}", status_code=204)
+async def terminate_upload(upload_id: str, db=Depends(get_database)):
+    try:
+        session = await find_session(db, upload_id)
+    except SessionNotFound:
+        raise tus_error(404, "Upload not found")
+    if session["state"] == "finalizing" and not finalize_stalled(session, datetime.utcnow()):
+        raise tus_error(409, "Upload is being finalized")
+    await delete_session(db, session)
+    return Response(status_code=204, headers=tus_headers())
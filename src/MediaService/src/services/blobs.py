@@ -0,0 +1,114 @@
+"""
+Content-addressed blob storage with reference counts
+"""
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import aiofiles.os
+import asyncio
+import os
+
+from ..config import settings
+from .storage import StagedFile, commit_staged, discard
+
+MAX_ACQUIRE_ATTEMPTS = 10
+ACQUIRE_RETRY_SECONDS = 0.05
+STALE_DELETION = timedelta(minutes=5)
+
+class BlobBusy(Exception):
+    pass
+
+def blob_filename(sha256: str, ext: str) -> str:
+    return f"{sha256}.{ext}"
+
+def blob_relative_path(stored_filename: str) -> str:
+    # Fan out by hash prefix to keep directories small.
+    return f"blobs/{stored_filename[:2]}/{stored_filename}"
+
+def blob_path(stored_filename: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, blob_relative_path(stored_filename))
+
+def blob_url(stored_filename: str) -> str:
+    return f"/uploads/{blob_relative_path(stored_filename)}"
+
+async def acquire_blob(db, staged: StagedFile, ext: str, mime_type: str) -> tuple[dict, bool]:
+    """
+    Take a reference on the blob for the staged content, creating it if
+    needed. Returns the blob and whether it was already stored, in which
+    case the staged copy is dropped. On BlobBusy the staged file is left to
+    the caller.
+    
+    A blob being deleted is excluded from the upsert filter, so the upsert
+    collides on _id and we retry until the deletion has finished instead of
+    pointing a new reference at a file that is about to disappear.
+    """
+    now = datetime.utcnow()
+    stored_filename = blob_filename(staged.sha256, ext)
+    for _ in range(MAX_ACQUIRE_ATTEMPTS):
+        try:
+            blob = await db.media_blobs.find_one_and_update(
+                {"_id": staged.sha256, "deleting": {"$ne": True}},
+                {
+                    "$inc": {"refcount": 1},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {
+                        "stored_filename": stored_filename,
+                        "path": blob_path(stored_filename),
+                        "size": staged.size,
+                        "mime_type": mime_type,
+                        "created_at": now
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            await finish_stale_deletion(db, staged.sha256, now)
+            await asyncio.sleep(ACQUIRE_RETRY_SECONDS)
+            continue
+        
+        if await aiofiles.os.path.exists(blob["path"]):
+            await discard(staged.path)
+            return blob, True
+        # New blob, or one whose first writer has not finished or died before
+        # renaming: the content is identical, so whoever renames last is fine.
+        await aiofiles.os.makedirs(os.path.dirname(blob["path"]), exist_ok=True)
+        await commit_staged(staged, blob["path"])
+        return blob, False
+    
+    raise BlobBusy(f"Blob {staged.sha256} is being deleted")
+
+async def release_blob(db, sha256: str) -> bool:
+    """
+    Drop one reference. The last one marks the blob as deleting, removes the
+    file and then the record. Returns whether the blob is gone.
+    """
+    blob = await db.media_blobs.find_one_and_update(
+        {"_id": sha256, "refcount": {"$gt": 0}},
+        {"$inc": {"refcount": -1}, "$set": {"updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not blob or blob["refcount"] > 0:
+        return False
+    
+    claimed = await db.media_blobs.find_one_and_update(
+        {"_id": sha256, "refcount": 0, "deleting": {"$ne": True}},
+        {"$set": {"deleting": True, "deleting_at": datetime.utcnow()}}
+    )
+    if not claimed:
+        return False
+    await discard(claimed["path"])
+    await db.media_blobs.delete_one({"_id": sha256, "deleting": True})
+    return True
+
+async def finish_stale_deletion(db, sha256: str, now: datetime):
+    # A deleter that died between marking the blob and removing it would
+    # otherwise block this content forever.
+    blob = await db.media_blobs.find_one({
+        "_id": sha256,
+        "deleting": True,
+        "deleting_at": {"$lt": now - STALE_DELETION}
+    })
+    if blob:
+        await discard(blob["path"])
+        await db.media_blobs.delete_one({"_id": sha256, "deleting": True})
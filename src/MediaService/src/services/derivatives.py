@@ -0,0 +1,132 @@
+"""
+Resized image derivatives generated on a process pool
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from ..config import settings
+from ..utils.imaging import render_derivative
+from .storage import discard
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+def derivative_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "derived")
+
+def derivative_filename(stored_filename: str, name: str) -> str:
+    spec = settings.DERIVATIVES[name]
+    stem = stored_filename.rsplit(".", 1)[0]
+    return f"{stem}.{name}.{FORMAT_EXTENSIONS[spec['format']]}"
+
+def derivative_path(stored_filename: str, name: str) -> str:
+    return os.path.join(derivative_dir(), derivative_filename(stored_filename, name))
+
+def derivative_url(stored_filename: str, name: str) -> str:
+    return f"/uploads/derived/{derivative_filename(stored_filename, name)}"
+
+def lazy_derivative_urls(file_id) -> dict[str, str]:
+    return {name: f"/api/v1/media/files/{file_id}/derivatives/{name}" for name in settings.DERIVATIVES}
+
+class DerivativePipeline:
+    """
+    Decoding and resizing photos is CPU-bound, so it runs in worker
+    processes and the event loop only awaits the results. Concurrent
+    requests for the same derivative share one render.
+    """
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._renders: dict[str, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+    
+    async def start(self):
+        os.makedirs(derivative_dir(), exist_ok=True)
+        # Spawned rather than forked: forking a process running an event loop
+        # and driver threads is unsafe.
+        self._pool = ProcessPoolExecutor(
+            max_workers=settings.DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    async def render(self, media_doc: dict, name: str) -> dict:
+        destination = derivative_path(media_doc["stored_filename"], name)
+        pending = self._renders.get(destination)
+        if pending:
+            return await asyncio.shield(pending)
+        
+        spec = settings.DERIVATIVES[name]
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, render_derivative,
+            media_doc["path"], destination, spec["width"], spec["format"],
+            spec.get("quality", settings.DERIVATIVE_QUALITY)
+        )
+        self._renders[destination] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            self._renders.pop(destination, None)
+        return {
+            **result,
+            "format": spec["format"],
+            "url": derivative_url(media_doc["stored_filename"], name),
+            "created_at": datetime.utcnow()
+        }
+    
+    async def ensure(self, db, media_doc: dict, name: str) -> str:
+        """
+        Path of the derivative, rendering it first if it is not on disk yet.
+        Files uploaded before derivatives existed are covered this way.
+        """
+        path = derivative_path(media_doc["stored_filename"], name)
+        if not os.path.exists(path):
+            derivative = await self.render(media_doc, name)
+            await db.media_files.update_one(
+                {"_id": media_doc["_id"]},
+                {"$set": {f"derivatives.{name}": derivative}}
+            )
+        return path
+    
+    def schedule(self, db, media_doc: dict):
+        task = asyncio.create_task(self._render_all(db, media_doc))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _render_all(self, db, media_doc: dict):
+        names = list(settings.DERIVATIVES)
+        results = await asyncio.gather(
+            *(self.render(media_doc, name) for name in names),
+            return_exceptions=True
+        )
+        derivatives = {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to render {name} for {media_doc['_id']}: {str(result)}")
+            else:
+                derivatives[f"derivatives.{name}"] = result
+        if not derivatives:
+            return
+        try:
+            await db.media_files.update_one({"_id": media_doc["_id"]}, {"$set": derivatives})
+        except PyMongoError as e:
+            logger.error(f"Failed to record derivatives for {media_doc['_id']}: {str(e)}")
+    
+    async def remove(self, media_doc: dict):
+        for name in settings.DERIVATIVES:
+            await discard(derivative_path(media_doc["stored_filename"], name))
+
+derivative_pipeline = DerivativePipeline()
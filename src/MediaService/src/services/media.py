@@ -0,0 +1,91 @@
+"""
+Registering and deleting media files
+"""
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from .blobs import acquire_blob, blob_url, release_blob
+from .derivatives import derivative_pipeline, lazy_derivative_urls
+from .storage import StagedFile, discard
+
+async def register_media(
+    db,
+    staged: StagedFile,
+    filename: str,
+    mime_type: Optional[str],
+    ticket_id: Optional[str],
+    user_id: Optional[str],
+    upload_session_id: Optional[str] = None
+) -> dict:
+    """
+    Store the staged upload as a blob and record a media_files document
+    referencing it. Identical content is stored once: a repeat upload only
+    adds a reference and reuses the blob's file and derivatives. A
+    resumable upload's session id is unique among media files, so a
+    session is registered at most once.
+    """
+    ext = filename.rsplit('.', 1)[1].lower()
+    blob, deduplicated = await acquire_blob(db, staged, ext, mime_type)
+    
+    media_doc = {
+        "filename": filename,
+        "stored_filename": blob["stored_filename"],
+        "mime_type": mime_type,
+        "size": staged.size,
+        "sha256": staged.sha256,
+        "blob_id": blob["_id"],
+        "ticket_id": ObjectId(ticket_id) if ticket_id else None,
+        "uploaded_by": ObjectId(user_id) if user_id else None,
+        "upload_date": datetime.utcnow(),
+        "path": blob["path"]
+    }
+    if upload_session_id:
+        media_doc["upload_session_id"] = upload_session_id
+    if deduplicated:
+        sibling = await db.media_files.find_one(
+            {"blob_id": blob["_id"], "derivatives": {"$exists": True}},
+            {"derivatives": 1}
+        )
+        if sibling:
+            media_doc["derivatives"] = sibling["derivatives"]
+    try:
+        await db.media_files.insert_one(media_doc)
+    except PyMongoError:
+        await release_media(db, media_doc)
+        raise
+    if "derivatives" not in media_doc:
+        derivative_pipeline.schedule(db, media_doc)
+    return media_summary(media_doc, deduplicated)
+
+def media_summary(media_doc: dict, deduplicated: bool = False) -> dict:
+    return {
+        "id": str(media_doc["_id"]),
+        "filename": media_doc["stored_filename"],
+        "url": blob_url(media_doc["stored_filename"]),
+        "sha256": media_doc["sha256"],
+        "deduplicated": deduplicated,
+        "derivatives": lazy_derivative_urls(media_doc["_id"])
+    }
+
+async def release_media(db, media_doc: dict):
+    """
+    Let go of the document's file. Blobs go away with their last reference,
+    taking the shared derivatives along; files stored before content
+    addressing belong to the one document.
+    """
+    if media_doc.get("blob_id"):
+        if not await release_blob(db, media_doc["blob_id"]):
+            return
+    else:
+        await discard(media_doc["path"])
+    await derivative_pipeline.remove(media_doc)
+
+async def delete_media(db, file_id: ObjectId) -> bool:
+    # Removing the document first makes each reference drop exactly once.
+    media_doc = await db.media_files.find_one_and_delete({"_id": file_id})
+    if not media_doc:
+        return False
+    await release_media(db, media_doc)
+    return True
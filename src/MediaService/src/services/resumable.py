@@ -0,0 +1,298 @@
+"""
+Resumable uploads following the tus 1.0 core protocol
+"""
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+import aiofiles
+import aiofiles.os
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import uuid
+
+from ..config import settings
+from .storage import StagedFile, discard
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,expiration,termination"
+
+class SessionNotFound(Exception):
+    pass
+
+class OffsetMismatch(Exception):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+class SessionBusy(Exception):
+    pass
+
+class SessionLockLost(Exception):
+    """The lock lapsed and another request claimed the session."""
+
+class UploadOverflow(Exception):
+    pass
+
+def parse_metadata(header: Optional[str]) -> dict[str, str]:
+    """
+    Upload-Metadata: comma-separated "key base64value" pairs; a key may
+    come without a value.
+    """
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode() if value else ""
+        except (binascii.Error, UnicodeDecodeError):
+            raise ValueError(f"Invalid Upload-Metadata value for {key}")
+    return metadata
+
+def sessions_dir() -> str:
+    # Next to the blobs so finalizing is a rename, and apart from .tmp, whose
+    # startup sweep would take sessions for abandoned single-request uploads.
+    return os.path.join(settings.UPLOAD_DIR, ".sessions")
+
+def session_path(session_id: str) -> str:
+    return os.path.join(sessions_dir(), f"{session_id}.upload")
+
+def expiry(now: datetime) -> datetime:
+    return now + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+
+async def create_session(db, length: int, metadata: dict[str, str]) -> dict:
+    now = datetime.utcnow()
+    session_id = uuid.uuid4().hex
+    session = {
+        "_id": session_id,
+        "state": "uploading",
+        "length": length,
+        "offset": 0,
+        "filename": metadata.get("filename"),
+        "mime_type": metadata.get("filetype"),
+        "ticket_id": metadata.get("ticket_id") or None,
+        "user_id": metadata.get("user_id") or None,
+        "path": session_path(session_id),
+        "created_at": now,
+        "expires_at": expiry(now)
+    }
+    async with aiofiles.open(session["path"], "wb"):
+        pass
+    try:
+        await db.upload_sessions.insert_one(session)
+    except PyMongoError:
+        await discard(session["path"])
+        raise
+    return session
+
+async def find_session(db, session_id: str) -> dict:
+    session = await db.upload_sessions.find_one({"_id": session_id, "expires_at": {"$gt": datetime.utcnow()}})
+    if not session:
+        raise SessionNotFound()
+    return session
+
+async def claim_session(db, session_id: str, offset: int) -> dict:
+    """
+    Lock the session for one PATCH at the offset the client believes it is
+    at. The lock is a lease, so a request that died holding it only blocks
+    the session until it lapses; the token tells this claim apart from any
+    later one.
+    """
+    now = datetime.utcnow()
+    session = await db.upload_sessions.find_one_and_update(
+        {
+            "_id": session_id,
+            "state": "uploading",
+            "offset": offset,
+            "expires_at": {"$gt": now},
+            "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+        },
+        {"$set": {
+            "locked_until": now + timedelta(seconds=settings.UPLOAD_SESSION_LOCK_SECONDS),
+            "lock_token": uuid.uuid4().hex
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if session:
+        return session
+    current = await find_session(db, session_id)
+    if current["offset"] != offset or current["state"] != "uploading":
+        raise OffsetMismatch(current["offset"])
+    raise SessionBusy()
+
+async def renew_lock(db, session: dict) -> datetime:
+    locked_until = datetime.utcnow() + timedelta(seconds=settings.UPLOAD_SESSION_LOCK_SECONDS)
+    result = await db.upload_sessions.update_one(
+        {"_id": session["_id"], "lock_token": session["lock_token"]},
+        {"$set": {"locked_until": locked_until}}
+    )
+    if not result.matched_count:
+        raise SessionLockLost()
+    return locked_until
+
+async def append_chunk(db, session: dict, chunks: AsyncIterator[bytes]):
+    """
+    Write the request body at the session's offset. Whatever arrived before
+    a dropped connection is kept, so the client resumes from there; a stale
+    tail left by an earlier crash is cut off.
+    
+    A slow body can outlive the lock, so it is checked before every chunk
+    and renewed once half of it has passed. Once lost, the file belongs to
+    another request and is not touched again, not even truncated.
+    """
+    remaining = session["length"] - session["offset"]
+    written = 0
+    locked_until = session["locked_until"]
+    renew_margin = timedelta(seconds=settings.UPLOAD_SESSION_LOCK_SECONDS / 2)
+    
+    async def hold_lock():
+        nonlocal locked_until
+        if datetime.utcnow() >= locked_until - renew_margin:
+            locked_until = await renew_lock(db, session)
+    
+    async with aiofiles.open(session["path"], "r+b") as file:
+        await file.seek(session["offset"])
+        try:
+            async for chunk in chunks:
+                if written + len(chunk) > remaining:
+                    raise UploadOverflow()
+                await hold_lock()
+                await file.write(chunk)
+                written += len(chunk)
+        finally:
+            await hold_lock()
+            await file.truncate(session["offset"] + written)
+
+async def release_session(db, session: dict) -> Optional[dict]:
+    """
+    Record the new offset and drop the lock. The file is only ever
+    truncated to what was written, so its size is the offset, however the
+    PATCH ended. None when the lock was lost to another request.
+    """
+    now = datetime.utcnow()
+    offset = await aiofiles.os.path.getsize(session["path"])
+    return await db.upload_sessions.find_one_and_update(
+        {"_id": session["_id"], "lock_token": session["lock_token"]},
+        {"$set": {
+            "offset": offset,
+            "locked_until": None,
+            "lock_token": None,
+            "expires_at": expiry(now),
+            "updated_at": now
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    async with aiofiles.open(path, "rb") as file:
+        while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def finalize_stalled(session: dict, now: datetime) -> bool:
+    return session["state"] == "finalizing" and (session.get("finalizing_until") or now) <= now
+
+async def begin_finalize(db, session: dict) -> Optional[datetime]:
+    """
+    Move a fully received session to finalizing. The finalize holds a
+    lease, so one that died midway is taken over by a later PATCH instead
+    of blocking the session until it expires. Returns the lease, which
+    also identifies this finalize, or None if it was not claimed.
+    """
+    now = datetime.utcnow()
+    finalizing_until = now + timedelta(seconds=settings.UPLOAD_SESSION_FINALIZE_SECONDS)
+    claimed = await db.upload_sessions.find_one_and_update(
+        {
+            "_id": session["_id"],
+            "offset": session["length"],
+            "$or": [
+                {"state": "uploading"},
+                {"state": "finalizing", "finalizing_until": None},
+                {"state": "finalizing", "finalizing_until": {"$lt": now}}
+            ]
+        },
+        {"$set": {"state": "finalizing", "finalizing_until": finalizing_until, "updated_at": now}}
+    )
+    return finalizing_until if claimed else None
+
+async def stage_session(session: dict) -> StagedFile:
+    # From here the file is an ordinary staged upload, registered like a single-request upload.
+    return StagedFile(path=session["path"], size=session["length"], sha256=await hash_file(session["path"]))
+
+async def abort_finalize(db, session: dict, finalizing_until: datetime) -> str:
+    """
+    Undo begin_finalize after registering the upload failed, unless another
+    finalize has taken over meanwhile. While the session file is still there
+    an empty PATCH retries; once it has been moved into blob storage the
+    upload cannot be finished and is failed.
+    """
+    state = "uploading" if await aiofiles.os.path.exists(session["path"]) else "failed"
+    await db.upload_sessions.update_one(
+        {"_id": session["_id"], "state": "finalizing", "finalizing_until": finalizing_until},
+        {"$set": {"state": state, "updated_at": datetime.utcnow()}}
+    )
+    return state
+
+async def complete_session(db, session_id: str, media: dict):
+    await db.upload_sessions.update_one(
+        {"_id": session_id},
+        {"$set": {"state": "completed", "media": media, "updated_at": datetime.utcnow()}}
+    )
+
+async def delete_session(db, session: dict):
+    await discard(session["path"])
+    await db.upload_sessions.delete_one({"_id": session["_id"]})
+
+class SessionSweeper:
+    """
+    Removes expired sessions and their partial files. Completed sessions are
+    kept until they expire so a client retrying its last PATCH still finds
+    out where its file went.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self, db):
+        self._db = db
+        await aiofiles.os.makedirs(sessions_dir(), exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                removed = await self.sweep()
+                if removed:
+                    logger.info(f"Removed {removed} expired upload sessions")
+            except PyMongoError as e:
+                logger.error(f"Failed to sweep upload sessions: {str(e)}")
+            await asyncio.sleep(settings.UPLOAD_SESSION_SWEEP_SECONDS)
+    
+    async def sweep(self) -> int:
+        removed = 0
+        async for session in self._db.upload_sessions.find(
+            {"expires_at": {"$lte": datetime.utcnow()}},
+            {"path": 1}
+        ):
+            await delete_session(self._db, session)
+            removed += 1
+        return removed
+
+session_sweeper = SessionSweeper()
@@ -0,0 +1,68 @@
+"""
+Streaming file storage for uploads
+"""
+from dataclasses import dataclass
+from fastapi import UploadFile
+import aiofiles
+import aiofiles.os
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+class UploadTooLarge(Exception):
+    pass
+
+@dataclass
+class StagedFile:
+    path: str
+    size: int
+    sha256: str
+
+def temp_dir() -> str:
+    # Inside UPLOAD_DIR so the final rename never crosses filesystems.
+    return os.path.join(settings.UPLOAD_DIR, ".tmp")
+
+def prepare_storage():
+    os.makedirs(temp_dir(), exist_ok=True)
+    cutoff = time.time() - settings.UPLOAD_TEMP_MAX_AGE_SECONDS
+    for entry in os.scandir(temp_dir()):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            logger.info(f"Removed stale upload {entry.name}")
+
+async def discard(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def stage_upload(file: UploadFile, max_size: int) -> StagedFile:
+    """
+    Copy the upload to a temp file chunk by chunk, hashing as it goes, and
+    give up as soon as it grows past max_size. The temp file is removed on
+    any failure, including the client going away mid-copy.
+    """
+    path = os.path.join(temp_dir(), f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(path, "wb") as out:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        await discard(path)
+        raise
+    return StagedFile(path=path, size=size, sha256=digest.hexdigest())
+
+async def commit_staged(staged: StagedFile, destination: str):
+    await aiofiles.os.replace(staged.path, destination)
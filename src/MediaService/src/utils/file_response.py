@@ -0,0 +1,128 @@
+"""
+File responses with validators, byte ranges and zero-copy sends
+"""
+from email.utils import formatdate
+from typing import Optional
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.types import Receive, Scope, Send
+import aiofiles
+import aiofiles.os
+import mimetypes
+
+CHUNK_SIZE = 256 * 1024
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    (start, end) inclusive for a single "bytes=" range, None to serve the
+    whole file. Multiple ranges are answered with the whole file, which the
+    spec allows. Raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not first.isdigit() and not last.isdigit():
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last.isdigit() else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range outside the file")
+    return start, end
+
+class RangeFileResponse(Response):
+    """
+    Sends [start, end] of a file. Servers offering the ASGI zero-copy send
+    extension get the file descriptor and do a sendfile(); otherwise the
+    file is read in chunks off the event loop.
+    """
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": count
+                })
+            return
+        
+        async with aiofiles.open(self.path, "rb") as file:
+            await file.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file shrank under us; close the response cleanly.
+                await send({"type": "http.response.body", "body": b""})
+
+async def file_response(
+    request: Request,
+    path: str,
+    etag: Optional[str],
+    cache_control: str,
+    media_type: Optional[str] = None
+) -> Response:
+    """
+    Serve a file with a strong ETag, honouring If-None-Match, Range and
+    If-Range. Without a content hash to use as the ETag, one is derived from
+    the file's mtime and size. Raises FileNotFoundError if it is missing.
+    """
+    stat = await aiofiles.os.stat(path)
+    etag = etag or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True)
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    headers["Content-Type"] = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    size = stat.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    send_body = request.method != "HEAD"
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return RangeFileResponse(path, 0, size - 1, 200, headers, send_body)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(path, start, end, 206, headers, send_body)
@@ -0,0 +1,110 @@
+"""
+Idempotency-Key handling for create endpoints
+"""
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from fastapi import HTTPException
+from fastapi.responses import Response
+from pymongo import IndexModel
+from pymongo.errors import DuplicateKeyError
+import hashlib
+
+from ..config import settings
+from .serialization import dumps
+
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADERS = ("content-type", "etag", "location")
+
+IDEMPOTENCY_INDEXES = [
+    IndexModel([("scope", 1), ("key", 1)], unique=True),
+    IndexModel([("expires_at", 1)], expireAfterSeconds=0)
+]
+
+def request_fingerprint(payload) -> str:
+    # Key order is not part of the request: a retry may serialize differently.
+    return hashlib.sha256(dumps(payload, sort_keys=True)).hexdigest()
+
+async def claim_key(db, scope: str, key: str, fingerprint: str) -> Optional[dict]:
+    """
+    Reserve the key for this request. Returns None when the caller owns it,
+    otherwise the record left by the earlier request. A pending record whose
+    lock has lapsed (the owner died mid-request) is taken over.
+    """
+    now = datetime.utcnow()
+    record = {
+        "scope": scope,
+        "key": key,
+        "fingerprint": fingerprint,
+        "state": "pending",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    }
+    try:
+        await db.idempotency_keys.insert_one(record)
+        return None
+    except DuplicateKeyError:
+        existing = await db.idempotency_keys.find_one({"scope": scope, "key": key})
+    
+    if existing and existing["state"] == "pending" and existing["expires_at"] <= now:
+        takeover = await db.idempotency_keys.update_one(
+            {"_id": existing["_id"], "state": "pending", "expires_at": existing["expires_at"]},
+            {"$set": {"fingerprint": fingerprint, "created_at": now, "expires_at": record["expires_at"]}}
+        )
+        if takeover.modified_count:
+            return None
+    return existing
+
+async def complete_key(db, scope: str, key: str, response: Response):
+    headers = {name: value for name, value in response.headers.items() if name in REPLAYED_HEADERS}
+    await db.idempotency_keys.update_one(
+        {"scope": scope, "key": key},
+        {"$set": {
+            "state": "completed",
+            "status_code": response.status_code,
+            "body": bytes(response.body),
+            "headers": headers,
+            "expires_at": datetime.utcnow() + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+        }}
+    )
+
+async def release_key(db, scope: str, key: str):
+    await db.idempotency_keys.delete_one({"scope": scope, "key": key, "state": "pending"})
+
+def replay_response(record: dict) -> Response:
+    headers = dict(record.get("headers") or {})
+    headers["Idempotent-Replayed"] = "true"
+    return Response(content=record["body"], status_code=record["status_code"], headers=headers)
+
+async def run_idempotent(
+    db,
+    scope: str,
+    key: Optional[str],
+    fingerprint: str,
+    handler: Callable[[], Awaitable[Response]]
+) -> Response:
+    """
+    Run a create handler at most once per (scope, key). A replay with the
+    same payload gets the stored response back; a different payload under
+    the same key is rejected. Failed attempts release the key so the client
+    can retry.
+    """
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key too long (max {MAX_KEY_LENGTH})")
+    
+    existing = await claim_key(db, scope, key, fingerprint)
+    if existing:
+        if existing["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+        if existing["state"] != "completed":
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+        return replay_response(existing)
+    
+    try:
+        response = await handler()
+    except Exception:
+        await release_key(db, scope, key)
+        raise
+    await complete_key(db, scope, key, response)
+    return response
@@ -0,0 +1,42 @@
+"""
+Image resizing, run inside worker processes
+"""
+from PIL import Image, ImageOps
+import os
+import uuid
+
+SAVE_OPTIONS = {
+    "JPEG": {"optimize": True, "progressive": True},
+    "WEBP": {"method": 4},
+    "PNG": {"optimize": True}
+}
+
+def render_derivative(source: str, destination: str, width: int, image_format: str, quality: int) -> dict:
+    """
+    Scale source to fit a width x width box (never upscaling), honouring the
+    EXIF orientation, and write it atomically to destination. Kept free of
+    service imports so spawned workers load only Pillow.
+    """
+    with Image.open(source) as image:
+        # JPEG can decode straight at a reduced scale, far cheaper than a full decode.
+        image.draft("RGB", (width, width))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, width), Image.Resampling.LANCZOS)
+        if image_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+        
+        temp_path = f"{destination}.{uuid.uuid4().hex}.part"
+        try:
+            image.save(temp_path, image_format, quality=quality, **SAVE_OPTIONS.get(image_format, {}))
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return {
+            "width": image.width,
+            "height": image.height,
+            "size": os.path.getsize(destination)
+        }
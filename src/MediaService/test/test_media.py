@@ -0,0 +1,450 @@
+"""
+Tests for MediaService
+"""
+import asyncio
+import hashlib
+import io
+import os
+import pytest
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+from src.config import settings
+from src.database import get_database
+from src.main import app
+from src.middleware.upload_limit import UploadLimitMiddleware
+from src.routes import uploads
+from src.routes.serve import resolve_upload_path
+from src.services import blobs, derivatives
+from src.services.blobs import BlobBusy, acquire_blob, release_blob
+from src.services.derivatives import DerivativePipeline, derivative_filename, derivative_url
+from src.services import resumable
+from src.services.resumable import (
+    OffsetMismatch,
+    SessionBusy,
+    SessionLockLost,
+    append_chunk,
+    claim_session,
+    create_session,
+    release_session
+)
+from src.services.storage import StagedFile, UploadTooLarge, prepare_storage, stage_upload, temp_dir
+from src.utils.file_response import parse_range
+from src.utils.imaging import render_derivative
+
+client = TestClient(app)
+
+def test_health_check():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    prepare_storage()
+    return tmp_path
+
+class FakeUpload:
+    def __init__(self, content: bytes):
+        self.stream = io.BytesIO(content)
+    
+    async def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+@pytest.mark.asyncio
+async def test_stage_upload_hashes_and_enforces_size_limit(upload_dir, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 4)
+    content = b"pothole photo bytes"
+    
+    staged = await stage_upload(FakeUpload(content), max_size=len(content))
+    assert staged.size == len(content)
+    assert staged.sha256 == hashlib.sha256(content).hexdigest()
+    with open(staged.path, "rb") as staged_file:
+        assert staged_file.read() == content
+    
+    with pytest.raises(UploadTooLarge):
+        await stage_upload(FakeUpload(content), max_size=len(content) - 1)
+    assert os.listdir(temp_dir()) == [os.path.basename(staged.path)]
+
+def test_upload_limit_middleware_rejects_large_bodies():
+    inner = FastAPI()
+    
+    @inner.post("/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+    
+    limited = TestClient(UploadLimitMiddleware(inner, paths=("/upload",), max_bytes=10))
+    assert limited.post("/upload", content=b"x" * 10).json() == {"size": 10}
+    assert limited.post("/upload", content=b"x" * 11).status_code == 413
+    
+    def chunked():
+        for _ in range(4):
+            yield b"x" * 4
+    
+    assert limited.post("/upload", content=chunked()).status_code == 413
+
+class FakeMediaFiles:
+    def __init__(self):
+        self.updates = []
+    
+    async def update_one(self, query, update):
+        self.updates.append((query, update))
+
+class FakeMediaDb:
+    def __init__(self):
+        self.media_files = FakeMediaFiles()
+
+def test_derivative_names_follow_format():
+    assert derivative_filename("abc.png", "thumb") == "abc.thumb.jpg"
+    assert derivative_filename("abc.jpeg", "medium_webp") == "abc.medium_webp.webp"
+    assert derivative_url("abc.png", "thumb") == "/uploads/derived/abc.thumb.jpg"
+
+@pytest.mark.asyncio
+async def test_derivative_ensure_renders_once(upload_dir, monkeypatch):
+    source = upload_dir / "photo.png"
+    Image.new("RGB", (800, 400), "red").save(source)
+    renders = []
+    
+    def counting_render(*args):
+        renders.append(args)
+        return render_derivative(*args)
+    
+    monkeypatch.setattr(derivatives, "render_derivative", counting_render)
+    os.makedirs(derivatives.derivative_dir())
+    pipeline = DerivativePipeline()
+    pipeline._pool = ThreadPoolExecutor(max_workers=2)
+    db = FakeMediaDb()
+    media_doc = {"_id": ObjectId(), "stored_filename": "photo.png", "path": str(source)}
+    
+    paths = await asyncio.gather(*(pipeline.ensure(db, media_doc, "thumb") for _ in range(3)))
+    assert len(set(paths)) == 1
+    with Image.open(paths[0]) as thumb:
+        assert thumb.size == (200, 100)
+        assert thumb.format == "JPEG"
+    await pipeline.ensure(db, media_doc, "thumb")
+    assert len(renders) == 1
+    
+    await pipeline.remove(media_doc)
+    assert not os.path.exists(paths[0])
+    await pipeline.stop()
+
+def matches(document, query):
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+            if "$gt" in condition and not (value is not None and value > condition["$gt"]):
+                return False
+            if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = {}
+    
+    async def insert_one(self, document):
+        self.documents[document["_id"]] = dict(document)
+    
+    async def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.documents.values() if matches(doc, query)), None)
+    
+    def apply(self, document, update):
+        document.update(update.get("$set", {}))
+        for field, count in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + count
+    
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        document = next((doc for doc in self.documents.values() if matches(doc, query)), None)
+        if document is None:
+            if not upsert:
+                return None
+            if query["_id"] in self.documents:
+                raise DuplicateKeyError("duplicate key")
+            document = self.documents[query["_id"]] = {"_id": query["_id"], **update.get("$setOnInsert", {})}
+            before = None
+        else:
+            before = dict(document)
+        self.apply(document, update)
+        return dict(document) if return_document else before
+    
+    async def update_one(self, query, update):
+        document = next((doc for doc in self.documents.values() if matches(doc, query)), None)
+        if document:
+            self.apply(document, update)
+        return type("Result", (), {"matched_count": int(document is not None)})()
+    
+    async def delete_one(self, query):
+        document = next((doc for doc in self.documents.values() if matches(doc, query)), None)
+        if document:
+            del self.documents[document["_id"]]
+        return type("Result", (), {"deleted_count": int(document is not None)})()
+
+class FakeBlobDb:
+    def __init__(self):
+        self.media_blobs = FakeCollection()
+
+async def staged_copy(content: bytes) -> StagedFile:
+    return await stage_upload(FakeUpload(content), max_size=len(content))
+
+@pytest.mark.asyncio
+async def test_blobs_deduplicate_and_count_references(upload_dir):
+    db = FakeBlobDb()
+    content = b"same photo twice"
+    
+    first = await staged_copy(content)
+    blob, existed = await acquire_blob(db, first, "jpg", "image/jpeg")
+    assert not existed
+    assert not os.path.exists(first.path)
+    assert blob["path"].startswith(str(upload_dir / "blobs" / first.sha256[:2]))
+    
+    second = await staged_copy(content)
+    blob, existed = await acquire_blob(db, second, "jpg", "image/jpeg")
+    assert existed
+    assert not os.path.exists(second.path)
+    assert blob["refcount"] == 2
+    
+    assert await release_blob(db, first.sha256) is False
+    assert os.path.exists(blob["path"])
+    assert await release_blob(db, first.sha256) is True
+    assert not os.path.exists(blob["path"])
+    assert db.media_blobs.documents == {}
+    assert await release_blob(db, first.sha256) is False
+
+@pytest.mark.asyncio
+async def test_blob_acquire_waits_out_deletions(upload_dir, monkeypatch):
+    monkeypatch.setattr(blobs, "ACQUIRE_RETRY_SECONDS", 0)
+    db = FakeBlobDb()
+    staged = await staged_copy(b"photo being deleted")
+    db.media_blobs.documents[staged.sha256] = {
+        "_id": staged.sha256,
+        "refcount": 0,
+        "path": blobs.blob_path(blobs.blob_filename(staged.sha256, "jpg")),
+        "deleting": True,
+        "deleting_at": datetime.utcnow()
+    }
+    
+    # A live deletion is never joined; the staged file stays with the caller.
+    with pytest.raises(BlobBusy):
+        await acquire_blob(db, staged, "jpg", "image/jpeg")
+    assert os.path.exists(staged.path)
+    
+    # A deleter that died long ago is finished off and the blob recreated.
+    db.media_blobs.documents[staged.sha256]["deleting_at"] -= timedelta(hours=1)
+    blob, existed = await acquire_blob(db, staged, "jpg", "image/jpeg")
+    assert not existed
+    assert blob["refcount"] == 1
+    assert "deleting" not in blob
+    assert os.path.exists(blob["path"])
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    for unsatisfiable in ("bytes=100-", "bytes=9-3", "bytes=-0"):
+        with pytest.raises(ValueError):
+            parse_range(unsatisfiable, 100)
+
+def test_serve_upload_ranges_and_validators(upload_dir):
+    content = b"0123456789" * 10
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = upload_dir / blobs.blob_relative_path(blobs.blob_filename(sha256, "txt"))
+    path.parent.mkdir(parents=True)
+    path.write_bytes(content)
+    url = blobs.blob_url(blobs.blob_filename(sha256, "txt"))
+    
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["etag"] == f'"{sha256}"'
+    assert "immutable" in response.headers["cache-control"]
+    
+    response = client.get(url, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+    assert response.headers["content-range"] == "bytes 10-19/100"
+    
+    response = client.get(url, headers={"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert client.get(url, headers={"Range": "bytes=100-"}).status_code == 416
+    assert client.get(url, headers={"If-None-Match": f'W/"{sha256}"'}).status_code == 304
+    
+    response = client.head(url)
+    assert response.headers["content-length"] == "100"
+    assert response.content == b""
+    
+    # Derivatives are never immutable, however the path is spelled.
+    (upload_dir / "derived").mkdir()
+    (upload_dir / "derived" / "x.thumb.jpg").write_bytes(b"thumb")
+    response = client.get("/uploads/blobs/%2E%2E/derived/x.thumb.jpg")
+    assert response.status_code == 200
+    assert "immutable" not in response.headers["cache-control"]
+
+def test_serve_upload_hides_dot_directories(upload_dir):
+    (upload_dir / ".tmp" / "upload.part").write_bytes(b"in progress")
+    (upload_dir / "blobs").mkdir()
+    
+    assert client.get("/uploads/.tmp/upload.part").status_code == 404
+    for path in ("blobs/../.tmp/upload.part", ".tmp/upload.part", "blobs/.hidden/file", "../etc/passwd", "."):
+        with pytest.raises(HTTPException) as error:
+            resolve_upload_path(path)
+        assert error.value.status_code == 404
+    assert resolve_upload_path("blobs/ab/file.jpg") == os.path.join(os.path.realpath(upload_dir), "blobs/ab/file.jpg")
+
+class FakeSessionDb:
+    def __init__(self):
+        self.upload_sessions = FakeCollection()
+        self.media_files = FakeCollection()
+
+async def body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+@pytest.fixture
+def session_db(upload_dir):
+    os.makedirs(resumable.sessions_dir())
+    db = FakeSessionDb()
+    app.dependency_overrides[get_database] = lambda: db
+    yield db
+    app.dependency_overrides.clear()
+
+@pytest.mark.asyncio
+async def test_upload_session_claims_track_offsets(session_db):
+    db = session_db
+    session = await create_session(db, 10, {"filename": "photo.jpg"})
+    
+    claimed = await claim_session(db, session["_id"], 0)
+    with pytest.raises(SessionBusy):
+        await claim_session(db, session["_id"], 0)
+    await append_chunk(db, claimed, body(b"01234", b"56"))
+    released = await release_session(db, claimed)
+    assert released["offset"] == 7
+    assert released["lock_token"] is None
+    with pytest.raises(OffsetMismatch) as error:
+        await claim_session(db, session["_id"], 0)
+    assert error.value.offset == 7
+    
+    # A lock about to lapse is renewed as the body streams in.
+    claimed = await claim_session(db, session["_id"], 7)
+    claimed["locked_until"] = datetime.utcnow() + timedelta(seconds=1)
+    await append_chunk(db, claimed, body(b"7"))
+    assert db.upload_sessions.documents[session["_id"]]["locked_until"] > claimed["locked_until"] + timedelta(seconds=60)
+    assert (await release_session(db, claimed))["offset"] == 8
+
+@pytest.mark.asyncio
+async def test_upload_session_lost_lock_stops_writes(session_db):
+    db = session_db
+    session = await create_session(db, 10, {"filename": "photo.jpg"})
+    stalled = await claim_session(db, session["_id"], 0)
+    
+    # The stalled request's lease lapses and another request takes over.
+    db.upload_sessions.documents[session["_id"]]["locked_until"] = datetime.utcnow() - timedelta(seconds=1)
+    stalled["locked_until"] = datetime.utcnow() - timedelta(seconds=1)
+    current = await claim_session(db, session["_id"], 0)
+    await append_chunk(db, current, body(b"abc"))
+    
+    with pytest.raises(SessionLockLost):
+        await append_chunk(db, stalled, body(b"xyz", b"w"))
+    assert await release_session(db, stalled) is None
+    assert (await release_session(db, current))["offset"] == 3
+    with open(session["path"], "rb") as upload:
+        assert upload.read() == b"abc"
+
+def test_upload_patch_answers_409_when_lock_is_lost(session_db, monkeypatch):
+    location = client.post("/api/v1/media/uploads/", headers={
+        "Upload-Length": "4",
+        "Upload-Metadata": "filename cGhvdG8uanBn"
+    }).headers["location"]
+    session_id = location.rsplit("/", 1)[1]
+    
+    async def taken_over(db, session, chunks):
+        async for chunk in chunks:
+            pass
+        db.upload_sessions.documents[session_id].update(lock_token="other", offset=2)
+        raise SessionLockLost()
+    
+    monkeypatch.setattr(uploads, "append_chunk", taken_over)
+    response = client.patch(location, content=b"abcd", headers={
+        "Upload-Offset": "0",
+        "Content-Type": "application/offset+octet-stream"
+    })
+    assert response.status_code == 409
+    assert response.headers["upload-offset"] == "2"
+
+def test_upload_finalize_failure_reopens_session(session_db, monkeypatch):
+    location = client.post("/api/v1/media/uploads/", headers={
+        "Upload-Length": "4",
+        "Upload-Metadata": "filename cGhvdG8uanBn"
+    }).headers["location"]
+    session_id = location.rsplit("/", 1)[1]
+    headers = {"Upload-Offset": "0", "Content-Type": "application/offset+octet-stream"}
+    
+    async def failing_register(*args, **kwargs):
+        raise RuntimeError("insert failed")
+    
+    monkeypatch.setattr(uploads, "register_media", failing_register)
+    with pytest.raises(RuntimeError):
+        client.patch(location, content=b"abcd", headers=headers)
+    assert session_db.upload_sessions.documents[session_id]["state"] == "uploading"
+    
+    async def register(db, staged, *args, upload_session_id=None):
+        assert upload_session_id == session_id
+        return {"id": str(ObjectId()), "url": f"/uploads/blobs/{staged.sha256}.jpg"}
+    
+    monkeypatch.setattr(uploads, "register_media", register)
+    response = client.patch(location, content=b"", headers={**headers, "Upload-Offset": "4"})
+    assert response.status_code == 204
+    assert response.headers["x-media-url"].startswith("/uploads/blobs/")
+    assert session_db.upload_sessions.documents[session_id]["state"] == "completed"
+
+def test_upload_finalize_takes_over_stalled_finalize(session_db, monkeypatch):
+    location = client.post("/api/v1/media/uploads/", headers={
+        "Upload-Length": "4",
+        "Upload-Metadata": "filename cGhvdG8uanBn"
+    }).headers["location"]
+    session_id = location.rsplit("/", 1)[1]
+    headers = {"Upload-Offset": "4", "Content-Type": "application/offset+octet-stream"}
+    
+    # A finalize that registered the media and then died holds the session.
+    media_id = ObjectId()
+    session_db.media_files.documents[media_id] = {
+        "_id": media_id, "stored_filename": "blobs/ab/abcd.jpg", "sha256": "abcd", "upload_session_id": session_id
+    }
+    session_db.upload_sessions.documents[session_id].update(
+        offset=4, state="finalizing", finalizing_until=datetime.utcnow() + timedelta(seconds=60)
+    )
+    
+    async def register(*args, **kwargs):
+        raise AssertionError("registered twice")
+    
+    monkeypatch.setattr(uploads, "register_media", register)
+    response = client.patch(location, content=b"", headers=headers)
+    assert response.status_code == 423
+    
+    session_db.upload_sessions.documents[session_id]["finalizing_until"] = datetime.utcnow() - timedelta(seconds=1)
+    response = client.patch(location, content=b"", headers=headers)
+    assert response.status_code == 204
+    assert response.headers["x-media-id"] == str(media_id)
+    assert session_db.upload_sessions.documents[session_id]["state"] == "completed"
+    
+    # Retrying the last request after completion answers with the same media.
+    response = client.patch(location, content=b"", headers=headers)
+    assert response.status_code == 204
+    assert response.headers["x-media-id"] == str(media_id)
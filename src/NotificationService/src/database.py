@@ -2,18 +2,55 @@
 Database connection for service
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import IndexModel
+from bson import ObjectId
 from pymongo.errors import ConnectionFailure
+import asyncio
 import logging
 from .config import settings
+from .utils.indexes import reconcile_indexes
 
 logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    index_task: asyncio.Task = None
 
 db_instance = Database()
 
+INDEXES = {
+    "notifications": [
+        IndexModel([("user_id", 1), ("created_at", -1)]),
+        IndexModel([("created_at", -1)]),
+        IndexModel([("read", 1)])
+    ],
+    "notification_preferences": [
+        IndexModel([("user_id", 1)], unique=True)
+    ]
+}
+
+QUERY_SHAPES = [
+    {
+        "name": "notifications_by_user",
+        "collection": "notifications",
+        "filter": {"user_id": ObjectId()},
+        "sort": [("created_at", -1)],
+        "limit": 50
+    },
+    {
+        "name": "notifications_recent",
+        "collection": "notifications",
+        "sort": [("created_at", -1)],
+        "limit": 50
+    },
+    {
+        "name": "preferences_by_user",
+        "collection": "notification_preferences",
+        "filter": {"user_id": ObjectId()}
+    }
+]
+
 async def connect_db():
     try:
         logger.info(f"Connecting to MongoDB...")
@@ -31,6 +68,8 @@ async def connect_db():
         raise
 
 async def close_db():
+    if db_instance.index_task and not db_instance.index_task.done():
+        db_instance.index_task.cancel()
     if db_instance.client:
         db_instance.client.close()
         logger.info("MongoDB connection closed")
@@ -41,6 +80,7 @@ async def get_database() -> AsyncIOMotorDatabase:
 async def init_database():
     try:
         db = await get_database()
+        db_instance.index_task = asyncio.create_task(reconcile_indexes(db, INDEXES))
         logger.info("Database initialized")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
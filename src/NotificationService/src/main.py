@@ -8,7 +8,9 @@ import logging
 import sys
 
 from .config import settings
-from .database import connect_db, close_db, init_database
+from .database import connect_db, close_db, init_database, get_database, QUERY_SHAPES
+from .utils.indexes import explain_query_shapes
+from .utils.serialization import MongoJSONResponse
 from .routes import notifications, preferences
 
 logging.basicConfig(
@@ -35,6 +37,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=MongoJSONResponse,
     lifespan=lifespan
 )
 
@@ -57,6 +60,10 @@ async def health_check():
 async def root():
     return {"service": settings.SERVICE_NAME, "version": "1.0.0", "docs": "/docs"}
 
+@app.get("/diagnostics/query-plans")
+async def query_plans():
+    return await explain_query_shapes(await get_database(), QUERY_SHAPES)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=settings.SERVICE_PORT, reload=settings.ENVIRONMENT == "development")
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from ..database import get_database
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
 from datetime import datetime
 
@@ -25,13 +26,9 @@ async def get_notifications(user_id: str = None, db=Depends(get_database)):
     
     notifications = []
     async for notif in db.notifications.find(query).sort("created_at", -1).limit(50):
-        notif["id"] = str(notif.pop("_id"))
-        notif["user_id"] = str(notif["user_id"])
-        if notif.get("ticket_id"):
-            notif["ticket_id"] = str(notif["ticket_id"])
-        notifications.append(notif)
+        notifications.append(with_id(notif))
     
-    return notifications
+    return MongoJSONResponse(notifications)
 
 @router.put("/{notification_id}/read")
 async def mark_notification_read(notification_id: str, db=Depends(get_database)):
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from ..database import get_database
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
 
 router = APIRouter()
@@ -15,9 +16,7 @@ async def get_preferences(user_id: str, db=Depends(get_database)):
             "in_app_enabled": True
         }
     
-    prefs["id"] = str(prefs.pop("_id"))
-    prefs["user_id"] = str(prefs["user_id"])
-    return prefs
+    return MongoJSONResponse(with_id(prefs))
 
 @router.put("/{user_id}")
 async def update_preferences(user_id: str, preferences_data: dict, db=Depends(get_database)):
@@ -1,9 +1,9 @@
 """
 CityFix Orchestrator - API Gateway and Service Orchestration
 """
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import logging
 import sys
 import httpx
@@ -32,6 +32,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Location", "ETag", "Content-Range", "Upload-Offset", "Upload-Length", "Upload-Expires",
+        "Tus-Resumable", "Tus-Version", "Tus-Extension", "Tus-Max-Size", "X-Media-Id", "X-Media-Url",
+        "X-Next-Cursor"
+    ]
 )
 
 SERVICE_URLS = {
@@ -64,6 +69,9 @@ async def proxy_request(service_url: str, path: str, request: Request):
             else:
                 return JSONResponse(status_code=405, content={"detail": "Method not allowed"})
             
+            if response.status_code == 304:
+                return Response(status_code=304, headers={"ETag": response.headers.get("etag", "")})
+            
             return JSONResponse(
                 status_code=response.status_code,
                 content=response.json() if response.headers.get('content-type', '').startswith('application/json') else {},
@@ -92,6 +100,68 @@ async def proxy_categories(path: str, request: Request):
 async def proxy_statistics(path: str, request: Request):
     return await proxy_request(SERVICE_URLS["admin"], f"/api/v1/statistics/{path}", request)
 
+@app.api_route("/api/v1/jobs/{path:path}", methods=["GET", "POST"])
+async def proxy_jobs(path: str, request: Request):
+    return await proxy_request(SERVICE_URLS["admin"], f"/api/v1/jobs/{path}", request)
+
+async def proxy_stream(service_url: str, path: str, request: Request):
+    headers = dict(request.headers)
+    headers.pop('host', None)
+    url = f"{service_url}{path}"
+    
+    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+    try:
+        upstream = await client.send(
+            client.build_request(
+                request.method,
+                url,
+                headers=headers,
+                params=request.query_params,
+                content=request.stream() if request.method in ("POST", "PUT", "PATCH") else None
+            ),
+            stream=True
+        )
+    except httpx.HTTPError as e:
+        await client.aclose()
+        logger.error(f"Error proxying to {url}: {str(e)}")
+        return JSONResponse(status_code=502, content={"detail": "Bad gateway"})
+    
+    async def relay():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+            await client.aclose()
+    
+    passthrough = {
+        name: value for name, value in upstream.headers.items()
+        if name.lower() in (
+            "cache-control", "content-disposition", "x-accel-buffering",
+            "etag", "last-modified", "accept-ranges", "content-range", "content-length",
+            "location", "upload-offset", "upload-length", "upload-expires",
+            "tus-resumable", "tus-version", "tus-extension", "tus-max-size", "x-media-id", "x-media-url"
+        )
+    }
+    return StreamingResponse(
+        relay(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get('content-type'),
+        headers=passthrough
+    )
+
+@app.get("/api/v1/tickets/stream")
+async def proxy_ticket_stream(request: Request):
+    return await proxy_stream(SERVICE_URLS["ticket"], "/api/v1/tickets/stream", request)
+
+@app.get("/api/v1/tickets/export")
+async def proxy_ticket_export(request: Request):
+    return await proxy_stream(SERVICE_URLS["ticket"], "/api/v1/tickets/export", request)
+
+@app.post("/api/v1/tickets/ingest")
+async def proxy_ticket_ingest(request: Request):
+    return await proxy_stream(SERVICE_URLS["ticket"], "/api/v1/tickets/ingest", request)
+
 @app.api_route("/api/v1/tickets/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def proxy_tickets(path: str, request: Request):
     return await proxy_request(SERVICE_URLS["ticket"], f"/api/v1/tickets/{path}", request)
@@ -104,6 +174,23 @@ async def proxy_comments(path: str, request: Request):
 async def proxy_feedback(path: str, request: Request):
     return await proxy_request(SERVICE_URLS["ticket"], f"/api/v1/feedback/{path}", request)
 
+@app.post("/api/v1/media/upload")
+async def proxy_media_upload(request: Request):
+    # Streamed so MediaService can reject oversized bodies early.
+    return await proxy_stream(SERVICE_URLS["media"], "/api/v1/media/upload", request)
+
+@app.api_route("/api/v1/media/uploads/{path:path}", methods=["POST", "HEAD", "PATCH", "DELETE", "OPTIONS"])
+async def proxy_media_uploads(path: str, request: Request):
+    return await proxy_stream(SERVICE_URLS["media"], f"/api/v1/media/uploads/{path}", request)
+
+@app.get("/api/v1/media/files/{file_id}/content")
+async def proxy_media_content(file_id: str, request: Request):
+    return await proxy_stream(SERVICE_URLS["media"], f"/api/v1/media/files/{file_id}/content", request)
+
+@app.get("/api/v1/media/files/{file_id}/derivatives/{name}")
+async def proxy_media_derivative(file_id: str, name: str, request: Request):
+    return await proxy_stream(SERVICE_URLS["media"], f"/api/v1/media/files/{file_id}/derivatives/{name}", request)
+
 @app.api_route("/api/v1/media/{path:path}", methods=["GET", "POST", "DELETE"])
 async def proxy_media(path: str, request: Request):
     return await proxy_request(SERVICE_URLS["media"], f"/api/v1/media/{path}", request)
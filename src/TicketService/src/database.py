@@ -2,18 +2,131 @@
 Database connection for service
 """
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import IndexModel
+from bson import ObjectId
+from datetime import datetime
 from pymongo.errors import ConnectionFailure
+import asyncio
 import logging
 from .config import settings
+from .utils.idempotency import IDEMPOTENCY_INDEXES
+from .utils.indexes import reconcile_indexes
+from .services.change_feed import enable_pre_images
+from .services.events import ensure_events_collection
+from .services.search import TEXT_INDEX_KEYS, TEXT_INDEX_WEIGHTS
 
 logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    index_task: asyncio.Task = None
 
 db_instance = Database()
 
+INDEXES = {
+    "tickets": [
+        IndexModel([("municipality_id", 1), ("status", 1), ("created_at", -1)]),
+        IndexModel([("municipality_id", 1), ("created_at", -1)]),
+        IndexModel([("municipality_id", 1), ("resolved_at", -1)]),
+        IndexModel([("status", 1), ("created_at", -1)]),
+        IndexModel([("created_at", -1)]),
+        IndexModel([("citizen_id", 1)]),
+        IndexModel([("assigned_operator_id", 1)]),
+        IndexModel([("municipality_id", 1), ("status", 1), ("triage_score", -1)]),
+        IndexModel([("assigned_operator_id", 1), ("status", 1), ("triage_score", -1)]),
+        IndexModel([("enrichment.status", 1), ("created_at", 1)]),
+        IndexModel([("location.coordinates", "2dsphere")]),
+        IndexModel(
+            TEXT_INDEX_KEYS,
+            name="tickets_text_search",
+            weights=TEXT_INDEX_WEIGHTS,
+            default_language=settings.SEARCH_LANGUAGE
+        )
+    ],
+    "ticket_comments": [
+        IndexModel([("ticket_id", 1), ("created_at", 1), ("_id", 1)])
+    ],
+    "ticket_outbox": [
+        IndexModel([("state", 1), ("available_at", 1)])
+    ],
+    "ticket_events": [
+        IndexModel([("ticket_id", 1), ("at", 1)])
+    ],
+    "ticket_feedback": [
+        IndexModel([("ticket_id", 1)], unique=True),
+        IndexModel([("citizen_id", 1)]),
+        IndexModel([("created_at", 1)], partialFilterExpression={"counted": False})
+    ],
+    "satisfaction_scores": [
+        IndexModel([("scope", 1), ("municipality_id", 1)])
+    ],
+    "idempotency_keys": IDEMPOTENCY_INDEXES
+}
+
+QUERY_SHAPES = [
+    {
+        "name": "tickets_by_municipality_and_status",
+        "collection": "tickets",
+        "filter": {"municipality_id": ObjectId(), "status": "received"},
+        "sort": [("created_at", -1)]
+    },
+    {
+        "name": "tickets_by_municipality",
+        "collection": "tickets",
+        "filter": {"municipality_id": ObjectId()},
+        "sort": [("created_at", -1)]
+    },
+    {
+        "name": "tickets_by_status",
+        "collection": "tickets",
+        "filter": {"status": "received"},
+        "sort": [("created_at", -1)]
+    },
+    {
+        "name": "tickets_resolved_since",
+        "collection": "tickets",
+        "filter": {"municipality_id": ObjectId(), "resolved_at": {"$gte": datetime(2026, 1, 1)}},
+        "sort": [("resolved_at", -1)]
+    },
+    {
+        "name": "triage_queue_by_municipality",
+        "collection": "tickets",
+        "filter": {"municipality_id": ObjectId(), "status": {"$in": ["received", "in_progress"]}},
+        "sort": [("triage_score", -1)],
+        "limit": 20
+    },
+    {
+        "name": "triage_queue_by_operator",
+        "collection": "tickets",
+        "filter": {"assigned_operator_id": ObjectId(), "status": {"$in": ["received", "in_progress"]}},
+        "sort": [("triage_score", -1)],
+        "limit": 20
+    },
+    {
+        "name": "ticket_events",
+        "collection": "ticket_events",
+        "filter": {"ticket_id": ObjectId()},
+        "sort": [("at", 1)]
+    },
+    {
+        "name": "ticket_comments",
+        "collection": "ticket_comments",
+        "filter": {"ticket_id": ObjectId()},
+        "sort": [("created_at", 1), ("_id", 1)]
+    },
+    {
+        "name": "ticket_feedback",
+        "collection": "ticket_feedback",
+        "filter": {"ticket_id": ObjectId()}
+    },
+    {
+        "name": "ticket_feedback_uncounted",
+        "collection": "ticket_feedback",
+        "filter": {"counted": False, "created_at": {"$lt": datetime(2026, 1, 1)}}
+    }
+]
+
 async def connect_db():
     try:
         logger.info(f"Connecting to MongoDB...")
@@ -31,6 +144,8 @@ async def connect_db():
         raise
 
 async def close_db():
+    if db_instance.index_task and not db_instance.index_task.done():
+        db_instance.index_task.cancel()
     if db_instance.client:
         db_instance.client.close()
         logger.info("MongoDB connection closed")
@@ -41,6 +156,9 @@ async def get_database() -> AsyncIOMotorDatabase:
 async def init_database():
     try:
         db = await get_database()
+        await ensure_events_collection(db)
+        await enable_pre_images(db)
+        db_instance.index_task = asyncio.create_task(reconcile_indexes(db, INDEXES))
         logger.info("Database initialized")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
@@ -8,8 +8,15 @@ import logging
 import sys
 
 from .config import settings
-from .database import connect_db, close_db, init_database
+from .database import connect_db, close_db, init_database, get_database, QUERY_SHAPES
+from .utils.indexes import explain_query_shapes
+from .utils.serialization import MongoJSONResponse
 from .routes import tickets, comments, feedback
+from .services.assignment import assignment_engine
+from .services.change_feed import change_feed
+from .services.enrichment import enrichment_workers
+from .services.satisfaction import satisfaction_recounter
+from .services.triage import triage_refresher
 
 logging.basicConfig(
     level=logging.INFO,
@@ -24,9 +31,19 @@ async def lifespan(app: FastAPI):
     logger.info(f"Starting {settings.SERVICE_NAME}...")
     await connect_db()
     await init_database()
+    await change_feed.start(await get_database())
+    await assignment_engine.start(await get_database())
+    await triage_refresher.start(await get_database())
+    await enrichment_workers.start(await get_database())
+    await satisfaction_recounter.start(await get_database())
     logger.info(f"{settings.SERVICE_NAME} started successfully on port {settings.SERVICE_PORT}")
     yield
     logger.info(f"Shutting down {settings.SERVICE_NAME}...")
+    await satisfaction_recounter.stop()
+    await enrichment_workers.stop()
+    await triage_refresher.stop()
+    await assignment_engine.stop()
+    await change_feed.stop()
     await close_db()
 
 app = FastAPI(
@@ -35,6 +52,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=MongoJSONResponse,
     lifespan=lifespan
 )
 
@@ -58,6 +76,10 @@ async def health_check():
 async def root():
     return {"service": settings.SERVICE_NAME, "version": "1.0.0", "docs": "/docs"}
 
+@app.get("/diagnostics/query-plans")
+async def query_plans():
+    return await explain_query_shapes(await get_database(), QUERY_SHAPES)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=settings.SERVICE_PORT, reload=settings.ENVIRONMENT == "development")
@@ -0,0 +1,9 @@
+from .ticket import (
+    TicketStatus,
+    OPEN_STATUSES
+)
+
+__all__ = [
+    "TicketStatus",
+    "OPEN_STATUSES"
+]
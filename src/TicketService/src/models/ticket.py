@@ -0,0 +1,11 @@
+"""
+Ticket models for TicketService
+"""
+from enum import Enum
+
+class TicketStatus(str, Enum):
+    RECEIVED = "received"
+    IN_PROGRESS = "in_progress"
+    RESOLVED = "resolved"
+
+OPEN_STATUSES = [TicketStatus.RECEIVED.value, TicketStatus.IN_PROGRESS.value]
@@ -1,27 +1,80 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException
+from ..config import settings
 from ..database import get_database
+from ..services.comments import (
+    MAX_SUMMARY_TICKETS,
+    build_summary_pipeline,
+    encode_cursor,
+    page_query
+)
+from ..utils.idempotency import request_fingerprint, run_idempotent
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
+from typing import Optional
 
 router = APIRouter()
 
 @router.post("/")
-async def create_comment(comment_data: dict, db=Depends(get_database)):
+async def create_comment(
+    comment_data: dict,
+    idempotency_key: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    return await run_idempotent(
+        db, "comments.create", idempotency_key, request_fingerprint(comment_data),
+        lambda: insert_comment(db, comment_data)
+    )
+
+async def insert_comment(db, comment_data: dict) -> MongoJSONResponse:
     comment_data["created_at"] = datetime.utcnow()
     if comment_data.get("ticket_id"):
         comment_data["ticket_id"] = ObjectId(comment_data["ticket_id"])
     if comment_data.get("user_id"):
         comment_data["user_id"] = ObjectId(comment_data["user_id"])
     result = await db.ticket_comments.insert_one(comment_data)
-    return {"id": str(result.inserted_id), "message": "Comment created"}
+    return MongoJSONResponse({"id": str(result.inserted_id), "message": "Comment created"})
+
+@router.post("/summary")
+async def get_comment_summary(summary_data: dict, db=Depends(get_database)):
+    ticket_ids = summary_data.get("ticket_ids") or []
+    if len(ticket_ids) > MAX_SUMMARY_TICKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many tickets (max {MAX_SUMMARY_TICKETS})"
+        )
+    try:
+        object_ids = [ObjectId(ticket_id) for ticket_id in ticket_ids]
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid ticket ID")
+    
+    summary = {str(ticket_id): {"count": 0, "latest": None} for ticket_id in object_ids}
+    async for group in db.ticket_comments.aggregate(build_summary_pipeline(object_ids)):
+        summary[str(group["_id"])] = {"count": group["count"], "latest": with_id(group["latest"])}
+    return MongoJSONResponse(summary)
 
 @router.get("/ticket/{ticket_id}")
-async def get_ticket_comments(ticket_id: str, db=Depends(get_database)):
-    comments = []
-    async for comment in db.ticket_comments.find({"ticket_id": ObjectId(ticket_id)}).sort("created_at", 1):
-        comment["id"] = str(comment.pop("_id"))
-        comment["ticket_id"] = str(comment["ticket_id"])
-        if comment.get("user_id"):
-            comment["user_id"] = str(comment["user_id"])
-        comments.append(comment)
-    return comments
+async def get_ticket_comments(
+    ticket_id: str,
+    cursor: Optional[str] = None,
+    limit: int = settings.COMMENTS_DEFAULT_PAGE_SIZE,
+    db=Depends(get_database)
+):
+    limit = min(max(limit, 1), settings.COMMENTS_MAX_PAGE_SIZE)
+    try:
+        query = page_query(ObjectId(ticket_id), cursor)
+    except (InvalidId, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid ticket ID or cursor")
+    
+    comments = await db.ticket_comments.find(query).sort(
+        [("created_at", 1), ("_id", 1)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+    
+    # The body stays a bare list for existing callers; the next page is
+    # announced in a header.
+    headers = {}
+    if len(comments) > limit:
+        comments = comments[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(comments[-1])
+    return MongoJSONResponse([with_id(comment) for comment in comments], headers=headers)
@@ -1,31 +1,88 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from ..database import get_database
+from ..services.satisfaction import SCOPES, count_feedback, parse_rating, parse_ref, satisfaction_id, satisfaction_summary
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
 from datetime import datetime
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.post("/")
 async def create_feedback(feedback_data: dict, db=Depends(get_database)):
     feedback_data["created_at"] = datetime.utcnow()
-    if feedback_data.get("ticket_id"):
-        feedback_data["ticket_id"] = ObjectId(feedback_data["ticket_id"])
+    if not feedback_data.get("ticket_id"):
+        raise HTTPException(status_code=400, detail="Missing ticket_id")
+    feedback_data["ticket_id"] = ObjectId(feedback_data["ticket_id"])
     if feedback_data.get("citizen_id"):
         feedback_data["citizen_id"] = ObjectId(feedback_data["citizen_id"])
+    try:
+        rating = parse_rating(feedback_data.get("rating"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    feedback_data["rating"] = rating
     
-    existing = await db.ticket_feedback.find_one({"ticket_id": feedback_data["ticket_id"]})
-    if existing:
-        raise HTTPException(status_code=400, detail="Feedback already exists for this ticket")
+    ticket = await db.tickets.find_one(
+        {"_id": feedback_data["ticket_id"]},
+        {"assigned_operator_id": 1, "municipality_id": 1, "category": 1}
+    )
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    # Who and what was rated, as it stood when the feedback was given.
+    feedback_data["assigned_operator_id"] = ticket.get("assigned_operator_id")
+    feedback_data["municipality_id"] = ticket.get("municipality_id")
+    feedback_data["category"] = ticket.get("category")
+    feedback_data["counted"] = False
     
-    result = await db.ticket_feedback.insert_one(feedback_data)
+    # The unique ticket_id index makes the insert the only gate, so a
+    # rating is counted into the aggregates once.
+    try:
+        result = await db.ticket_feedback.insert_one(feedback_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Feedback already exists for this ticket")
+    try:
+        await count_feedback(db, feedback_data)
+    except PyMongoError as e:
+        # The feedback is stored; the recounter adds the rating later.
+        logger.warning(f"Failed to count rating for ticket {feedback_data['ticket_id']}: {str(e)}")
     return {"id": str(result.inserted_id), "message": "Feedback created"}
 
 @router.get("/ticket/{ticket_id}")
 async def get_ticket_feedback(ticket_id: str, db=Depends(get_database)):
     feedback = await db.ticket_feedback.find_one({"ticket_id": ObjectId(ticket_id)})
-    if feedback:
-        feedback["id"] = str(feedback.pop("_id"))
-        feedback["ticket_id"] = str(feedback["ticket_id"])
-        if feedback.get("citizen_id"):
-            feedback["citizen_id"] = str(feedback["citizen_id"])
-    return feedback
+    return MongoJSONResponse(with_id(feedback) if feedback else None)
+
+def check_scope(scope: str):
+    if scope not in SCOPES:
+        raise HTTPException(status_code=404, detail=f"scope must be one of {', '.join(SCOPES)}")
+
+@router.get("/satisfaction/{scope}")
+async def satisfaction_leaderboard(
+    scope: str,
+    municipality_id: Optional[str] = None,
+    min_count: int = Query(1, ge=0),
+    limit: int = Query(20, ge=1, le=200),
+    db=Depends(get_database)
+):
+    check_scope(scope)
+    query = {"scope": scope, "count": {"$gte": min_count}}
+    if municipality_id:
+        query["municipality_id"] = ObjectId(municipality_id)
+    # One document per operator, municipality or category: small enough to rank in memory.
+    summaries = [satisfaction_summary(document) async for document in db.satisfaction_scores.find(query)]
+    summaries.sort(key=lambda summary: (-(summary["score"] or 0), -summary["count"], str(summary["ref"])))
+    return MongoJSONResponse(summaries[:limit])
+
+@router.get("/satisfaction/{scope}/{ref}")
+async def get_satisfaction(scope: str, ref: str, db=Depends(get_database)):
+    check_scope(scope)
+    try:
+        ref = parse_ref(scope, ref)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    document = await db.satisfaction_scores.find_one({"_id": satisfaction_id(scope, ref)})
+    return MongoJSONResponse(satisfaction_summary(document or {"scope": scope, "ref": ref}))
@@ -1,23 +1,208 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from ..config import settings
 from ..database import get_database
+from ..models.ticket import OPEN_STATUSES
+from ..services.assignment import assignment_engine
+from ..services.change_feed import change_feed, format_sse
+from ..services.enrichment import enrichment_workers
+from ..services.events import make_event, record_events
+from ..services.export import (
+    DEFAULT_EXPORT_FIELDS,
+    EXPORT_FORMATS,
+    build_projection,
+    stream_csv,
+    stream_ndjson
+)
+from ..services.ingest import ingest_ndjson
+from ..services.search import build_search_pipeline
+from ..services.tickets import (
+    MAX_BULK_OPERATIONS,
+    TicketConflictError,
+    TicketPreconditionFailed,
+    apply_ticket_changes,
+    build_bulk_requests,
+    etag_matches,
+    init_ticket_timings,
+    list_etag,
+    normalize_changes,
+    parse_bulk_operation,
+    parse_version,
+    record_ticket_changes,
+    ticket_etag
+)
+from ..utils.idempotency import request_fingerprint, run_idempotent
+from ..utils.serialization import MongoJSONResponse, with_id
 from bson import ObjectId
-from datetime import datetime
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.post("/")
-async def create_ticket(ticket_data: dict, db=Depends(get_database)):
+async def create_ticket(
+    ticket_data: dict,
+    idempotency_key: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    return await run_idempotent(
+        db, "tickets.create", idempotency_key, request_fingerprint(ticket_data),
+        lambda: insert_ticket(db, ticket_data)
+    )
+
+async def insert_ticket(db, ticket_data: dict) -> MongoJSONResponse:
+    now = datetime.utcnow()
+    ticket_data = normalize_changes(ticket_data)
     ticket_data["status"] = "received"
-    ticket_data["created_at"] = datetime.utcnow()
-    ticket_data["updated_at"] = datetime.utcnow()
-    result = await db.tickets.insert_one(ticket_data)
-    return {"id": str(result.inserted_id), **ticket_data}
+    ticket_data["created_at"] = now
+    ticket_data["updated_at"] = now
+    init_ticket_timings(ticket_data, now)
+    ticket_data["enrichment"] = {"status": "pending"}
+    
+    operator = None
+    if settings.AUTO_ASSIGN_ON_CREATE and not ticket_data.get("assigned_operator_id"):
+        operator = assignment_engine.choose(ticket_data)
+        if operator:
+            ticket_data["assigned_operator_id"] = operator.id
+    
+    await db.tickets.insert_one(ticket_data)
+    events = [make_event(ticket_data, "created", now)]
+    if operator:
+        events.append(make_event(
+            ticket_data, "assignment_changed", now,
+            field="assigned_operator_id", previous=None, value=operator.id
+        ))
+    await record_events(db, events)
+    await record_ticket_changes(db, [(None, ticket_data)])
+    assignment_engine.record_change({}, ticket_data)
+    await enrichment_workers.enqueue(ticket_data["_id"])
+    return MongoJSONResponse(with_id(ticket_data), headers={"ETag": ticket_etag(1)})
+
+@router.post("/bulk")
+async def bulk_update_tickets(bulk_data: dict, db=Depends(get_database)):
+    items = bulk_data.get("operations") or []
+    if not items:
+        raise HTTPException(status_code=400, detail="No operations provided")
+    if len(items) > MAX_BULK_OPERATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many operations (max {MAX_BULK_OPERATIONS})"
+        )
+    
+    now = datetime.utcnow()
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            ticket_id, changes = parse_bulk_operation(item)
+        except (ValueError, TypeError, InvalidId) as e:
+            ticket_ref = item.get("ticket_id") if isinstance(item, dict) else None
+            results[index] = {"ticket_id": ticket_ref, "success": False, "error": str(e)}
+            continue
+        parsed.append((index, ticket_id, changes))
+    
+    befores = {}
+    if parsed:
+        async for ticket in db.tickets.find({"_id": {"$in": [ticket_id for _, ticket_id, _ in parsed]}}):
+            befores[ticket["_id"]] = ticket
+    
+    pending = []
+    seen = set()
+    for index, ticket_id, changes in parsed:
+        if ticket_id not in befores:
+            results[index] = {"ticket_id": str(ticket_id), "success": False, "error": "Ticket not found"}
+        elif ticket_id in seen:
+            results[index] = {"ticket_id": str(ticket_id), "success": False, "error": "Duplicate ticket_id in batch"}
+        else:
+            seen.add(ticket_id)
+            pending.append((index, ticket_id, changes))
+    
+    if pending:
+        requests, events, written = build_bulk_requests(
+            befores, [(ticket_id, changes) for _, ticket_id, changes in pending], now
+        )
+        write_errors = {}
+        try:
+            await db.tickets.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                write_errors[error["index"]] = error.get("errmsg", "Write failed")
+        
+        # Every applied update carries this request's updated_at.
+        applied = set(await db.tickets.distinct(
+            "_id", {"_id": {"$in": list(seen)}, "updated_at": now}
+        ))
+        applied_events = []
+        applied_changes = []
+        for position, (index, ticket_id, changes) in enumerate(pending):
+            if position in write_errors:
+                results[index] = {"ticket_id": str(ticket_id), "success": False, "error": write_errors[position]}
+            elif ticket_id not in applied:
+                results[index] = {"ticket_id": str(ticket_id), "success": False, "error": "Ticket changed concurrently, retry"}
+            else:
+                results[index] = {"ticket_id": str(ticket_id), "success": True}
+                applied_events.extend(events[ticket_id])
+                applied_changes.append((befores[ticket_id], {**befores[ticket_id], **written[ticket_id]}))
+                assignment_engine.record_change(befores[ticket_id], changes)
+        await record_events(db, applied_events)
+        await record_ticket_changes(db, applied_changes)
+    
+    succeeded = sum(1 for result in results if result["success"])
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+@router.post("/ingest")
+async def ingest_tickets(request: Request, db=Depends(get_database)):
+    # Migration path: rows keep their history, no events or auto-assignment.
+    return await ingest_ndjson(
+        db,
+        request.stream(),
+        batch_size=settings.INGEST_BATCH_SIZE,
+        max_in_flight=settings.INGEST_MAX_IN_FLIGHT,
+        max_line_bytes=settings.INGEST_MAX_LINE_BYTES,
+        max_errors=settings.INGEST_MAX_REPORTED_ERRORS
+    )
+
+@router.post("/rebalance")
+async def rebalance_tickets(rebalance_data: dict, db=Depends(get_database)):
+    municipality_id = rebalance_data.get("municipality_id")
+    if not municipality_id or not ObjectId.is_valid(municipality_id):
+        raise HTTPException(status_code=400, detail="Valid municipality_id required")
+    municipality = ObjectId(municipality_id)
+    tickets = await db.tickets.find(
+        {"municipality_id": municipality, "status": "received"}
+    ).sort("created_at", 1).to_list(length=settings.ASSIGNMENT_REBALANCE_LIMIT)
+    plan = assignment_engine.plan_rebalance(municipality, tickets)
+    if not plan:
+        return {"considered": len(tickets), "reassigned": 0, "conflicts": 0}
+    
+    now = datetime.utcnow()
+    befores = {ticket["_id"]: ticket for ticket, _ in plan}
+    operations = [(ticket["_id"], {"assigned_operator_id": operator_id}) for ticket, operator_id in plan]
+    requests, events, _ = build_bulk_requests(befores, operations, now)
+    try:
+        await db.tickets.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        logger.error(f"Rebalance write errors: {e.details.get('writeErrors', [])}")
+    
+    applied = set(await db.tickets.distinct("_id", {"_id": {"$in": list(befores)}, "updated_at": now}))
+    applied_events = []
+    for ticket_id, changes in operations:
+        if ticket_id in applied:
+            applied_events.extend(events[ticket_id])
+            assignment_engine.record_change(befores[ticket_id], changes)
+    await record_events(db, applied_events)
+    return {"considered": len(tickets), "reassigned": len(applied), "conflicts": len(plan) - len(applied)}
 
 @router.get("/")
 async def get_tickets(
     status: Optional[str] = None,
     municipality_id: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     db=Depends(get_database)
 ):
     query = {}
@@ -26,56 +211,270 @@ async def get_tickets(
     if municipality_id:
         query["municipality_id"] = ObjectId(municipality_id)
     
-    tickets = []
-    async for ticket in db.tickets.find(query).sort("created_at", -1):
-        ticket["id"] = str(ticket.pop("_id"))
-        if ticket.get("municipality_id"):
-            ticket["municipality_id"] = str(ticket["municipality_id"])
-        if ticket.get("citizen_id"):
-            ticket["citizen_id"] = str(ticket["citizen_id"])
-        if ticket.get("assigned_operator_id"):
-            ticket["assigned_operator_id"] = str(ticket["assigned_operator_id"])
-        tickets.append(ticket)
-    return tickets
+    if if_none_match:
+        # Compare (_id, version) pairs before pulling full documents.
+        versions = await db.tickets.find(query, {"version": 1}).sort("created_at", -1).to_list(length=None)
+        etag = list_etag(versions)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    
+    tickets = await db.tickets.find(query).sort("created_at", -1).to_list(length=None)
+    etag = list_etag(tickets)
+    return MongoJSONResponse([with_id(ticket) for ticket in tickets], headers={"ETag": etag})
+
+@router.get("/search")
+async def search_tickets(
+    q: str,
+    municipality_id: str,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    db=Depends(get_database)
+):
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), settings.SEARCH_MAX_PAGE_SIZE)
+    
+    pipeline = build_search_pipeline(
+        q,
+        ObjectId(municipality_id),
+        status=status,
+        category=category,
+        skip=(page - 1) * page_size,
+        limit=page_size,
+        recency_half_life_days=settings.SEARCH_RECENCY_HALF_LIFE_DAYS
+    )
+    facets = await db.tickets.aggregate(pipeline).to_list(length=1)
+    facets = facets[0] if facets else {}
+    
+    total = facets.get("total") or [{"count": 0}]
+    return MongoJSONResponse({
+        "total": total[0]["count"],
+        "page": page,
+        "page_size": page_size,
+        "results": [with_id(ticket) for ticket in facets.get("results", [])],
+        "facets": {
+            "status": {bucket["_id"]: bucket["count"] for bucket in facets.get("status", [])},
+            "category": {bucket["_id"]: bucket["count"] for bucket in facets.get("category", [])}
+        }
+    })
+
+@router.get("/export")
+async def export_tickets(
+    municipality_id: str,
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    db=Depends(get_database)
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format, expected one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else DEFAULT_EXPORT_FIELDS
+    
+    query = {"municipality_id": ObjectId(municipality_id)}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    
+    cursor = db.tickets.find(query, build_projection(field_list)).sort(
+        "created_at", 1
+    ).batch_size(settings.EXPORT_BATCH_SIZE)
+    if format == "csv":
+        body = stream_csv(cursor, field_list, settings.EXPORT_BATCH_SIZE)
+    else:
+        body = stream_ndjson(cursor, settings.EXPORT_BATCH_SIZE)
+    
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="tickets-{municipality_id}.{format}"'}
+    )
+
+@router.get("/sla-breaches")
+async def get_sla_breaches(
+    municipality_id: str,
+    threshold_hours: float,
+    since: Optional[datetime] = None,
+    limit: int = 100,
+    db=Depends(get_database)
+):
+    now = datetime.utcnow()
+    threshold_seconds = threshold_hours * 3600
+    limit = min(max(limit, 1), 500)
+    municipality = ObjectId(municipality_id)
+    
+    resolved_query = {
+        "municipality_id": municipality,
+        "resolved_at": {"$gte": since or now - timedelta(days=7)},
+        "resolution_seconds": {"$gt": threshold_seconds}
+    }
+    open_query = {
+        "municipality_id": municipality,
+        "status": {"$in": OPEN_STATUSES},
+        "created_at": {"$lt": now - timedelta(seconds=threshold_seconds)}
+    }
+    resolved = await db.tickets.find(resolved_query).sort("resolved_at", -1).limit(limit).to_list(length=limit)
+    still_open = await db.tickets.find(open_query).sort("created_at", 1).limit(limit).to_list(length=limit)
+    return MongoJSONResponse({
+        "resolved_late": [with_id(ticket) for ticket in resolved],
+        "open_overdue": [with_id(ticket) for ticket in still_open]
+    })
+
+@router.get("/queue")
+async def get_triage_queue(
+    municipality_id: Optional[str] = None,
+    assigned_operator_id: Optional[str] = None,
+    limit: int = 20,
+    db=Depends(get_database)
+):
+    if bool(municipality_id) == bool(assigned_operator_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Provide exactly one of municipality_id or assigned_operator_id"
+        )
+    limit = min(max(limit, 1), settings.TRIAGE_QUEUE_MAX_LIMIT)
+    
+    query = {"status": {"$in": OPEN_STATUSES}}
+    if municipality_id:
+        query["municipality_id"] = ObjectId(municipality_id)
+    else:
+        query["assigned_operator_id"] = ObjectId(assigned_operator_id)
+    
+    tickets = await db.tickets.find(query).sort("triage_score", -1).limit(limit).to_list(length=limit)
+    return MongoJSONResponse([with_id(ticket) for ticket in tickets])
+
+@router.get("/stream")
+async def stream_ticket_changes(
+    request: Request,
+    ticket_id: Optional[str] = None,
+    municipality_id: Optional[str] = None,
+    assigned_operator_id: Optional[str] = None
+):
+    if not change_feed.available:
+        raise HTTPException(status_code=503, detail="Ticket change feed unavailable")
+    
+    subscription = change_feed.subscribe(
+        {
+            "ticket_id": ticket_id,
+            "municipality_id": municipality_id,
+            "assigned_operator_id": assigned_operator_id
+        },
+        last_event_id=request.headers.get("last-event-id")
+    )
+    
+    async def event_stream():
+        try:
+            while not subscription.closed or not subscription.queue.empty():
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.queue.get(),
+                        timeout=settings.CHANGE_FEED_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            change_feed.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/{ticket_id}")
-async def get_ticket(ticket_id: str, db=Depends(get_database)):
+async def get_ticket(
+    ticket_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    if if_none_match:
+        current = await db.tickets.find_one({"_id": ObjectId(ticket_id)}, {"version": 1})
+        if current and etag_matches(if_none_match, ticket_etag(current.get("version"))):
+            return Response(status_code=304, headers={"ETag": ticket_etag(current.get("version"))})
+    
     ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    ticket["id"] = str(ticket.pop("_id"))
-    if ticket.get("municipality_id"):
-        ticket["municipality_id"] = str(ticket["municipality_id"])
-    if ticket.get("citizen_id"):
-        ticket["citizen_id"] = str(ticket["citizen_id"])
-    if ticket.get("assigned_operator_id"):
-        ticket["assigned_operator_id"] = str(ticket["assigned_operator_id"])
-    return ticket
+    return MongoJSONResponse(with_id(ticket), headers={"ETag": ticket_etag(ticket.get("version"))})
 
-@router.put("/{ticket_id}")
-async def update_ticket(ticket_id: str, update_data: dict, db=Depends(get_database)):
-    update_data["updated_at"] = datetime.utcnow()
-    result = await db.tickets.update_one(
-        {"_id": ObjectId(ticket_id)},
-        {"$set": update_data}
-    )
-    if result.modified_count == 0:
+@router.post("/{ticket_id}/assign")
+async def auto_assign_ticket(ticket_id: str, db=Depends(get_database)):
+    ticket = await db.tickets.find_one({"_id": ObjectId(ticket_id)})
+    if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    return {"message": "Updated successfully"}
-
-@router.put("/{ticket_id}/status")
-async def update_ticket_status(ticket_id: str, status_data: dict, db=Depends(get_database)):
-    update_data = {
-        "status": status_data.get("status"),
-        "updated_at": datetime.utcnow()
-    }
-    if status_data.get("status") == "resolved":
-        update_data["resolved_at"] = datetime.utcnow()
+    operator = assignment_engine.choose(ticket)
+    if not operator:
+        raise HTTPException(status_code=409, detail="No operator available")
     
-    result = await db.tickets.update_one(
-        {"_id": ObjectId(ticket_id)},
-        {"$set": update_data}
+    changes = {"assigned_operator_id": operator.id}
+    try:
+        before = await apply_ticket_changes(db, ticket["_id"], changes)
+    except TicketConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not before:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    assignment_engine.record_change(before, changes)
+    return MongoJSONResponse(
+        {"assigned_operator_id": operator.id},
+        headers={"ETag": ticket_etag((before.get("version") or 0) + 1)}
     )
-    if result.modified_count == 0:
+
+@router.get("/{ticket_id}/events")
+async def get_ticket_events(ticket_id: str, db=Depends(get_database)):
+    events = []
+    async for event in db.ticket_events.find({"ticket_id": ObjectId(ticket_id)}).sort("at", 1):
+        event.pop("_id", None)
+        events.append(event)
+    return MongoJSONResponse(events)
+
+async def update_with_precondition(db, ticket_id: str, changes: dict, if_match: Optional[str]) -> str:
+    expected_version = None
+    if if_match and if_match.strip() != "*":
+        expected_version = parse_version(if_match)
+        if expected_version is None:
+            raise HTTPException(status_code=412, detail="Invalid If-Match header")
+    try:
+        before = await apply_ticket_changes(
+            db, ObjectId(ticket_id), changes, expected_version=expected_version
+        )
+    except TicketPreconditionFailed as e:
+        raise HTTPException(status_code=412, detail=str(e))
+    except TicketConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not before:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    return {"message": "Status updated successfully"}
+    assignment_engine.record_change(before, changes)
+    return ticket_etag((before.get("version") or 0) + 1)
+
+@router.put("/{ticket_id}")
+async def update_ticket(
+    ticket_id: str,
+    update_data: dict,
+    if_match: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    etag = await update_with_precondition(db, ticket_id, normalize_changes(update_data), if_match)
+    return MongoJSONResponse({"message": "Updated successfully"}, headers={"ETag": etag})
+
+@router.put("/{ticket_id}/status")
+async def update_ticket_status(
+    ticket_id: str,
+    status_data: dict,
+    if_match: Optional[str] = Header(None),
+    db=Depends(get_database)
+):
+    etag = await update_with_precondition(db, ticket_id, {"status": status_data.get("status")}, if_match)
+    return MongoJSONResponse({"message": "Status updated successfully"}, headers={"ETag": etag})
@@ -0,0 +1,179 @@
+"""
+Automatic operator assignment
+"""
+from dataclasses import dataclass, replace
+from typing import Optional
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
+import math
+
+from ..config import settings
+from ..models.ticket import OPEN_STATUSES
+from .satisfaction import satisfaction_id, smoothed_score
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+@dataclass
+class Operator:
+    id: ObjectId
+    municipality_id: Optional[ObjectId]
+    categories: frozenset
+    zone: Optional[tuple[float, float]]
+    open_tickets: int = 0
+    satisfaction: Optional[float] = None
+
+def to_point(location) -> Optional[tuple[float, float]]:
+    if not isinstance(location, dict):
+        return None
+    if location.get("lat") is not None and location.get("lng") is not None:
+        return float(location["lat"]), float(location["lng"])
+    coordinates = location.get("coordinates")
+    if isinstance(coordinates, (list, tuple)) and len(coordinates) == 2:
+        return float(coordinates[1]), float(coordinates[0])
+    return None
+
+def haversine_km(a: tuple[float, float], b: tuple[float, float]) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+def operator_from_user(user: dict) -> Operator:
+    categories = set(user.get("categories") or [])
+    if user.get("category"):
+        categories.add(user["category"])
+    return Operator(
+        id=user["_id"],
+        municipality_id=user.get("municipality_id"),
+        categories=frozenset(categories),
+        zone=to_point(user.get("zone") or user.get("location"))
+    )
+
+def operator_score(operator: Operator, ticket_point: Optional[tuple[float, float]]) -> float:
+    distance = haversine_km(operator.zone, ticket_point) if operator.zone and ticket_point else 0.0
+    # Unrated operators sit at the prior and are neither favoured nor penalised.
+    satisfaction = (operator.satisfaction or settings.SATISFACTION_PRIOR_MEAN) - settings.SATISFACTION_PRIOR_MEAN
+    return (
+        settings.ASSIGNMENT_LOAD_WEIGHT * operator.open_tickets
+        + settings.ASSIGNMENT_DISTANCE_WEIGHT * distance
+        - settings.ASSIGNMENT_SATISFACTION_WEIGHT * satisfaction
+    )
+
+def choose_operator(operators: list[Operator], ticket: dict) -> Optional[Operator]:
+    """
+    Prefer operators skilled in the ticket's category, then generalists,
+    then anyone; among those pick the lowest load/distance score.
+    """
+    available = [op for op in operators if op.open_tickets < settings.ASSIGNMENT_MAX_OPEN_TICKETS]
+    if not available:
+        return None
+    category = ticket.get("category")
+    candidates = (
+        [op for op in available if category in op.categories]
+        or [op for op in available if not op.categories]
+        or available
+    )
+    ticket_point = to_point(ticket.get("location"))
+    return min(candidates, key=lambda op: (operator_score(op, ticket_point), str(op.id)))
+
+def open_assignee(ticket: dict) -> Optional[ObjectId]:
+    return ticket.get("assigned_operator_id") if ticket.get("status") in OPEN_STATUSES else None
+
+class AssignmentEngine:
+    """
+    In-memory operator roster per municipality with open-ticket loads.
+    
+    Loads are adjusted on every local write and the whole roster is reloaded
+    periodically, which also repairs drift from writes on other replicas.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._by_id: dict[ObjectId, Operator] = {}
+        self._by_municipality: dict[ObjectId, list[Operator]] = {}
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except PyMongoError as e:
+                logger.error(f"Failed to refresh operator roster: {str(e)}")
+            await asyncio.sleep(settings.ASSIGNMENT_REFRESH_SECONDS)
+    
+    async def refresh(self):
+        operators = {}
+        async for user in self._db.users.find(
+            {"role": "operator", "is_active": {"$ne": False}},
+            {"municipality_id": 1, "category": 1, "categories": 1, "zone": 1, "location": 1}
+        ):
+            operators[user["_id"]] = operator_from_user(user)
+        
+        async for row in self._db.tickets.aggregate([
+            {"$match": {"status": {"$in": OPEN_STATUSES}, "assigned_operator_id": {"$in": list(operators)}}},
+            {"$group": {"_id": "$assigned_operator_id", "count": {"$sum": 1}}}
+        ]):
+            operators[row["_id"]].open_tickets = row["count"]
+        
+        async for row in self._db.satisfaction_scores.find(
+            {"_id": {"$in": [satisfaction_id("operator", operator_id) for operator_id in operators]}},
+            {"ref": 1, "count": 1, "sum": 1}
+        ):
+            if row.get("ref") in operators:
+                operators[row["ref"]].satisfaction = smoothed_score(row.get("count") or 0, row.get("sum") or 0)
+        
+        by_municipality = {}
+        for operator in operators.values():
+            by_municipality.setdefault(operator.municipality_id, []).append(operator)
+        self._by_id, self._by_municipality = operators, by_municipality
+    
+    def choose(self, ticket: dict) -> Optional[Operator]:
+        return choose_operator(self._by_municipality.get(ticket.get("municipality_id"), []), ticket)
+    
+    def record_change(self, before: dict, changes: dict):
+        previous = open_assignee(before)
+        current = open_assignee({**before, **changes})
+        if previous == current:
+            return
+        if previous in self._by_id:
+            self._by_id[previous].open_tickets = max(0, self._by_id[previous].open_tickets - 1)
+        if current in self._by_id:
+            self._by_id[current].open_tickets += 1
+    
+    def plan_rebalance(self, municipality_id: ObjectId, tickets: list[dict]) -> list[tuple[dict, ObjectId]]:
+        """
+        Greedily redistribute the given tickets as if none of them were
+        assigned yet. Returns only the tickets whose operator changes.
+        """
+        simulated = {op.id: replace(op) for op in self._by_municipality.get(municipality_id, [])}
+        for ticket in tickets:
+            assignee = open_assignee(ticket)
+            if assignee in simulated:
+                simulated[assignee].open_tickets -= 1
+        
+        plan = []
+        for ticket in tickets:
+            chosen = choose_operator(list(simulated.values()), ticket)
+            if chosen is None:
+                continue
+            chosen.open_tickets += 1
+            if chosen.id != ticket.get("assigned_operator_id"):
+                plan.append((ticket, chosen.id))
+        return plan
+
+assignment_engine = AssignmentEngine()
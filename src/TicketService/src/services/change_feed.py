@@ -0,0 +1,267 @@
+"""
+Ticket change feed backed by a MongoDB change stream
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ..config import settings
+from ..utils.serialization import dumps, with_id
+from .triage import TRIAGE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAMS_UNSUPPORTED = 40573
+NAMESPACE_NOT_FOUND = 26
+# Ticket fields subscriptions filter on; matched against the pre-image too,
+# so a ticket leaving a municipality or operator (or deleted) still reaches
+# the consoles that were following it.
+OWNER_FIELDS = ("municipality_id", "assigned_operator_id")
+
+# Periodic rescoring rewrites every open ticket; those writes are not
+# changes subscribers care about, so the server drops them.
+WATCH_PIPELINE = [
+    {"$match": {"$expr": {"$not": [{"$and": [
+        {"$eq": ["$operationType", "update"]},
+        {"$setIsSubset": [
+            {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+                "in": "$$this.k"
+            }},
+            list(TRIAGE_FIELDS)
+        ]},
+        {"$eq": [{"$size": {"$ifNull": ["$updateDescription.removedFields", []]}}, 0]}
+    ]}]}}}
+]
+
+def watch_options() -> dict:
+    return {"full_document": "updateLookup", "full_document_before_change": "whenAvailable"}
+
+async def enable_pre_images(db):
+    """
+    Record ticket pre-images for the change stream (MongoDB 6.0+). Without
+    them deletes and reassignments only reach unfiltered subscribers.
+    """
+    try:
+        try:
+            await db.command("collMod", "tickets", changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as e:
+            if e.code != NAMESPACE_NOT_FOUND:
+                raise
+            await db.create_collection("tickets", changeStreamPreAndPostImages={"enabled": True})
+    except PyMongoError as e:
+        logger.info(f"Change stream pre-images unavailable: {str(e)}")
+
+def owner_id(document: Optional[dict], field: str) -> Optional[str]:
+    return str(document[field]) if document and document.get(field) else None
+
+def encode_resume_token(token: dict) -> str:
+    return token["_data"]
+
+def decode_resume_token(event_id: str) -> dict:
+    return {"_data": event_id}
+
+def change_to_event(change: dict) -> dict:
+    document = change.get("fullDocument")
+    before = change.get("fullDocumentBeforeChange")
+    
+    update_description = change.get("updateDescription") or {}
+    event = {
+        "id": encode_resume_token(change["_id"]),
+        "operation": change["operationType"],
+        "ticket_id": str(change["documentKey"]["_id"]),
+        "updated_fields": list((update_description.get("updatedFields") or {}).keys()),
+        "ticket": with_id(dict(document)) if document else None
+    }
+    for field in OWNER_FIELDS:
+        # A deleted ticket is described by what it was.
+        event[field] = owner_id(document or before, field)
+        event[f"previous_{field}"] = owner_id(before, field)
+    return event
+
+def reset_event(event_id: str) -> dict:
+    # Tells the client its Last-Event-ID could not be resumed: refetch, then
+    # follow live changes from here.
+    return {"id": event_id, "operation": "reset"}
+
+def format_sse(event: dict) -> str:
+    event_type = "reset" if event["operation"] == "reset" else "ticket"
+    return f"id: {event['id']}\nevent: {event_type}\ndata: {dumps(event).decode()}\n\n"
+
+class Subscription:
+    def __init__(self, filters: dict):
+        self.filters = {field: value for field, value in filters.items() if value}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.CHANGE_FEED_QUEUE_SIZE)
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+        # Set when handed over from a catch-up cursor: events up to here
+        # were already delivered. Resume tokens sort in stream order.
+        self.delivered_through: Optional[str] = None
+    
+    def matches(self, event: dict) -> bool:
+        return all(
+            event.get(field) == value or (field in OWNER_FIELDS and event.get(f"previous_{field}") == value)
+            for field, value in self.filters.items()
+        )
+    
+    def offer(self, event: dict):
+        if self.closed or not self.matches(event):
+            return
+        if self.delivered_through and event["id"] <= self.delivered_through:
+            return
+        self.push(event)
+    
+    def push(self, event: dict):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop it, the client reconnects with Last-Event-ID.
+            self.closed = True
+
+class TicketChangeFeed:
+    """
+    Single change stream cursor per process, fanned out in memory.
+    
+    Recent events are kept in a bounded history so reconnecting clients can
+    replay from their Last-Event-ID. Older tokens (after a restart, or from
+    another replica) get a short-lived cursor that only runs until it has
+    caught up with the present, then joins the shared fan-out. Catch-ups
+    are capped; past the cap, or when the token cannot be resumed, the
+    client gets a reset event and follows live.
+    """
+    def __init__(self):
+        self.available = False
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._subscribers: set[Subscription] = set()
+        self._history: deque = deque(maxlen=settings.CHANGE_FEED_HISTORY_SIZE)
+        self._last_event_id: Optional[str] = None
+        self._catch_ups = 0
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.available = False
+    
+    async def _run(self):
+        resume_token = None
+        while True:
+            try:
+                async with self._db.tickets.watch(
+                    WATCH_PIPELINE,
+                    resume_after=resume_token,
+                    **watch_options()
+                ) as stream:
+                    self.available = True
+                    logger.info("Ticket change stream opened")
+                    async for change in stream:
+                        resume_token = change["_id"]
+                        self._publish(change_to_event(change))
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams require a replica set, ticket change feed disabled")
+                    self.available = False
+                    return
+                logger.error(f"Ticket change stream failed: {str(e)}")
+                resume_token = None
+            except PyMongoError as e:
+                logger.error(f"Ticket change stream interrupted: {str(e)}")
+            self.available = False
+            await asyncio.sleep(settings.CHANGE_FEED_RETRY_SECONDS)
+    
+    def _publish(self, event: dict):
+        self._last_event_id = event["id"]
+        self._history.append(event)
+        for subscription in list(self._subscribers):
+            subscription.offer(event)
+            if subscription.closed:
+                self._subscribers.discard(subscription)
+    
+    def subscribe(self, filters: dict, last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(filters)
+        if not last_event_id:
+            self._subscribers.add(subscription)
+            return subscription
+        
+        history = list(self._history)
+        position = next((i for i, event in enumerate(history) if event["id"] == last_event_id), None)
+        if position is not None:
+            for event in history[position + 1:]:
+                subscription.offer(event)
+            self._subscribers.add(subscription)
+        elif self._catch_ups >= settings.CHANGE_FEED_MAX_CATCH_UPS:
+            self._attach_after_reset(subscription, last_event_id)
+        else:
+            self._catch_ups += 1
+            subscription.task = asyncio.create_task(self._catch_up(subscription, last_event_id))
+        return subscription
+    
+    def _attach(self, subscription: Subscription, delivered_through: str):
+        """
+        Join the shared fan-out without gaps or repeats: replay whatever the
+        shared stream has seen past delivered_through, then skip the rest
+        until live events move beyond it. No awaits, so nothing published
+        in between is missed.
+        """
+        if subscription.closed:
+            return
+        subscription.delivered_through = delivered_through
+        for event in self._history:
+            subscription.offer(event)
+        self._subscribers.add(subscription)
+    
+    def _attach_after_reset(self, subscription: Subscription, last_event_id: str):
+        subscription.push(reset_event(self._last_event_id or last_event_id))
+        self._subscribers.add(subscription)
+    
+    async def _catch_up(self, subscription: Subscription, last_event_id: str):
+        delivered_through = last_event_id
+        try:
+            async with self._db.tickets.watch(
+                WATCH_PIPELINE,
+                resume_after=decode_resume_token(last_event_id),
+                **watch_options()
+            ) as stream:
+                while not subscription.closed:
+                    change = await stream.try_next()
+                    if change is None:
+                        break
+                    event = change_to_event(change)
+                    subscription.offer(event)
+                    delivered_through = event["id"]
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            logger.warning(f"Cannot resume ticket change stream: {str(e)}")
+            self._attach_after_reset(subscription, last_event_id)
+            return
+        finally:
+            self._catch_ups -= 1
+            subscription.task = None
+        self._attach(subscription, delivered_through)
+    
+    def unsubscribe(self, subscription: Subscription):
+        subscription.closed = True
+        self._subscribers.discard(subscription)
+        if subscription.task:
+            subscription.task.cancel()
+
+change_feed = TicketChangeFeed()
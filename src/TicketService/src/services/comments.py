@@ -0,0 +1,39 @@
+"""
+Comment pagination and summaries
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from bson import ObjectId
+
+MAX_SUMMARY_TICKETS = 500
+
+def encode_cursor(comment: dict) -> str:
+    raw = f"{comment['created_at'].isoformat()}|{comment['_id']}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    created_at, comment_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), ObjectId(comment_id)
+
+def page_query(ticket_id: ObjectId, cursor: str = None) -> dict:
+    query = {"ticket_id": ticket_id}
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gt": comment_id}}
+        ]
+    return query
+
+def build_summary_pipeline(ticket_ids: list[ObjectId]) -> list:
+    # Descending on the whole (ticket_id, created_at, _id) index so $first is
+    # the latest comment of each ticket.
+    return [
+        {"$match": {"ticket_id": {"$in": ticket_ids}}},
+        {"$sort": {"ticket_id": -1, "created_at": -1, "_id": -1}},
+        {"$group": {
+            "_id": "$ticket_id",
+            "count": {"$sum": 1},
+            "latest": {"$first": "$$ROOT"}
+        }}
+    ]
@@ -0,0 +1,277 @@
+"""
+Post-create ticket enrichment fed by an outbox collection
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+import asyncio
+import httpx
+import logging
+
+from ..config import settings
+from ..models.ticket import OPEN_STATUSES
+from .assignment import to_point
+from .tickets import TicketConflictError, apply_ticket_changes
+
+logger = logging.getLogger(__name__)
+
+# Media is not a step: it is uploaded after the ticket exists, so a
+# post-create lookup would almost always come back empty. Attachments are
+# found through media_files.ticket_id instead.
+ENRICHMENT_STEPS = ("geocode", "municipality", "duplicates")
+
+def outbox_entry(ticket_id: ObjectId, now: datetime) -> dict:
+    # Keyed by ticket so re-enqueueing the same ticket is a no-op.
+    return {
+        "_id": ticket_id,
+        "state": "pending",
+        "attempts": 0,
+        "completed_steps": [],
+        "available_at": now,
+        "created_at": now
+    }
+
+def geo_point(point: tuple[float, float]) -> dict:
+    return {"type": "Point", "coordinates": [point[1], point[0]]}
+
+def retry_delay(attempts: int) -> timedelta:
+    seconds = settings.ENRICHMENT_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, settings.ENRICHMENT_RETRY_MAX_SECONDS))
+
+async def enrich_geocode(db, client: httpx.AsyncClient, ticket: dict, point) -> dict:
+    location = ticket.get("location") or {}
+    if not point or location.get("address"):
+        return {}
+    response = await client.get(
+        "/api/v1/geo/reverse-geocode",
+        params={"lat": point[0], "lng": point[1]}
+    )
+    if response.status_code == 404:
+        return {}
+    response.raise_for_status()
+    return {"location.address": response.json()["address"]}
+
+async def enrich_municipality(db, client: httpx.AsyncClient, ticket: dict, point) -> dict:
+    if not point:
+        return {}
+    boundary = await db.municipality_boundaries.find_one(
+        {"geometry": {"$geoIntersects": {"$geometry": geo_point(point)}}},
+        {"municipality_id": 1}
+    )
+    if not boundary:
+        return {}
+    changes = {"boundary_municipality_id": boundary["municipality_id"]}
+    if not ticket.get("municipality_id"):
+        changes["municipality_id"] = boundary["municipality_id"]
+    return changes
+
+async def enrich_duplicates(db, client: httpx.AsyncClient, ticket: dict, point) -> dict:
+    if not point:
+        return {}
+    created_at = ticket.get("created_at") or datetime.utcnow()
+    candidates = await db.tickets.find(
+        {
+            "_id": {"$ne": ticket["_id"]},
+            "status": {"$in": OPEN_STATUSES},
+            "category": ticket.get("category"),
+            "created_at": {"$gte": created_at - timedelta(days=settings.DUPLICATE_WINDOW_DAYS)},
+            "location.coordinates": {
+                "$nearSphere": {
+                    "$geometry": geo_point(point),
+                    "$maxDistance": settings.DUPLICATE_RADIUS_METERS
+                }
+            }
+        },
+        {"_id": 1}
+    ).limit(5).to_list(length=5)
+    if not candidates:
+        return {}
+    
+    # Conditional push keeps the count right when the step is retried.
+    original = candidates[0]["_id"]
+    await db.tickets.update_one(
+        {"_id": original, "duplicate_ids": {"$ne": ticket["_id"]}},
+        {"$push": {"duplicate_ids": ticket["_id"]}, "$inc": {"duplicate_count": 1, "version": 1}}
+    )
+    return {"possible_duplicate_ids": [candidate["_id"] for candidate in candidates]}
+
+STEP_HANDLERS = {
+    "geocode": enrich_geocode,
+    "municipality": enrich_municipality,
+    "duplicates": enrich_duplicates
+}
+
+class EnrichmentWorkers:
+    """
+    Worker pool draining ticket_outbox. A job is claimed by pushing its
+    available_at forward by the lease, so a job held by a crashed worker
+    becomes claimable again once the lease runs out. Steps of one job run
+    concurrently; failed steps are retried with backoff, finished ones are
+    not repeated.
+    """
+    def __init__(self):
+        self._db = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+    
+    async def start(self, db):
+        self._db = db
+        self._client = httpx.AsyncClient(
+            base_url=settings.GEO_SERVICE_URL,
+            timeout=settings.ENRICHMENT_HTTP_TIMEOUT_SECONDS
+        )
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(settings.ENRICHMENT_WORKERS)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+    
+    def notify(self):
+        self._wakeup.set()
+    
+    async def enqueue(self, ticket_id: ObjectId):
+        """
+        Best effort: if this fails the ticket stays pending and the sweep
+        enqueues it later, so the POST never fails on enrichment.
+        """
+        try:
+            await self._db.ticket_outbox.update_one(
+                {"_id": ticket_id},
+                {"$setOnInsert": outbox_entry(ticket_id, datetime.utcnow())},
+                upsert=True
+            )
+            self.notify()
+        except PyMongoError as e:
+            logger.error(f"Failed to enqueue enrichment for ticket {ticket_id}: {str(e)}")
+    
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self.claim()
+                if job:
+                    await self.run(job)
+                    continue
+            except PyMongoError as e:
+                logger.error(f"Enrichment worker error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.ENRICHMENT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(settings.ENRICHMENT_SWEEP_SECONDS)
+            try:
+                cutoff = datetime.utcnow() - timedelta(seconds=settings.ENRICHMENT_LEASE_SECONDS)
+                async for ticket in self._db.tickets.find(
+                    {"enrichment.status": "pending", "created_at": {"$lt": cutoff}},
+                    {"_id": 1}
+                ):
+                    await self.enqueue(ticket["_id"])
+            except PyMongoError as e:
+                logger.error(f"Enrichment sweep failed: {str(e)}")
+    
+    async def claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self._db.ticket_outbox.find_one_and_update(
+            {"state": {"$in": ["pending", "processing"]}, "available_at": {"$lte": now}},
+            {
+                "$set": {"state": "processing", "available_at": now + timedelta(seconds=settings.ENRICHMENT_LEASE_SECONDS)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def run(self, job: dict):
+        # Anything process() did not expect (a malformed location, an
+        # unforeseen write error) must not end the worker; the job backs
+        # off like a failed step and eventually fails for good.
+        try:
+            await self.process(job)
+        except PyMongoError:
+            raise
+        except Exception as e:
+            logger.exception(f"Enrichment of ticket {job['_id']} crashed: {str(e)}")
+            failed = job["attempts"] >= settings.ENRICHMENT_MAX_ATTEMPTS
+            await self._db.ticket_outbox.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "state": "failed" if failed else "pending",
+                    "last_errors": {"process": f"{type(e).__name__}: {e}"},
+                    "available_at": datetime.utcnow() + retry_delay(job["attempts"])
+                }}
+            )
+    
+    async def process(self, job: dict):
+        ticket = await self._db.tickets.find_one({"_id": job["_id"]})
+        if not ticket:
+            await self._db.ticket_outbox.delete_one({"_id": job["_id"]})
+            return
+        
+        point = to_point(ticket.get("location"))
+        steps = [step for step in ENRICHMENT_STEPS if step not in job["completed_steps"]]
+        results = await asyncio.gather(
+            *(STEP_HANDLERS[step](self._db, self._client, ticket, point) for step in steps),
+            return_exceptions=True
+        )
+        
+        changes = {}
+        if point and not (ticket.get("location") or {}).get("coordinates"):
+            changes["location.coordinates"] = [point[1], point[0]]
+        completed = list(job["completed_steps"])
+        errors = {}
+        for step, result in zip(steps, results):
+            if isinstance(result, Exception):
+                errors[step] = str(result) or type(result).__name__
+            else:
+                changes.update(result)
+                completed.append(step)
+        
+        now = datetime.utcnow()
+        if not errors:
+            status = "done"
+        elif job["attempts"] >= settings.ENRICHMENT_MAX_ATTEMPTS:
+            status = "failed"
+        else:
+            status = "retrying"
+        changes["enrichment"] = {
+            "status": status,
+            "completed_steps": completed,
+            "errors": errors,
+            "attempts": job["attempts"],
+            "updated_at": now
+        }
+        
+        try:
+            await apply_ticket_changes(self._db, ticket["_id"], changes, now)
+        except TicketConflictError as e:
+            # Nothing was saved, so every step runs again on the next attempt.
+            logger.warning(f"Enrichment of ticket {ticket['_id']} deferred: {str(e)}")
+            status = "retrying"
+            completed = list(job["completed_steps"])
+        
+        if status == "done":
+            await self._db.ticket_outbox.delete_one({"_id": job["_id"]})
+        else:
+            await self._db.ticket_outbox.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "state": "failed" if status == "failed" else "pending",
+                    "completed_steps": completed,
+                    "last_errors": errors,
+                    "available_at": now + retry_delay(job["attempts"])
+                }}
+            )
+
+enrichment_workers = EnrichmentWorkers()
@@ -0,0 +1,59 @@
+"""
+Append-only ticket event history
+"""
+from datetime import datetime
+from typing import Any, Optional
+from pymongo.errors import CollectionInvalid, OperationFailure
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRACKED_FIELDS = ("status", "assigned_operator_id", "priority")
+
+EVENT_TYPES = {
+    "status": "status_changed",
+    "assigned_operator_id": "assignment_changed",
+    "priority": "priority_changed"
+}
+
+def make_event(
+    ticket: dict,
+    event_type: str,
+    now: datetime,
+    field: Optional[str] = None,
+    previous: Any = None,
+    value: Any = None
+) -> dict:
+    event = {
+        "at": now,
+        "municipality_id": ticket.get("municipality_id"),
+        "ticket_id": ticket["_id"],
+        "type": event_type
+    }
+    if field:
+        event["field"] = field
+        event["from"] = previous
+        event["to"] = value
+    return event
+
+async def ensure_events_collection(db):
+    """
+    Create ticket_events as a time-series collection where the server
+    supports it (MongoDB 5.0+), otherwise leave it to be created implicitly.
+    """
+    if "ticket_events" in await db.list_collection_names():
+        return
+    try:
+        await db.create_collection(
+            "ticket_events",
+            timeseries={"timeField": "at", "metaField": "municipality_id", "granularity": "minutes"}
+        )
+        logger.info("Created ticket_events time-series collection")
+    except CollectionInvalid:
+        pass
+    except OperationFailure as e:
+        logger.info(f"Time-series collections unavailable, using a regular collection: {str(e)}")
+
+async def record_events(db, events: list[dict]):
+    if events:
+        await db.ticket_events.insert_many(events, ordered=False)
@@ -0,0 +1,86 @@
+"""
+Streaming ticket export
+"""
+from datetime import datetime
+from bson import ObjectId
+import csv
+import io
+
+from ..utils.serialization import dumps, with_id
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+DEFAULT_EXPORT_FIELDS = [
+    "id",
+    "title",
+    "description",
+    "category",
+    "status",
+    "priority",
+    "location.address",
+    "location.lat",
+    "location.lng",
+    "citizen_id",
+    "assigned_operator_id",
+    "created_at",
+    "updated_at",
+    "resolved_at",
+    "resolution_seconds"
+]
+
+def build_projection(fields: list[str]) -> dict:
+    projection = {("_id" if field == "id" else field): 1 for field in fields}
+    if "_id" not in projection:
+        projection["_id"] = 0
+    return projection
+
+def get_path(document: dict, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode()
+    return value
+
+async def stream_ndjson(cursor, batch_size: int):
+    lines = []
+    async for ticket in cursor:
+        if "_id" in ticket:
+            with_id(ticket)
+        lines.append(dumps(ticket))
+        if len(lines) >= batch_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+async def stream_csv(cursor, fields: list[str], batch_size: int):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    rows = 0
+    async for ticket in cursor:
+        if "_id" in ticket:
+            with_id(ticket)
+        writer.writerow([csv_value(get_path(ticket, field)) for field in fields])
+        rows += 1
+        if rows >= batch_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate(0)
+            rows = 0
+    yield buffer.getvalue().encode()
@@ -0,0 +1,193 @@
+"""
+Bulk NDJSON ticket ingestion
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError, PyMongoError
+import asyncio
+import logging
+import time
+import orjson
+
+from ..models.ticket import TicketStatus
+from .tickets import init_ticket_timings, normalize_changes, record_ticket_changes
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = ("created_at", "updated_at", "resolved_at")
+STATUSES = {status.value for status in TicketStatus}
+
+@dataclass
+class IngestReport:
+    max_errors: int
+    received: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: list[dict] = field(default_factory=list)
+    
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+    
+    def to_dict(self, elapsed: float) -> dict:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.received / elapsed) if elapsed else None
+        }
+
+def parse_date(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_ingest_row(line: bytes, now: datetime) -> dict:
+    """
+    Turn one NDJSON line into a ticket document. Historical timestamps and
+    statuses are kept; timings and triage fields are derived as on create.
+    """
+    try:
+        row = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+    if not row.get("municipality_id"):
+        raise ValueError("Missing municipality_id")
+    
+    try:
+        ticket = normalize_changes(row)
+    except (InvalidId, TypeError) as e:
+        raise ValueError(f"Invalid id: {str(e)}")
+    for name in DATE_FIELDS:
+        if ticket.get(name) is not None:
+            try:
+                ticket[name] = parse_date(ticket[name])
+            except (ValueError, TypeError):
+                raise ValueError(f"Invalid {name}")
+    
+    ticket["status"] = ticket.get("status") or TicketStatus.RECEIVED.value
+    if ticket["status"] not in STATUSES:
+        raise ValueError(f"Unknown status {ticket['status']!r}")
+    ticket.setdefault("created_at", now)
+    ticket.setdefault("updated_at", ticket["created_at"])
+    init_ticket_timings(ticket, now)
+    if ticket["status"] == TicketStatus.RESOLVED.value and ticket.get("resolved_at"):
+        ticket["status_entered_at"] = ticket["resolved_at"]
+        ticket["resolution_seconds"] = (ticket["resolved_at"] - ticket["created_at"]).total_seconds()
+    else:
+        ticket["status_entered_at"] = ticket["created_at"]
+    return ticket
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Optional[bytes]]:
+    """
+    Yield each line, or None in place of a line longer than max_line_bytes.
+    An over-long line is dropped as it streams in rather than buffered, and
+    reading carries on after its newline.
+    """
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        if skipping:
+            end = chunk.find(b"\n")
+            if end == -1:
+                continue
+            chunk = chunk[end + 1:]
+            skipping = False
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line if len(line) <= max_line_bytes else None
+        if len(buffer) > max_line_bytes:
+            yield None
+            buffer = b""
+            skipping = True
+    if buffer:
+        yield buffer
+
+async def write_batch(db, tickets: list[dict], line_numbers: list[int], report: IngestReport):
+    failed = set()
+    try:
+        result = await db.tickets.insert_many(tickets, ordered=False)
+        report.inserted += len(result.inserted_ids)
+    except BulkWriteError as e:
+        report.inserted += e.details.get("nInserted", 0)
+        for error in e.details.get("writeErrors", []):
+            failed.add(error["index"])
+            report.error(line_numbers[error["index"]], error.get("errmsg", "Write failed"))
+    except PyMongoError as e:
+        logger.error(f"Ingest batch starting at line {line_numbers[0]} failed: {str(e)}")
+        for line in line_numbers:
+            report.error(line, "Batch write failed")
+        return
+    
+    await record_ticket_changes(db, [
+        (None, ticket) for index, ticket in enumerate(tickets) if index not in failed
+    ])
+
+async def ingest_ndjson(
+    db,
+    chunks: AsyncIterator[bytes],
+    batch_size: int,
+    max_in_flight: int,
+    max_line_bytes: int,
+    max_errors: int
+) -> dict:
+    """
+    Stream rows into insert_many(ordered=False) batches. At most
+    max_in_flight batches are being written at once; while they are, the
+    request body is not read any further, so a fast client is throttled by
+    TCP backpressure instead of buffering in memory.
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    report = IngestReport(max_errors)
+    slots = asyncio.Semaphore(max_in_flight)
+    pending: set[asyncio.Task] = set()
+    
+    async def flush(tickets, line_numbers):
+        try:
+            await write_batch(db, tickets, line_numbers, report)
+        finally:
+            slots.release()
+    
+    async def submit(tickets, line_numbers):
+        await slots.acquire()
+        task = asyncio.create_task(flush(tickets, line_numbers))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    
+    tickets, line_numbers = [], []
+    line_number = 0
+    async for line in iter_lines(chunks, max_line_bytes):
+        line_number += 1
+        if line is None:
+            report.received += 1
+            report.error(line_number, f"Line exceeds {max_line_bytes} bytes")
+            continue
+        if not line.strip():
+            continue
+        report.received += 1
+        try:
+            tickets.append(parse_ingest_row(line, now))
+            line_numbers.append(line_number)
+        except ValueError as e:
+            report.error(line_number, str(e))
+        if len(tickets) >= batch_size:
+            await submit(tickets, line_numbers)
+            tickets, line_numbers = [], []
+    
+    if tickets:
+        await submit(tickets, line_numbers)
+    await asyncio.gather(*pending)
+    return report.to_dict(time.perf_counter() - started)
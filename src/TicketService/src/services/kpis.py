@@ -0,0 +1,81 @@
+"""
+Daily KPI buckets for tickets
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import logging
+
+from .rollups import rollup_key
+from .sketches import sketch_bin
+
+logger = logging.getLogger(__name__)
+
+def day_bucket_id(day: datetime, municipality_id, category) -> str:
+    return f"day|{day.date().isoformat()}|{municipality_id or ''}|{rollup_key(category)}"
+
+def kpi_deltas(before: Optional[dict], after: Optional[dict]) -> dict[str, Counter]:
+    """
+    Counters to add to daily buckets for a ticket going from before to
+    after. KPIs count flows (opened, entered a status, resolved) on the day
+    they happen, so unlike the rollups nothing is ever subtracted.
+    Resolution and first-response times also feed the bucket's DDSketch
+    bins, which merge by plain addition across days and municipalities.
+    """
+    deltas = defaultdict(Counter)
+    if not after:
+        return deltas
+    
+    def bucket(at: Optional[datetime]) -> Counter:
+        day = at or after.get("updated_at") or datetime.utcnow()
+        return deltas[day_bucket_id(day, after.get("municipality_id"), after.get("category"))]
+    
+    if not before:
+        bucket(after.get("created_at"))["opened"] += 1
+    status = after.get("status")
+    if status and status != (before or {}).get("status"):
+        counters = bucket(after.get("status_entered_at"))
+        counters[f"entered.{rollup_key(status)}"] += 1
+        if status == "resolved":
+            counters["resolved"] += 1
+            if after.get("resolution_seconds") is not None:
+                counters["resolution_seconds_sum"] += after["resolution_seconds"]
+                counters[f"resolution_sketch.{sketch_bin(after['resolution_seconds'])}"] += 1
+    if after.get("first_response_seconds") is not None and not (before or {}).get("first_response_at"):
+        counters = bucket(after.get("first_response_at"))
+        counters["responded"] += 1
+        counters["response_seconds_sum"] += after["first_response_seconds"]
+        counters[f"response_sketch.{sketch_bin(after['first_response_seconds'])}"] += 1
+    return deltas
+
+def bucket_fields(bucket_id: str) -> dict:
+    granularity, day, municipality_id, category = bucket_id.split("|", 3)
+    return {
+        "granularity": granularity,
+        "period_start": datetime.fromisoformat(day),
+        "municipality_id": ObjectId(municipality_id) if ObjectId.is_valid(municipality_id) else None,
+        "category": category
+    }
+
+async def apply_kpi_deltas(db, deltas: dict):
+    """
+    Best effort, like the statistics rollups. updated_at tells the
+    AdminService compaction which weeks and months need rebuilding.
+    """
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    try:
+        await db.kpi_buckets.bulk_write([
+            UpdateOne(
+                {"_id": bucket_id},
+                {"$inc": dict(counters), "$set": {"updated_at": now}, "$setOnInsert": bucket_fields(bucket_id)},
+                upsert=True
+            )
+            for bucket_id, counters in deltas.items()
+        ], ordered=False)
+    except PyMongoError as e:
+        logger.warning(f"Failed to update KPI buckets: {str(e)}")
@@ -0,0 +1,85 @@
+"""
+Incremental statistics rollups for tickets
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import logging
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_SCOPE = "global"
+
+def rollup_key(value) -> str:
+    # Counter names become field names, so dots and a leading $ are not allowed.
+    if value is None or value == "":
+        return "unknown"
+    return str(value).replace(".", "_").lstrip("$") or "unknown"
+
+def municipality_scope(municipality_id) -> str:
+    return f"municipality:{municipality_id}"
+
+def scope_fields(scope: str) -> dict:
+    if scope.startswith("municipality:"):
+        municipality_id = scope.split(":", 1)[1]
+        return {
+            "scope": "municipality",
+            "municipality_id": ObjectId(municipality_id) if ObjectId.is_valid(municipality_id) else municipality_id
+        }
+    return {"scope": scope}
+
+def ticket_counters(ticket: dict) -> dict[str, int]:
+    return {
+        "tickets.total": 1,
+        f"tickets.by_status.{rollup_key(ticket.get('status'))}": 1,
+        f"tickets.by_category.{rollup_key(ticket.get('category'))}": 1
+    }
+
+def rollup_deltas(before: Optional[dict], after: Optional[dict]) -> dict[str, Counter]:
+    """
+    $inc per rollup document for a ticket going from before to after; either
+    side may be None for inserts and deletes. Counters that cancel out are
+    dropped, so an update that touches no rolled-up field yields nothing.
+    """
+    deltas = defaultdict(Counter)
+    for ticket, sign in ((before, -1), (after, 1)):
+        if not ticket:
+            continue
+        scopes = [GLOBAL_SCOPE]
+        if ticket.get("municipality_id"):
+            scopes.append(municipality_scope(ticket["municipality_id"]))
+        for scope in scopes:
+            for path, count in ticket_counters(ticket).items():
+                deltas[scope][path] += sign * count
+    return {
+        scope: Counter({path: count for path, count in counters.items() if count})
+        for scope, counters in deltas.items()
+        if any(counters.values())
+    }
+
+def merge_deltas(target: dict, deltas: dict):
+    for scope, counters in deltas.items():
+        target.setdefault(scope, Counter()).update(counters)
+
+async def apply_rollup_deltas(db, deltas: dict):
+    """
+    Best effort: a failed increment only leaves drift behind, which the
+    AdminService reconciliation repairs.
+    """
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    requests = []
+    for scope, counters in deltas.items():
+        requests.append(UpdateOne(
+            {"_id": scope},
+            {"$inc": dict(counters), "$set": {"updated_at": now}, "$setOnInsert": scope_fields(scope)},
+            upsert=True
+        ))
+    try:
+        await db.statistics_rollups.bulk_write(requests, ordered=False)
+    except PyMongoError as e:
+        logger.warning(f"Failed to update statistics rollups: {str(e)}")
@@ -0,0 +1,168 @@
+"""
+Running satisfaction aggregates from citizen feedback
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
+import math
+
+from ..config import settings
+from ..utils.leases import acquire_lease
+from .rollups import rollup_key
+
+logger = logging.getLogger(__name__)
+
+MIN_RATING = 1
+MAX_RATING = 5
+SCOPES = ("operator", "municipality", "category")
+LEASE_NAME = "satisfaction_recounter"
+
+def parse_rating(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise ValueError("rating must be a whole number")
+    if not MIN_RATING <= value <= MAX_RATING:
+        raise ValueError(f"rating must be between {MIN_RATING} and {MAX_RATING}")
+    return int(value)
+
+def satisfaction_id(scope: str, ref) -> str:
+    return f"{scope}:{rollup_key(ref)}"
+
+def satisfaction_targets(ticket: dict) -> dict[str, dict]:
+    """
+    Aggregate documents a rating on this ticket counts towards, with the
+    fields identifying each one. Operator documents also carry their
+    municipality so per-municipality leaderboards are a single indexed find.
+    """
+    targets = {}
+    if ticket.get("assigned_operator_id"):
+        targets[satisfaction_id("operator", ticket["assigned_operator_id"])] = {
+            "scope": "operator",
+            "ref": ticket["assigned_operator_id"],
+            "municipality_id": ticket.get("municipality_id")
+        }
+    if ticket.get("municipality_id"):
+        targets[satisfaction_id("municipality", ticket["municipality_id"])] = {
+            "scope": "municipality",
+            "ref": ticket["municipality_id"],
+            "municipality_id": ticket["municipality_id"]
+        }
+    targets[satisfaction_id("category", ticket.get("category"))] = {
+        "scope": "category",
+        "ref": rollup_key(ticket.get("category"))
+    }
+    return targets
+
+def rating_increments(rating: int) -> dict:
+    return {
+        "count": 1,
+        "sum": rating,
+        "sum_squares": rating * rating,
+        f"stars.{rating}": 1
+    }
+
+async def record_rating(db, ticket: dict, rating: int, now: Optional[datetime] = None):
+    now = now or datetime.utcnow()
+    increments = rating_increments(rating)
+    await db.satisfaction_scores.bulk_write([
+        UpdateOne(
+            {"_id": target_id},
+            {"$inc": increments, "$set": {"updated_at": now}, "$setOnInsert": fields},
+            upsert=True
+        )
+        for target_id, fields in satisfaction_targets(ticket).items()
+    ], ordered=False)
+
+async def count_feedback(db, feedback: dict):
+    """
+    Fold a stored rating into the aggregates, then mark it counted.
+    Feedback is inserted uncounted, so a count that fails or is cut short
+    is left to the recounter instead of being lost.
+    """
+    await record_rating(db, feedback, feedback["rating"], feedback["created_at"])
+    await db.ticket_feedback.update_one({"_id": feedback["_id"]}, {"$set": {"counted": True}})
+
+def smoothed_score(count: int, total: float) -> Optional[float]:
+    """
+    Mean rating pulled towards SATISFACTION_PRIOR_MEAN by
+    SATISFACTION_PRIOR_COUNT virtual ratings, so a single five-star review
+    does not top a leaderboard.
+    """
+    prior = settings.SATISFACTION_PRIOR_COUNT
+    if count + prior <= 0:
+        return None
+    return (total + settings.SATISFACTION_PRIOR_MEAN * prior) / (count + prior)
+
+def satisfaction_summary(document: dict) -> dict:
+    count = document.get("count") or 0
+    total = document.get("sum") or 0
+    mean = total / count if count else None
+    variance = max((document.get("sum_squares") or 0) / count - mean * mean, 0.0) if count else None
+    stars = document.get("stars") or {}
+    return {
+        "scope": document.get("scope"),
+        "ref": document.get("ref"),
+        "municipality_id": document.get("municipality_id"),
+        "count": count,
+        "mean": mean,
+        "stddev": math.sqrt(variance) if variance is not None else None,
+        "score": smoothed_score(count, total),
+        "stars": {str(star): stars.get(str(star), 0) for star in range(MIN_RATING, MAX_RATING + 1)},
+        "updated_at": document.get("updated_at")
+    }
+
+def parse_ref(scope: str, ref: str):
+    if scope == "category":
+        return rollup_key(ref)
+    if not ObjectId.is_valid(ref):
+        raise ValueError(f"Invalid {scope} id")
+    return ObjectId(ref)
+
+class SatisfactionRecounter:
+    """
+    Counts ratings that were stored but never made it into the aggregates.
+    Only feedback uncounted for longer than one interval is picked up, so
+    requests still counting their own rating are left alone. Only the
+    replica holding the recounter lease does it.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.SATISFACTION_RECOUNT_SECONDS)
+            try:
+                if not await acquire_lease(self._db, LEASE_NAME, settings.SATISFACTION_RECOUNT_SECONDS * 2):
+                    continue
+                counted = await self.recount()
+                if counted:
+                    logger.info(f"Counted {counted} pending satisfaction ratings")
+            except PyMongoError as e:
+                logger.error(f"Failed to recount satisfaction ratings: {str(e)}")
+    
+    async def recount(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.SATISFACTION_RECOUNT_SECONDS)
+        counted = 0
+        async for feedback in self._db.ticket_feedback.find({"counted": False, "created_at": {"$lt": cutoff}}):
+            await count_feedback(self._db, feedback)
+            counted += 1
+        return counted
+
+satisfaction_recounter = SatisfactionRecounter()
@@ -0,0 +1,59 @@
+"""
+Ticket full-text search
+"""
+from typing import Optional
+from bson import ObjectId
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+TEXT_INDEX_KEYS = [
+    ("municipality_id", 1),
+    ("title", "text"),
+    ("location.address", "text"),
+    ("description", "text")
+]
+TEXT_INDEX_WEIGHTS = {"title": 10, "location.address": 5, "description": 1}
+
+def build_search_pipeline(
+    q: str,
+    municipality_id: ObjectId,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 20,
+    recency_half_life_days: int = 30
+) -> list:
+    # municipality_id prefixes the text index, so every search is an
+    # equality-scoped index scan within one tenant.
+    filters = {}
+    if status:
+        filters["status"] = status
+    if category:
+        filters["category"] = category
+    status_filters = {key: value for key, value in filters.items() if key != "status"}
+    category_filters = {key: value for key, value in filters.items() if key != "category"}
+    
+    age_ms = {"$subtract": ["$$NOW", {"$ifNull": ["$created_at", "$$NOW"]}]}
+    recency = {"$pow": [0.5, {"$divide": [age_ms, recency_half_life_days * DAY_MS]}]}
+    
+    return [
+        {"$match": {"municipality_id": municipality_id, "$text": {"$search": q}}},
+        {"$addFields": {"relevance": {"$multiply": [{"$meta": "textScore"}, recency]}}},
+        {"$facet": {
+            "results": [
+                {"$match": filters},
+                {"$sort": {"relevance": -1, "created_at": -1}},
+                {"$skip": skip},
+                {"$limit": limit}
+            ],
+            "total": [{"$match": filters}, {"$count": "count"}],
+            "status": [
+                {"$match": status_filters},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+            ],
+            "category": [
+                {"$match": category_filters},
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}}
+            ]
+        }}
+    ]
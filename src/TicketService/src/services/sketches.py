@@ -0,0 +1,18 @@
+"""
+DDSketch binning for ticket latency distributions
+"""
+import math
+
+# Bins are relative-error buckets: any quantile read back from merged bins
+# is within 1% of the true value. AdminService decodes with the same value.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Sub-second latencies are noise for tickets; they share one bin read as 0.
+MIN_INDEXABLE_SECONDS = 1.0
+ZERO_BIN = "zero"
+
+def sketch_bin(seconds: float) -> str:
+    if seconds < MIN_INDEXABLE_SECONDS:
+        return ZERO_BIN
+    return str(math.ceil(math.log(seconds) / LOG_GAMMA))
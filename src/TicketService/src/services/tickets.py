@@ -0,0 +1,196 @@
+"""
+Ticket service logic
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+from bson import ObjectId
+import hashlib
+from pymongo import UpdateOne
+
+from .events import EVENT_TYPES, TRACKED_FIELDS, make_event, record_events
+from .kpis import apply_kpi_deltas, kpi_deltas
+from .rollups import apply_rollup_deltas, merge_deltas, rollup_deltas
+from .triage import triage_fields
+
+MAX_BULK_OPERATIONS = 1000
+MAX_UPDATE_RETRIES = 5
+ID_FIELDS = ("municipality_id", "citizen_id", "assigned_operator_id")
+
+class TicketConflictError(Exception):
+    pass
+
+class TicketPreconditionFailed(TicketConflictError):
+    pass
+
+def ticket_etag(version: Optional[int]) -> str:
+    return f'"{version or 0}"'
+
+def list_etag(tickets: Iterable[dict]) -> str:
+    digest = hashlib.sha1()
+    for ticket in tickets:
+        digest.update(f"{ticket['_id']}:{ticket.get('version') or 0};".encode())
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def parse_version(if_match: str) -> Optional[int]:
+    value = if_match.strip().removeprefix("W/").strip('"')
+    return int(value) if value.isdigit() else None
+
+def build_status_update(status: str, now: Optional[datetime] = None) -> dict:
+    now = now or datetime.utcnow()
+    update_data = {
+        "status": status,
+        "updated_at": now
+    }
+    if status == "resolved":
+        update_data["resolved_at"] = now
+    return update_data
+
+def normalize_changes(update_data: dict) -> dict:
+    changes = dict(update_data)
+    changes.pop("_id", None)
+    changes.pop("version", None)
+    for field in ID_FIELDS:
+        if isinstance(changes.get(field), str):
+            changes[field] = ObjectId(changes[field]) if changes[field] else None
+    return changes
+
+def parse_bulk_operation(item: dict) -> tuple[ObjectId, dict]:
+    if not isinstance(item, dict):
+        raise ValueError("Operation must be an object")
+    if not item.get("ticket_id"):
+        raise ValueError("Missing ticket_id")
+    ticket_id = ObjectId(item["ticket_id"])
+    
+    changes = {}
+    if item.get("status"):
+        changes["status"] = item["status"]
+    if "assigned_operator_id" in item:
+        changes["assigned_operator_id"] = item["assigned_operator_id"]
+    if not changes:
+        raise ValueError("Operation must set status or assigned_operator_id")
+    
+    return ticket_id, normalize_changes(changes)
+
+def init_ticket_timings(ticket_data: dict, now: datetime):
+    ticket_data["version"] = 1
+    ticket_data["status_entered_at"] = now
+    ticket_data["status_durations"] = {}
+    ticket_data.update(triage_fields(ticket_data, now))
+
+def build_tracked_update(before: dict, changes: dict, now: datetime) -> tuple[dict, dict, list[dict]]:
+    """
+    Build a compare-and-set update for one ticket, with the events it
+    produces and the incremental status timings. The filter pins the
+    version that was read and the update bumps it. The triage score is
+    recomputed against the ticket as it will be after the update.
+    """
+    set_fields = dict(changes)
+    set_fields["updated_at"] = now
+    inc_fields = {}
+    events = []
+    
+    for field in TRACKED_FIELDS:
+        if field in changes and changes[field] != before.get(field):
+            events.append(make_event(
+                before, EVENT_TYPES[field], now,
+                field=field, previous=before.get(field), value=changes[field]
+            ))
+    
+    previous_status = before.get("status")
+    new_status = changes.get("status")
+    if new_status and new_status != previous_status:
+        set_fields.update(build_status_update(new_status, now))
+        set_fields["status_entered_at"] = now
+        entered_at = before.get("status_entered_at") or before.get("created_at")
+        if previous_status and entered_at:
+            seconds = (now - entered_at).total_seconds()
+            inc_fields[f"status_durations.{previous_status}"] = seconds
+            next(e for e in events if e["field"] == "status")["duration_seconds"] = seconds
+        if new_status == "resolved" and before.get("created_at"):
+            set_fields["resolution_seconds"] = (now - before["created_at"]).total_seconds()
+    
+    responded = (
+        (new_status and new_status != "received")
+        or changes.get("assigned_operator_id")
+    )
+    if responded and not before.get("first_response_at") and before.get("created_at"):
+        set_fields["first_response_at"] = now
+        set_fields["first_response_seconds"] = (now - before["created_at"]).total_seconds()
+    
+    set_fields.update(triage_fields({**before, **set_fields}, now))
+    inc_fields["version"] = 1
+    return (
+        {"_id": before["_id"], "version": before.get("version")},
+        {"$set": set_fields, "$inc": inc_fields},
+        events
+    )
+
+async def apply_ticket_changes(
+    db,
+    ticket_id: ObjectId,
+    changes: dict,
+    now: Optional[datetime] = None,
+    expected_version: Optional[int] = None
+) -> Optional[dict]:
+    """
+    Apply changes to a ticket and append its events. Returns the ticket as it
+    was before the update, or None if it does not exist.
+    
+    With expected_version (from If-Match) the update is attempted once and
+    fails if the ticket has moved on; otherwise lost races are retried.
+    """
+    now = now or datetime.utcnow()
+    attempts = 1 if expected_version is not None else MAX_UPDATE_RETRIES
+    for _ in range(attempts):
+        before = await db.tickets.find_one({"_id": ticket_id})
+        if not before:
+            return None
+        if expected_version is not None and (before.get("version") or 0) != expected_version:
+            break
+        query, update, events = build_tracked_update(before, changes, now)
+        result = await db.tickets.update_one(query, update)
+        if result.matched_count:
+            await record_events(db, events)
+            await record_ticket_changes(db, [(before, {**before, **update["$set"]})])
+            return before
+    if expected_version is not None:
+        raise TicketPreconditionFailed(f"Ticket {ticket_id} no longer matches version {expected_version}")
+    raise TicketConflictError(f"Ticket {ticket_id} kept changing, update not applied")
+
+def build_bulk_requests(
+    befores: dict,
+    operations: list[tuple[ObjectId, dict]],
+    now: datetime
+) -> tuple[list[UpdateOne], dict, dict]:
+    """
+    Returns the update requests plus, per ticket, the events and the
+    fields written, to be recorded once the write is known to have applied.
+    """
+    requests = []
+    events = {}
+    written = {}
+    for ticket_id, changes in operations:
+        query, update, ticket_events = build_tracked_update(befores[ticket_id], changes, now)
+        requests.append(UpdateOne(query, update))
+        events[ticket_id] = ticket_events
+        written[ticket_id] = update["$set"]
+    return requests, events, written
+
+async def record_ticket_changes(db, changes: list[tuple[Optional[dict], Optional[dict]]]):
+    """
+    Fold (before, after) ticket states into the statistics rollups and the
+    daily KPI buckets, one bulk write each.
+    """
+    rollups = {}
+    buckets = {}
+    for before, after in changes:
+        merge_deltas(rollups, rollup_deltas(before, after))
+        merge_deltas(buckets, kpi_deltas(before, after))
+    await apply_rollup_deltas(db, rollups)
+    await apply_kpi_deltas(db, buckets)
@@ -0,0 +1,132 @@
+"""
+Ticket triage scoring
+"""
+from datetime import datetime
+from typing import Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+import asyncio
+import logging
+import math
+
+from ..config import settings
+from ..models.ticket import OPEN_STATUSES
+from ..utils.leases import acquire_lease
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_BOOST = {
+    "low": -1.0,
+    "normal": 0.0,
+    "high": 2.0,
+    "urgent": 4.0
+}
+
+# Fields triage_score depends on, used to project the refresh scan.
+SCORE_FIELDS = ("category", "priority", "upvotes", "duplicate_count", "created_at", "status", "version")
+# Fields the refresher writes; updates touching nothing else are not ticket changes.
+TRIAGE_FIELDS = ("triage_score", "triage_scored_at")
+LEASE_NAME = "triage_refresher"
+
+def sla_hours(category: Optional[str]) -> float:
+    return settings.TRIAGE_SLA_HOURS.get(category, settings.TRIAGE_DEFAULT_SLA_HOURS)
+
+def triage_score(ticket: dict, now: datetime) -> float:
+    """
+    Higher is more urgent. Combines category severity, community signal
+    (upvotes and merged duplicates, log-damped), age and how close the
+    ticket is to its category SLA; past the SLA the pressure keeps
+    growing quadratically up to a cap.
+    """
+    created_at = ticket.get("created_at") or now
+    age_hours = max((now - created_at).total_seconds() / 3600, 0.0)
+    severity = settings.TRIAGE_CATEGORY_SEVERITY.get(ticket.get("category"), settings.TRIAGE_DEFAULT_SEVERITY)
+    votes = (ticket.get("upvotes") or 0) + (ticket.get("duplicate_count") or 0)
+    sla_ratio = min(age_hours / sla_hours(ticket.get("category")), settings.TRIAGE_SLA_RATIO_CAP)
+    
+    score = (
+        settings.TRIAGE_SEVERITY_WEIGHT * severity
+        + settings.TRIAGE_VOTES_WEIGHT * math.log1p(max(votes, 0))
+        + settings.TRIAGE_AGE_WEIGHT * age_hours / 24
+        + settings.TRIAGE_SLA_WEIGHT * sla_ratio ** 2
+        + PRIORITY_BOOST.get(ticket.get("priority"), 0.0)
+    )
+    return round(score, 4)
+
+def triage_fields(ticket: dict, now: datetime) -> dict:
+    return {"triage_score": triage_score(ticket, now), "triage_scored_at": now}
+
+class TriageRefresher:
+    """
+    Periodically rescores open tickets so age and SLA pressure keep
+    growing between writes. Updates are pinned to the version that was
+    read and leave it untouched: a ticket written meanwhile already carries
+    a fresh score, and the score alone is not a revision of the ticket.
+    
+    Only the replica holding the refresher lease rescores; the others keep
+    trying to take it over in case the holder goes away.
+    """
+    def __init__(self):
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.TRIAGE_REFRESH_SECONDS)
+            try:
+                if not await self._hold_lease():
+                    continue
+                rescored = await self.refresh()
+                logger.info(f"Rescored {rescored} open tickets")
+            except PyMongoError as e:
+                logger.error(f"Failed to refresh triage scores: {str(e)}")
+    
+    async def _hold_lease(self) -> bool:
+        # Outlives one interval so the holder keeps it across cycles.
+        return await acquire_lease(self._db, LEASE_NAME, settings.TRIAGE_REFRESH_SECONDS * 2)
+    
+    async def refresh(self) -> int:
+        now = datetime.utcnow()
+        rescored = 0
+        batch = []
+        cursor = self._db.tickets.find(
+            {"status": {"$in": OPEN_STATUSES}},
+            {field: 1 for field in SCORE_FIELDS}
+        ).batch_size(settings.TRIAGE_REFRESH_BATCH_SIZE)
+        async for ticket in cursor:
+            batch.append(UpdateOne(
+                {"_id": ticket["_id"], "version": ticket.get("version")},
+                {"$set": triage_fields(ticket, now)}
+            ))
+            if len(batch) >= settings.TRIAGE_REFRESH_BATCH_SIZE:
+                rescored += await self._flush(batch)
+                batch = []
+                if not await self._hold_lease():
+                    logger.warning("Lost the triage refresher lease mid-refresh")
+                    break
+        if batch:
+            rescored += await self._flush(batch)
+        return rescored
+    
+    async def _flush(self, batch: list[UpdateOne]) -> int:
+        try:
+            result = await self._db.tickets.bulk_write(batch, ordered=False)
+            return result.modified_count
+        except BulkWriteError as e:
+            logger.error(f"Triage refresh write errors: {e.details.get('writeErrors', [])}")
+            return e.details.get("nModified", 0)
+
+triage_refresher = TriageRefresher()
@@ -0,0 +1,26 @@
+"""
+Leader leases for work only one replica should do
+"""
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+import os
+import uuid
+
+# Identifies this process as a lease holder.
+HOLDER_ID = f"{os.getenv('HOSTNAME', 'local')}:{uuid.uuid4().hex[:8]}"
+
+async def acquire_lease(db, name: str, seconds: float) -> bool:
+    """
+    Take or renew the named lease. Returns whether this process holds it.
+    While another holder's lease is live the upsert collides on _id.
+    """
+    now = datetime.utcnow()
+    try:
+        await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"holder": HOLDER_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"holder": HOLDER_ID, "expires_at": now + timedelta(seconds=seconds), "renewed_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
@@ -0,0 +1,69 @@
+"""
+Microbenchmark: serializing a 10k-ticket list response.
+
+Run from src/TicketService with: python -m test.bench_serialization
+"""
+from datetime import datetime, timedelta
+import json
+import timeit
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from src.utils.serialization import dumps, with_id
+
+TICKET_COUNT = 10_000
+ROUNDS = 5
+
+def make_tickets() -> list[dict]:
+    municipality_id = ObjectId()
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"Buca sul manto stradale #{i}",
+            "description": "Buca profonda sulla carreggiata, pericolosa per i motocicli.",
+            "category": "roads",
+            "status": "received",
+            "location": {"lat": 40.6824, "lng": 14.7681, "address": "Via Roma 45, Salerno"},
+            "photos": [f"/uploads/{ObjectId()}.jpg"],
+            "municipality_id": municipality_id,
+            "citizen_id": ObjectId(),
+            "assigned_operator_id": ObjectId(),
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now
+        }
+        for i in range(TICKET_COUNT)
+    ]
+
+def legacy(tickets: list[dict]) -> bytes:
+    # Per-field str() conversion, jsonable_encoder, then JSONResponse.render
+    converted = []
+    for ticket in tickets:
+        ticket = dict(ticket)
+        ticket["id"] = str(ticket.pop("_id"))
+        for field in ("municipality_id", "citizen_id", "assigned_operator_id"):
+            if ticket.get(field):
+                ticket[field] = str(ticket[field])
+        converted.append(ticket)
+    return json.dumps(
+        jsonable_encoder(converted),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+def fast(tickets: list[dict]) -> bytes:
+    return dumps([with_id(dict(ticket)) for ticket in tickets])
+
+def main():
+    tickets = make_tickets()
+    assert json.loads(legacy(tickets)) == json.loads(fast(tickets))
+    
+    for name, func in (("legacy", legacy), ("orjson", fast)):
+        best = min(timeit.repeat(lambda: func(tickets), number=1, repeat=ROUNDS))
+        print(f"{name:>8}: {best * 1000:8.1f} ms per {TICKET_COUNT} tickets")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,595 @@
+"""
+Tests for TicketService
+"""
+import json
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from src.main import app
+from src.services.assignment import Operator, choose_operator
+from pymongo.errors import OperationFailure
+from src.services.change_feed import Subscription, TicketChangeFeed, change_to_event
+from src.services.comments import decode_cursor, encode_cursor, page_query
+from src.services import enrichment
+from src.services.export import build_projection, stream_csv
+from src.services.kpis import kpi_deltas
+from src.services.sketches import sketch_bin
+from src.services.ingest import ingest_ndjson
+from src.services.rollups import rollup_deltas
+from src.services.satisfaction import (
+    SatisfactionRecounter,
+    count_feedback,
+    parse_rating,
+    satisfaction_summary,
+    satisfaction_targets
+)
+from src.services.search import build_search_pipeline
+from src.services.tickets import (
+    build_status_update,
+    build_tracked_update,
+    etag_matches,
+    list_etag,
+    parse_bulk_operation,
+    parse_version,
+    ticket_etag
+)
+from src.services.triage import triage_score
+from src.utils.idempotency import request_fingerprint, run_idempotent
+from src.utils.indexes import plan_stages
+from src.utils.serialization import MongoJSONResponse, dumps, with_id
+
+client = TestClient(app)
+
+def test_health_check():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+def test_rebalance_takes_municipality_from_body():
+    assert client.post("/api/v1/tickets/rebalance", json={}).status_code == 400
+    assert client.post("/api/v1/tickets/rebalance", json={"municipality_id": "nope"}).status_code == 400
+
+def test_status_update_sets_resolved_at():
+    now = datetime.utcnow()
+    update = build_status_update("resolved", now)
+    assert update == {"status": "resolved", "updated_at": now, "resolved_at": now}
+    assert "resolved_at" not in build_status_update("in_progress", now)
+
+def test_bulk_operation_status_and_assignment():
+    ticket_id = ObjectId()
+    operator_id = ObjectId()
+    parsed_id, changes = parse_bulk_operation({
+        "ticket_id": str(ticket_id),
+        "status": "resolved",
+        "assigned_operator_id": str(operator_id)
+    })
+    assert parsed_id == ticket_id
+    assert changes == {"status": "resolved", "assigned_operator_id": operator_id}
+
+def test_bulk_operation_rejects_empty_update():
+    with pytest.raises(ValueError):
+        parse_bulk_operation({"ticket_id": str(ObjectId())})
+
+def test_tracked_update_accumulates_status_timings():
+    created_at = datetime(2026, 3, 1, 8, 0, 0)
+    entered_at = datetime(2026, 3, 1, 9, 0, 0)
+    now = datetime(2026, 3, 1, 12, 0, 0)
+    before = {
+        "_id": ObjectId(),
+        "status": "in_progress",
+        "created_at": created_at,
+        "updated_at": entered_at,
+        "status_entered_at": entered_at,
+        "first_response_at": entered_at,
+        "version": 3
+    }
+    query, update, events = build_tracked_update(before, {"status": "resolved"}, now)
+    
+    assert query == {"_id": before["_id"], "version": 3}
+    assert update["$inc"] == {"status_durations.in_progress": 3 * 3600, "version": 1}
+    assert update["$set"]["resolved_at"] == now
+    assert update["$set"]["resolution_seconds"] == 4 * 3600
+    assert "first_response_at" not in update["$set"]
+    assert [(e["type"], e["from"], e["to"]) for e in events] == [("status_changed", "in_progress", "resolved")]
+    assert events[0]["duration_seconds"] == 3 * 3600
+
+def test_tracked_update_without_changes_emits_no_events():
+    now = datetime.utcnow()
+    before = {"_id": ObjectId(), "status": "received", "created_at": now}
+    _, update, events = build_tracked_update(before, {"status": "received"}, now)
+    assert events == []
+    assert update["$inc"] == {"version": 1}
+
+def test_etag_helpers():
+    assert ticket_etag(4) == '"4"'
+    assert ticket_etag(None) == '"0"'
+    assert etag_matches('"3", W/"4"', '"4"')
+    assert not etag_matches('"3"', '"4"')
+    assert parse_version('W/"7"') == 7
+    assert parse_version('"abc"') is None
+    
+    tickets = [{"_id": ObjectId(), "version": 1}, {"_id": ObjectId(), "version": 2}]
+    assert list_etag(tickets) == list_etag([dict(t) for t in tickets])
+    tickets[1]["version"] = 3
+    assert list_etag(tickets) != list_etag([tickets[0], {**tickets[1], "version": 2}])
+
+def test_change_event_carries_filter_fields():
+    ticket_id = ObjectId()
+    municipality_id = ObjectId()
+    event = change_to_event({
+        "_id": {"_data": "8265AB"},
+        "operationType": "update",
+        "documentKey": {"_id": ticket_id},
+        "fullDocument": {"_id": ticket_id, "municipality_id": municipality_id, "status": "resolved"},
+        "updateDescription": {"updatedFields": {"status": "resolved"}}
+    })
+    assert event["id"] == "8265AB"
+    assert event["ticket"]["id"] == ticket_id
+    assert event["updated_fields"] == ["status"]
+    assert Subscription({"municipality_id": str(municipality_id), "ticket_id": None}).matches(event)
+    assert not Subscription({"assigned_operator_id": str(ObjectId())}).matches(event)
+
+def test_change_event_reaches_previous_owners():
+    ticket_id, municipality_id = ObjectId(), ObjectId()
+    operator_a, operator_b = ObjectId(), ObjectId()
+    before = {"_id": ticket_id, "municipality_id": municipality_id, "assigned_operator_id": operator_a}
+    reassigned = change_to_event({
+        "_id": {"_data": "8265AC"},
+        "operationType": "update",
+        "documentKey": {"_id": ticket_id},
+        "fullDocument": {**before, "assigned_operator_id": operator_b},
+        "fullDocumentBeforeChange": before,
+        "updateDescription": {"updatedFields": {"assigned_operator_id": operator_b}}
+    })
+    assert reassigned["assigned_operator_id"] == str(operator_b)
+    assert Subscription({"assigned_operator_id": str(operator_a)}).matches(reassigned)
+    assert Subscription({"assigned_operator_id": str(operator_b)}).matches(reassigned)
+    
+    deleted = change_to_event({
+        "_id": {"_data": "8265AD"},
+        "operationType": "delete",
+        "documentKey": {"_id": ticket_id},
+        "fullDocumentBeforeChange": before
+    })
+    assert deleted["ticket"] is None
+    assert Subscription({"municipality_id": str(municipality_id)}).matches(deleted)
+    assert Subscription({"assigned_operator_id": str(operator_a)}).matches(deleted)
+    assert not Subscription({"ticket_id": str(ObjectId())}).matches(deleted)
+
+def test_search_pipeline_facets_ignore_own_filter():
+    municipality_id = ObjectId()
+    pipeline = build_search_pipeline("buca", municipality_id, status="received", category="roads")
+    assert pipeline[0]["$match"] == {"municipality_id": municipality_id, "$text": {"$search": "buca"}}
+    facets = pipeline[-1]["$facet"]
+    assert facets["results"][0]["$match"] == {"status": "received", "category": "roads"}
+    assert facets["status"][0]["$match"] == {"category": "roads"}
+    assert facets["category"][0]["$match"] == {"status": "received"}
+
+def test_plan_stages_flags_in_memory_sort():
+    winning_plan = {
+        "stage": "SORT",
+        "inputStage": {"stage": "FETCH", "inputStage": {"stage": "COLLSCAN"}}
+    }
+    assert plan_stages(winning_plan) == ["SORT", "FETCH", "COLLSCAN"]
+
+def test_dumps_handles_motor_documents():
+    ticket_id = ObjectId()
+    created_at = datetime(2026, 1, 30, 9, 15, 0)
+    payload = dumps([with_id({
+        "_id": ticket_id,
+        "created_at": created_at,
+        "location": {"lat": 40.68, "lng": 14.77}
+    })])
+    assert json.loads(payload) == [{
+        "id": str(ticket_id),
+        "created_at": created_at.isoformat(),
+        "location": {"lat": 40.68, "lng": 14.77}
+    }]
+
+def test_comment_cursor_round_trip():
+    comment = {"_id": ObjectId(), "created_at": datetime(2026, 2, 1, 10, 30, 0, 123000)}
+    assert decode_cursor(encode_cursor(comment)) == (comment["created_at"], comment["_id"])
+    
+    ticket_id = ObjectId()
+    query = page_query(ticket_id, encode_cursor(comment))
+    assert query["ticket_id"] == ticket_id
+    assert query["$or"][1] == {"created_at": comment["created_at"], "_id": {"$gt": comment["_id"]}}
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+    
+    def __aiter__(self):
+        return self._iterate()
+    
+    async def _iterate(self):
+        for document in self.documents:
+            yield dict(document)
+
+@pytest.mark.asyncio
+async def test_csv_export_streams_in_batches():
+    ticket_ids = [ObjectId() for _ in range(3)]
+    cursor = FakeCursor([
+        {"_id": ticket_id, "title": f"Ticket {i}", "location": {"address": "Via Roma 45, Salerno"}}
+        for i, ticket_id in enumerate(ticket_ids)
+    ])
+    chunks = [chunk async for chunk in stream_csv(cursor, ["id", "title", "location.address"], batch_size=2)]
+    
+    assert len(chunks) == 2
+    rows = b"".join(chunks).decode().splitlines()
+    assert rows[0] == "id,title,location.address"
+    assert rows[1] == f'{ticket_ids[0]},Ticket 0,"Via Roma 45, Salerno"'
+    assert build_projection(["title"]) == {"title": 1, "_id": 0}
+
+def test_choose_operator_balances_skill_distance_and_load():
+    salerno = {"lat": 40.6824, "lng": 14.7681}
+    roads_near = Operator(ObjectId(), None, frozenset({"roads"}), (40.68, 14.77), open_tickets=3)
+    roads_far = Operator(ObjectId(), None, frozenset({"roads"}), (41.90, 12.49), open_tickets=0)
+    lighting = Operator(ObjectId(), None, frozenset({"lighting"}), (40.68, 14.77), open_tickets=0)
+    
+    ticket = {"category": "roads", "location": salerno}
+    assert choose_operator([roads_near, roads_far, lighting], ticket) is roads_near
+    
+    roads_near.open_tickets = 200
+    assert choose_operator([roads_near, roads_far, lighting], ticket) is roads_far
+    assert choose_operator([lighting], {"category": "waste"}) is lighting
+
+def test_triage_score_grows_with_votes_age_and_sla_pressure():
+    now = datetime(2026, 3, 10, 12, 0)
+    fresh = {"category": "roads", "created_at": now}
+    upvoted = {**fresh, "upvotes": 12, "duplicate_count": 3}
+    overdue = {**fresh, "created_at": now - timedelta(days=5)}
+    
+    assert triage_score(upvoted, now) > triage_score(fresh, now)
+    assert triage_score(overdue, now) > triage_score(fresh, now)
+    assert triage_score({**fresh, "priority": "urgent"}, now) > triage_score(fresh, now)
+    assert triage_score(overdue, now + timedelta(days=1)) > triage_score(overdue, now)
+    
+    query, update, _ = build_tracked_update(
+        {"_id": ObjectId(), "status": "received", "created_at": now, "version": 1},
+        {"priority": "urgent"},
+        now
+    )
+    assert update["$set"]["triage_score"] == triage_score({"created_at": now, "priority": "urgent"}, now)
+
+class FakeKeys:
+    def __init__(self):
+        self.records = {}
+    
+    async def insert_one(self, record):
+        if (record["scope"], record["key"]) in self.records:
+            raise DuplicateKeyError("duplicate key")
+        self.records[(record["scope"], record["key"])] = dict(record, _id=ObjectId())
+    
+    async def find_one(self, query):
+        return self.records.get((query["scope"], query["key"]))
+    
+    async def update_one(self, query, update):
+        self.records[(query["scope"], query["key"])].update(update["$set"])
+    
+    async def delete_one(self, query):
+        self.records.pop((query["scope"], query["key"]), None)
+
+class FakeIdempotencyDb:
+    def __init__(self):
+        self.idempotency_keys = FakeKeys()
+
+@pytest.mark.asyncio
+async def test_idempotency_key_replays_original_response():
+    db = FakeIdempotencyDb()
+    calls = []
+    
+    async def handler():
+        calls.append(1)
+        return MongoJSONResponse({"id": str(ObjectId())}, headers={"ETag": '"1"'})
+    
+    payload = {"title": "Buca in via Roma"}
+    first = await run_idempotent(db, "tickets.create", "abc", request_fingerprint(payload), handler)
+    replay = await run_idempotent(db, "tickets.create", "abc", request_fingerprint(payload), handler)
+    
+    assert len(calls) == 1
+    assert replay.body == first.body
+    assert replay.headers["etag"] == '"1"'
+    assert replay.headers["idempotent-replayed"] == "true"
+    with pytest.raises(HTTPException) as error:
+        await run_idempotent(db, "tickets.create", "abc", request_fingerprint({"title": "Altro"}), handler)
+    assert error.value.status_code == 422
+    assert request_fingerprint({"a": 1, "b": {"c": 2, "d": 3}}) == request_fingerprint({"b": {"d": 3, "c": 2}, "a": 1})
+
+class FakeTickets:
+    def __init__(self):
+        self.batches = []
+    
+    async def insert_many(self, documents, ordered=True):
+        self.batches.append(documents)
+        return type("Result", (), {"inserted_ids": [ObjectId() for _ in documents]})()
+
+class FakeCounters:
+    def __init__(self):
+        self.counters = {}
+    
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            scope = request._filter["_id"]
+            for path, count in request._doc["$inc"].items():
+                self.counters.setdefault(scope, {}).setdefault(path, 0)
+                self.counters[scope][path] += count
+
+class FakeIngestDb:
+    def __init__(self):
+        self.tickets = FakeTickets()
+        self.statistics_rollups = FakeCounters()
+        self.kpi_buckets = FakeCounters()
+
+@pytest.mark.asyncio
+async def test_ingest_batches_rows_and_reports_bad_lines():
+    municipality_id = str(ObjectId())
+    rows = [
+        json.dumps({"municipality_id": municipality_id, "title": f"Ticket {i}"}).encode()
+        for i in range(5)
+    ]
+    rows.insert(2, b'{"title": "no municipality"}')
+    rows.insert(4, b'{"title": "' + b"x" * 3000 + b'"}')
+    rows.append(json.dumps({
+        "municipality_id": municipality_id,
+        "status": "resolved",
+        "created_at": "2024-01-01T08:00:00+01:00",
+        "resolved_at": "2024-01-02T07:00:00Z"
+    }).encode())
+    body = b"\n".join(rows) + b"\n"
+    
+    async def chunks():
+        for offset in range(0, len(body), 37):
+            yield body[offset:offset + 37]
+    
+    db = FakeIngestDb()
+    report = await ingest_ndjson(db, chunks(), batch_size=2, max_in_flight=2, max_line_bytes=1024, max_errors=10)
+    
+    assert report["received"] == 8
+    assert report["inserted"] == 6
+    assert report["errors"] == [
+        {"line": 3, "error": "Missing municipality_id"},
+        {"line": 5, "error": "Line exceeds 1024 bytes"}
+    ]
+    assert [len(batch) for batch in db.tickets.batches] == [2, 2, 2]
+    resolved = db.tickets.batches[-1][-1]
+    assert resolved["municipality_id"] == ObjectId(municipality_id)
+    assert resolved["resolution_seconds"] == 24 * 3600
+    assert db.statistics_rollups.counters["global"]["tickets.total"] == 6
+    assert db.statistics_rollups.counters[f"municipality:{municipality_id}"]["tickets.by_status.resolved"] == 1
+    assert db.kpi_buckets.counters[f"day|2024-01-02|{municipality_id}|unknown"]["resolved"] == 1
+
+class FakeOutbox:
+    def __init__(self):
+        self.updates = []
+    
+    async def update_one(self, query, update):
+        self.updates.append(update["$set"])
+
+class FakeEnrichmentDb:
+    def __init__(self, ticket):
+        self.ticket = ticket
+        self.ticket_outbox = FakeOutbox()
+        self.tickets = self
+    
+    async def find_one(self, query):
+        return self.ticket
+
+@pytest.mark.asyncio
+async def test_enrichment_keeps_finished_steps_and_retries_failures(monkeypatch):
+    ticket = {"_id": ObjectId(), "location": {"lat": 40.68, "lng": 14.77}}
+    applied = []
+    
+    async def geocode_down(db, client, ticket, point):
+        raise RuntimeError("geo service down")
+    
+    async def found_duplicates(db, client, ticket, point):
+        return {"possible_duplicate_ids": ["t1"]}
+    
+    async def no_changes(db, client, ticket, point):
+        return {}
+    
+    async def fake_apply(db, ticket_id, changes, now):
+        applied.append(changes)
+    
+    monkeypatch.setattr(enrichment, "STEP_HANDLERS", {
+        "geocode": geocode_down, "municipality": no_changes, "duplicates": found_duplicates
+    })
+    monkeypatch.setattr(enrichment, "apply_ticket_changes", fake_apply)
+    db = FakeEnrichmentDb(ticket)
+    workers = enrichment.EnrichmentWorkers()
+    workers._db = db
+    
+    await workers.process({"_id": ticket["_id"], "attempts": 1, "completed_steps": []})
+    
+    changes = applied[0]
+    assert changes["possible_duplicate_ids"] == ["t1"]
+    assert changes["location.coordinates"] == [14.77, 40.68]
+    assert changes["enrichment"]["status"] == "retrying"
+    assert changes["enrichment"]["errors"] == {"geocode": "geo service down"}
+    assert db.ticket_outbox.updates[0]["state"] == "pending"
+    assert db.ticket_outbox.updates[0]["completed_steps"] == ["municipality", "duplicates"]
+    
+    async def apply_crashes(db, ticket_id, changes, now):
+        raise TypeError("unexpected location")
+    
+    # An unexpected error backs the job off instead of ending the worker.
+    monkeypatch.setattr(enrichment, "apply_ticket_changes", apply_crashes)
+    await workers.run({"_id": ticket["_id"], "attempts": 1, "completed_steps": []})
+    assert db.ticket_outbox.updates[-1]["state"] == "pending"
+    assert db.ticket_outbox.updates[-1]["last_errors"] == {"process": "TypeError: unexpected location"}
+
+def test_rollup_deltas_move_counts_between_statuses():
+    municipality_id = ObjectId()
+    before = {"municipality_id": municipality_id, "status": "received", "category": "roads"}
+    
+    deltas = rollup_deltas(before, {**before, "status": "resolved"})
+    assert deltas["global"] == {"tickets.by_status.received": -1, "tickets.by_status.resolved": 1}
+    assert deltas[f"municipality:{municipality_id}"] == deltas["global"]
+    assert rollup_deltas(before, {**before, "title": "Renamed"}) == {}
+    assert rollup_deltas(None, {"status": "received", "category": "a.b"})["global"]["tickets.by_category.a_b"] == 1
+
+def test_kpi_deltas_count_flows_on_the_day_they_happen():
+    municipality_id = ObjectId()
+    created = {
+        "municipality_id": municipality_id,
+        "category": "roads",
+        "status": "received",
+        "created_at": datetime(2026, 3, 1, 23, 30),
+        "status_entered_at": datetime(2026, 3, 1, 23, 30)
+    }
+    assert kpi_deltas(None, created) == {
+        f"day|2026-03-01|{municipality_id}|roads": {"opened": 1, "entered.received": 1}
+    }
+    
+    resolved = {**created, "status": "resolved", "status_entered_at": datetime(2026, 3, 3, 9), "resolution_seconds": 7200}
+    bucket = kpi_deltas(created, resolved)[f"day|2026-03-03|{municipality_id}|roads"]
+    assert bucket["resolved"] == 1
+    assert bucket["resolution_seconds_sum"] == 7200
+    assert bucket[f"resolution_sketch.{sketch_bin(7200)}"] == 1
+    
+    responded = {**created, "first_response_at": datetime(2026, 3, 2, 8), "first_response_seconds": 30600}
+    bucket = kpi_deltas(created, responded)[f"day|2026-03-02|{municipality_id}|roads"]
+    assert bucket == {"responded": 1, "response_seconds_sum": 30600, f"response_sketch.{sketch_bin(30600)}": 1}
+    assert kpi_deltas(resolved, {**resolved, "title": "Renamed"}) == {}
+
+def test_satisfaction_aggregates_summarize_ratings():
+    operator_id, municipality_id = ObjectId(), ObjectId()
+    targets = satisfaction_targets({"assigned_operator_id": operator_id, "municipality_id": municipality_id, "category": "roads"})
+    assert set(targets) == {f"operator:{operator_id}", f"municipality:{municipality_id}", "category:roads"}
+    assert targets[f"operator:{operator_id}"]["municipality_id"] == municipality_id
+    
+    summary = satisfaction_summary({"count": 4, "sum": 15, "sum_squares": 59, "stars": {"3": 2, "4": 1, "5": 1}})
+    assert summary["mean"] == 3.75
+    assert summary["stddev"] == pytest.approx(0.829, abs=1e-3)
+    assert summary["stars"] == {"1": 0, "2": 0, "3": 2, "4": 1, "5": 1}
+    assert 3.0 < summary["score"] < summary["mean"]
+    
+    with pytest.raises(ValueError):
+        parse_rating(6)
+    with pytest.raises(ValueError):
+        parse_rating("5")
+
+class FakeFeedback:
+    def __init__(self, documents):
+        self.documents = documents
+    
+    def find(self, query):
+        return FakeCursor([
+            document for document in self.documents
+            if document["counted"] == query["counted"] and document["created_at"] < query["created_at"]["$lt"]
+        ])
+    
+    async def update_one(self, query, update):
+        for document in self.documents:
+            if document["_id"] == query["_id"]:
+                document.update(update["$set"])
+
+class FakeScores:
+    def __init__(self):
+        self.failing = False
+        self.counts = {}
+    
+    async def bulk_write(self, requests, ordered=True):
+        if self.failing:
+            raise OperationFailure("not primary")
+        for request in requests:
+            scope = request._filter["_id"]
+            self.counts[scope] = self.counts.get(scope, 0) + request._doc["$inc"]["count"]
+
+class FakeSatisfactionDb:
+    def __init__(self, feedback):
+        self.ticket_feedback = FakeFeedback(feedback)
+        self.satisfaction_scores = FakeScores()
+
+@pytest.mark.asyncio
+async def test_uncounted_feedback_is_recounted():
+    feedback = {
+        "_id": ObjectId(),
+        "rating": 4,
+        "category": "roads",
+        "counted": False,
+        "created_at": datetime.utcnow() - timedelta(hours=1)
+    }
+    db = FakeSatisfactionDb([feedback])
+    db.satisfaction_scores.failing = True
+    with pytest.raises(OperationFailure):
+        await count_feedback(db, feedback)
+    assert feedback["counted"] is False
+    
+    db.satisfaction_scores.failing = False
+    recounter = SatisfactionRecounter()
+    recounter._db = db
+    assert await recounter.recount() == 1
+    assert feedback["counted"] is True
+    assert db.satisfaction_scores.counts == {"category:roads": 1}
+    assert await recounter.recount() == 0
+
+def ticket_change(token: str, ticket_id: ObjectId) -> dict:
+    return {
+        "_id": {"_data": token},
+        "operationType": "update",
+        "documentKey": {"_id": ticket_id},
+        "fullDocument": {"_id": ticket_id},
+        "updateDescription": {"updatedFields": {"status": "in_progress"}}
+    }
+
+class FakeChangeStream:
+    def __init__(self, changes, error=None):
+        self.changes = list(changes)
+        self.error = error
+    
+    async def __aenter__(self):
+        if self.error:
+            raise self.error
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+    
+    async def try_next(self):
+        return self.changes.pop(0) if self.changes else None
+
+class FakeWatchDb:
+    def __init__(self, stream):
+        self.stream = stream
+        self.tickets = self
+    
+    def watch(self, pipeline=None, **kwargs):
+        return self.stream
+
+@pytest.mark.asyncio
+async def test_change_feed_catch_up_hands_over_to_shared_stream():
+    ticket_id = ObjectId()
+    feed = TicketChangeFeed()
+    feed._db = FakeWatchDb(FakeChangeStream([ticket_change("0002", ticket_id), ticket_change("0003", ticket_id)]))
+    # The shared stream has already seen 0003 and 0004 when the catch-up ends.
+    feed._publish(change_to_event(ticket_change("0003", ticket_id)))
+    feed._publish(change_to_event(ticket_change("0004", ticket_id)))
+    
+    subscription = feed.subscribe({}, last_event_id="0001")
+    await subscription.task
+    feed._publish(change_to_event(ticket_change("0005", ticket_id)))
+    
+    delivered = [subscription.queue.get_nowait()["id"] for _ in range(subscription.queue.qsize())]
+    assert delivered == ["0002", "0003", "0004", "0005"]
+    assert subscription in feed._subscribers and feed._catch_ups == 0
+
+@pytest.mark.asyncio
+async def test_change_feed_unresumable_token_resets_and_follows_live(monkeypatch):
+    ticket_id = ObjectId()
+    feed = TicketChangeFeed()
+    feed._db = FakeWatchDb(FakeChangeStream([], error=OperationFailure("history lost", code=286)))
+    feed._publish(change_to_event(ticket_change("0009", ticket_id)))
+    
+    lost = feed.subscribe({}, last_event_id="0001")
+    await lost.task
+    assert lost.queue.get_nowait() == {"id": "0009", "operation": "reset"}
+    assert not lost.closed and lost in feed._subscribers
+    
+    monkeypatch.setattr("src.services.change_feed.settings.CHANGE_FEED_MAX_CATCH_UPS", 0)
+    capped = feed.subscribe({}, last_event_id="0001")
+    assert capped.task is None and capped.queue.get_nowait()["operation"] == "reset"